@@ -1,35 +1,93 @@
-import subprocess
 import os
+import sys
+import argparse
 
 # 获取当前脚本的绝对路径，并定位到 scripts 目录
 script_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "script")
-common_folder = os.path.join(os.getcwd(), "data")
-
-print(f"📁 公共文件路径已设置为: {common_folder}\n")
-
-# 确保 data 目录存在
-os.makedirs(common_folder, exist_ok=True)
-
-# 定义要执行的子程序列表
-subprograms = [
-    "020 Email download.py",
-    "021 Merge excel.py",
-    "030 Warehousing at home.py",
-    "032 Warehousing at out.py",
-    "033 list insertion.py",
-    "041 operation.py",
-    "042 Color display.py",
-    "050 mailtxt.py",
-    "051 Send an email.py"
-]
-
-# 依次执行子程序
-for script in subprograms:
-    script_path = os.path.join(script_dir, script)
-    print(f"🚀 正在运行 {script} ...")
-    result = subprocess.run(["python", script_path, common_folder], capture_output=True, text=True)
-    print(result.stdout)
-    if result.stderr:
-        print(f"⚠️ {script} 执行出错: {result.stderr}")
-
-print("\n🎉 全部子程序执行完成！")
+sys.path.insert(0, script_dir)
+
+from pipeline import run_pipeline, print_summary, DEFAULT_STAGES  # noqa: E402
+from workbook_session import WorkbookSession  # noqa: E402
+from scheduler import run_scheduled  # noqa: E402
+from stage_cache import StageCache  # noqa: E402
+import tracer  # noqa: E402
+import stage_log  # noqa: E402
+
+# 要执行的子程序列表：与 lazy_import --check 共用 pipeline.DEFAULT_STAGES
+subprograms = DEFAULT_STAGES
+
+
+def main():
+    parser = argparse.ArgumentParser(description="美的仓储自动化主程序")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("PIPELINE_WORKERS", "1")),
+                        help="并行进程数；>1 时按阶段依赖图并行执行（任一阶段失败立即停止；不使用阶段缓存）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不使用阶段缓存，所有阶段都重新计算（缓存目录见 STAGE_CACHE_DIR；"
+                             "阶段缓存只在串行模式 --workers 1 下使用）")
+    parser.add_argument("--trace", nargs="?", const="1", default=None, metavar="PATH",
+                        help="输出 Chrome trace-event 格式的耗时追踪（默认 data/trace.json；也可设 PIPELINE_TRACE）")
+    parser.add_argument("--log-level", default=None, choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="日志级别（默认 INFO；DEBUG 时打印逐行明细；也可设 LOG_LEVEL）")
+    parser.add_argument("--tenants", default=None, metavar="JSON",
+                        help="多租户配置文件：各租户在独立目录 data/tenants/<名称>/ 中并发运行（示例见 tenants.example.json）")
+    parser.add_argument("--tenant-workers", type=int, default=None,
+                        help="多租户并发进程数（默认 CPU 核数与租户数的较小值）")
+    parser.add_argument("--daemon", action="store_true",
+                        help="常驻模式：IMAP IDLE 监听，命中关键词的邮件到达后运行一次主程序（见 script/imap_idle.py）")
+    parser.add_argument("--replay", default=None, metavar="YYYY-MM-DD",
+                        help="补跑 / 重跑某天：邮件从本地邮件库读取，不连邮箱（见 script/mail_store.py）")
+    args = parser.parse_args()
+    if args.log_level:
+        stage_log.set_level(args.log_level)
+    if args.daemon:
+        from imap_idle import serve_daemon
+        serve_daemon([a for a in sys.argv[1:] if a != "--daemon"])
+        return
+    if args.trace:
+        tracer.enable(args.trace)
+
+    common_folder = os.path.join(os.getcwd(), "data")
+
+    print(f"📁 公共文件路径已设置为: {common_folder}\n")
+
+    # 确保 data 目录存在
+    os.makedirs(common_folder, exist_ok=True)
+
+    if args.tenants:
+        # 多租户：共享一次邮箱抓取，各租户在进程池中并发运行整条流水线
+        from tenants import load_profiles, run_tenants, print_tenant_summary
+        all_results = run_tenants(load_profiles(args.tenants), subprograms, common_folder,
+                                  workers=args.tenant_workers, use_cache=not args.no_cache,
+                                  replay_date=args.replay)
+        print_tenant_summary(all_results)
+        trace_file = tracer.trace_path(common_folder)
+        if trace_file:
+            tracer.save(trace_file)
+        print("\n🎉 全部租户执行完成！")
+        return
+
+    # “总库存”由工作簿会话共用：各阶段只在内存中修改，整次运行只加载/保存一次
+    context = {"data_dir": common_folder, "workbook_session": WorkbookSession(common_folder)}
+    if args.replay:
+        context["replay_date"] = args.replay
+    if args.workers > 1:
+        # 按依赖图并行执行互不依赖的阶段；缓存键按阶段顺序串联，并行模式不读写阶段缓存
+        if not args.no_cache:
+            print("ℹ️ 并行模式（--workers > 1）不使用阶段缓存；需要缓存时用 --workers 1\n")
+        results = run_scheduled(subprograms, context, workers=args.workers)
+    else:
+        # 在同一进程内依次执行子程序（出错的阶段打印错误后继续，与原行为一致）
+        # 邮件与上次相同时，后续阶段直接从阶段缓存恢复输出
+        cache = None if args.no_cache else StageCache()
+        results = run_pipeline(subprograms, context, cache=cache)
+    print_summary(results)
+
+    trace_file = tracer.trace_path(common_folder)
+    if trace_file:
+        tracer.save(trace_file)
+
+    print("\n🎉 全部子程序执行完成！")
+
+
+if __name__ == "__main__":
+    main()
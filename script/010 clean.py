@@ -6,17 +6,30 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 # 要删除的文件名中包含的关键字
 keywords = ["总库存", "美的仓储自动化", "合肥市","存量查询","output.html","mail_meta","last_mail_html"]
 
-# 遍历目录及其子目录中的所有文件
-for root, dirs, files in os.walk(script_dir):
-    for filename in files:
-        file_path = os.path.join(root, filename)
-
-        # 检查文件名是否包含任意关键字
-        if any(keyword in filename for keyword in keywords):
-            try:
-                os.remove(file_path)
-                print(f"✅ 删除文件: {file_path}")
-            except Exception as e:
-                print(f"❌ 删除文件 {file_path} 失败: {e}")
-
-print("\n处理完成！")
+# 删除文件是副作用，不走阶段缓存
+CACHEABLE = False
+
+
+def run(context: dict) -> dict:
+    removed = []
+
+    # 遍历目录及其子目录中的所有文件
+    for root, dirs, files in os.walk(script_dir):
+        for filename in files:
+            file_path = os.path.join(root, filename)
+
+            # 检查文件名是否包含任意关键字
+            if any(keyword in filename for keyword in keywords):
+                try:
+                    os.remove(file_path)
+                    removed.append(file_path)
+                    print(f"✅ 删除文件: {file_path}")
+                except Exception as e:
+                    print(f"❌ 删除文件 {file_path} 失败: {e}")
+
+    print("\n处理完成！")
+    return {"removed": removed}
+
+
+if __name__ == "__main__":
+    run({})
@@ -7,21 +7,42 @@
 import os
 import sys
 import re
+import math
+import queue
 import platform
 import json
+import base64
+import quopri
+import shutil
+import binascii
+import hashlib
+import tempfile
 import email
 import imaplib
+import threading
 from email.header import decode_header
 from email.utils import parsedate_tz, mktime_tz
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo  # Python 3.9+
 
-import pandas as pd
 import openpyxl
-from bs4 import BeautifulSoup
-from openpyxl.styles import Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, NamedStyle
 from dotenv import load_dotenv
 
+import html_table
+import imap_compress
+import attachment_store
+from tracer import span
+from lazy_import import lazy_import
+from stage_log import get_logger
+
+log = get_logger(__file__)
+
+# 只有拿到邮件正文后才用得到
+pd = lazy_import("pandas")
+
 # ================================
 # 🕒 时区工具（统一北京时间）
 # ================================
@@ -41,9 +62,6 @@ if platform.system() == "Windows":
 else:
     default_save_path = os.path.expanduser("~/data")
 
-excel_save_path = sys.argv[1] if len(sys.argv) >= 2 else default_save_path
-os.makedirs(excel_save_path, exist_ok=True)
-print(f"📂 保存路径: {os.path.abspath(excel_save_path)}")
 
 # ================================
 # 🔧 关键词/邮箱配置（集中管理）
@@ -55,19 +73,71 @@ KEYWORDS = {
 MAILBOX = os.getenv("IMAP_MAILBOX", "INBOX")
 RECENT_LIMIT = int(os.getenv("RECENT_LIMIT", "15"))
 META_FILENAME = "mail_meta.json"
+# 正文中的多个表格按表头归类：表头相同的合并（存量查询被拆成几张表），其余（汇总表等）各成一个附表
+MAIN_TABLE_COLUMNS = ("存货编码",)  # 表头含这些列的表格为存量查询主表（写入“第一页”）
+SAVE_EXTRA_TABLES = os.getenv("SAVE_EXTRA_TABLES", "1") != "0"  # 汇总表等其他表格写入同一文件的附表工作表
+DECIMAL_COLUMNS = (4, 5)  # 第5/6列（0-based）：多数行是数字时写成 #,##0.00
+DECIMAL_STYLE_NAME = "存量数值"
+
+# 服务器端检索：按 SINCE/SUBJECT/FROM 缩小候选 → 只取候选的头部 → 只下载每个关键词最新一封的完整邮件
+# IMAP_FAST_SELECT=0 时退回旧方式（取最近 RECENT_LIMIT 封完整邮件）
+FAST_SELECT = os.getenv("IMAP_FAST_SELECT", "1") != "0"
+SEARCH_SINCE_DAYS = int(os.getenv("IMAP_SEARCH_SINCE_DAYS", "7"))
+SEARCH_FROM = os.getenv("IMAP_SEARCH_FROM", "")  # 可选：只看某个发件人
+SEARCH_MAX_CANDIDATES = int(os.getenv("IMAP_SEARCH_MAX_CANDIDATES", "200"))  # 只取最新的这么多封的头部
+HEADER_FIELDS = "(SUBJECT FROM DATE MESSAGE-ID)"
+# 批量下载：一条 UID FETCH 取多封（按 RFC822.SIZE 分块），而不是每封一次往返
+FETCH_CHUNK_BYTES = int(os.getenv("IMAP_FETCH_CHUNK_BYTES", str(16 * 1024 * 1024)))  # 每条 FETCH 的字节上限
+FETCH_CHUNK_MESSAGES = int(os.getenv("IMAP_FETCH_CHUNK_MESSAGES", "50"))
+FETCH_PIPELINE = int(os.getenv("IMAP_FETCH_PIPELINE", "1"))  # >1 时连发多条 FETCH 再统一等响应（流水线）
+# 大邮件分段下载：按 BODYSTRUCTURE 只取正文和需要的表格附件，附件按块边下载边解码写入暂存目录
+PARTIAL_FETCH = os.getenv("IMAP_PARTIAL_FETCH", "1") != "0"
+PARTIAL_MIN_BYTES = int(os.getenv("IMAP_PARTIAL_MIN_BYTES", str(1024 * 1024)))  # 小于此大小的邮件仍整封下载（少几次往返）
+PARTIAL_CHUNK_BYTES = int(os.getenv("IMAP_PARTIAL_CHUNK_BYTES", str(1024 * 1024)))  # 每次 BODY.PEEK[n]<起点.长度> 的长度
+ATTACHMENT_EXTS = (".xlsx", ".xls", ".csv")
+SPOOL_DIR = os.getenv("ATTACHMENT_SPOOL_DIR") or attachment_store.BLOB_DIR  # 默认直接写进附件库（见 attachment_store.py）
+SPOOL_RETENTION_DAYS = int(os.getenv("MAIL_STORE_RETENTION_DAYS", "90"))  # 只用于单独的暂存目录；附件库由它自己的保留期清理
+SPOOL_HEADER = "X-Meidi-Spool"  # 分段下载的邮件中，附件部分只留头部 + 此字段（暂存文件的 SHA-256）
+SYNC_STATE_FILENAME = "mail_sync_state.json"  # UID 增量同步状态：UIDVALIDITY + 已处理的最大 UID + 上次选中的邮件
+# 流水线：IMAP 线程逐封下载，主线程拿到一封就在线程池中落盘附件、解析表格；主表的行经有界队列边解析边写 Excel
+# INGEST_PIPELINE=0 时按顺序执行（全部下载完 → 选取 → 解析 → 写 Excel）
+INGEST_PIPELINE = os.getenv("INGEST_PIPELINE", "1") != "0"
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))  # 已下载、待处理的邮件数上限
+ROW_QUEUE_BATCHES = int(os.getenv("ROW_QUEUE_BATCHES", "16"))  # 解析 → 写 Excel 的队列上限（批）
+ROW_BATCH = 1000  # 每批行数
+# 本地原始邮件库（见 mail_store.py）：下载过的邮件先查本地；重跑 / 补跑（context["replay_date"]）不连邮箱
+
+# 阶段依赖声明（见 scheduler.py）
+INPUTS = ["mail:inbox"]
+OUTPUTS = ["file:*.xlsx", "file:*.xls", "file:*.csv", "file:mail_meta.json", "file:last_mail_html.html"]
+
+# 要连邮箱，不走阶段缓存；返回的 fingerprint（邮件 Message-ID + 附件摘要）作为下游缓存键的起点
+CACHEABLE = False
 
 # ================================
 # 📧 邮箱凭据（.env）
 # ================================
-load_dotenv()
-email_user = os.getenv("EMAIL_ADDRESS_QQ")
-email_password = os.getenv("EMAIL_PASSWORD_QQ") or os.getenv("EMAIL_PASSWOR_QQ")
-email_server = os.getenv("IMAP_SERVER", "imap.qq.com")
-
-if not email_user or not email_password:
-    raise ValueError("❌ 环境变量未正确配置（EMAIL_ADDRESS_QQ / EMAIL_PASSWORD_QQ）！")
-
-print("📬 正在使用邮箱:", email_user)
+def load_credentials() -> tuple[str, str, str]:
+    load_dotenv()
+    email_user = os.getenv("EMAIL_ADDRESS_QQ")
+    email_password = os.getenv("EMAIL_PASSWORD_QQ") or os.getenv("EMAIL_PASSWOR_QQ")
+    email_server = os.getenv("IMAP_SERVER", "imap.qq.com")
+
+    if not email_user or not email_password:
+        raise ValueError("❌ 环境变量未正确配置（EMAIL_ADDRESS_QQ / EMAIL_PASSWORD_QQ）！")
+
+    print("📬 正在使用邮箱:", email_user)
+    return email_user, email_password, email_server
+
+def connect_imap(server: str) -> imaplib.IMAP4:
+    """
+    IMAP_SSL=0 时走明文（本地替身服务器，见 imap_standin.py）；IMAP_PORT 为空时用默认端口。
+    连接支持 COMPRESS=DEFLATE（登录后由 open_mailbox 协商，见 imap_compress.py），并统计线上 / 解码后字节数。
+    """
+    port = int(os.getenv("IMAP_PORT") or 0)
+    if os.getenv("IMAP_SSL", "1") == "0":
+        return imap_compress.CompressIMAP4(server, port or imaplib.IMAP4_PORT)
+    return imap_compress.CompressIMAP4_SSL(server, port or imaplib.IMAP4_SSL_PORT)
 
 # ================================
 # 🔑 标题解码与清理
@@ -88,67 +158,720 @@ def clean_subject(subject: str) -> str:
     return cleaned_subject.strip()
 
 # ================================
-# 📨 抓取邮件并输出 HTML/元数据/附件
+# 📨 抓取邮件（原始字节），多租户时由主进程抓取一次后共享给各租户
 # ================================
-def fetch_html_from_emails(server: str, user: str, password: str, save_dir: str) -> str | None:
-    mail = None
-    html_content = None
+def _imap_mailbox_name(name: str) -> str:
+    """文件夹名按 RFC 3501 修改版 UTF-7 编码（中文文件夹），含空格等特殊字符时加引号"""
+    out, pending = [], []
+
+    def flush():
+        if pending:
+            b64 = base64.b64encode("".join(pending).encode("utf-16-be")).decode("ascii")
+            out.append("&" + b64.rstrip("=").replace("/", ",") + "-")
+            pending.clear()
+
+    for ch in name:
+        if 0x20 <= ord(ch) <= 0x7E:
+            flush()
+            out.append("&-" if ch == "&" else ch)
+        else:
+            pending.append(ch)
+    flush()
+    encoded = "".join(out)
+    if re.search(r'[\s"(){%*\\]', encoded):
+        encoded = '"' + encoded.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return encoded
+
+def open_mailbox(server: str, user: str, password: str, mailbox: str | None = None) -> imaplib.IMAP4:
+    """登录并选择文件夹；未指定 mailbox 时用 MAILBOX（选择失败退回 INBOX），指定的文件夹选择失败时报错"""
+    print(f"🔗 正在连接邮箱{f' {user} / {mailbox}' if mailbox else ''}...")
+    mail = connect_imap(server)
+    mail.login(user, password)
+    if imap_compress.start_compression(mail):
+        log.debug("IMAP 已启用 COMPRESS=DEFLATE")
+
+    status, _ = mail.select(_imap_mailbox_name(mailbox or MAILBOX))
+    if status != "OK":
+        if mailbox:
+            _logout(mail)
+            raise imaplib.IMAP4.error(f"无法选择邮箱目录 {mailbox}")
+        print(f"⚠️ 无法选择邮箱目录 {MAILBOX}，尝试使用 INBOX")
+        mail.select("INBOX")
+    return mail
+
+def open_store():
+    """本地原始邮件库；MAIL_STORE=0 或打不开时返回 None（照常从邮箱下载）"""
+    import mail_store
+    if not mail_store.enabled():
+        return None
+    try:
+        return mail_store.MailStore()
+    except Exception as e:
+        print(f"⚠️ 本地邮件库不可用，直接从邮箱下载: {e}")
+        return None
 
-    meta = {
-        "selected_heyu_da_subject": None,
-        "selected_heyu_da_received_at": None,  # ISO8601（带+08:00）
-        "selected_waiting_subject": None,
-        "selected_waiting_received_at": None,  # ISO8601（带+08:00）
-    }
+def _close_store(store) -> None:
+    if store is not None:
+        store.close()
 
+def _logout(mail) -> None:
     try:
-        print("🔗 正在连接邮箱...")
-        mail = imaplib.IMAP4_SSL(server)
-        mail.login(user, password)
+        if mail is not None:
+            mail.logout()
+    except Exception:
+        pass
+    traffic = imap_compress.describe(mail)
+    if traffic:
+        print(traffic)
 
-        status, _ = mail.select(MAILBOX)
-        if status != "OK":
-            print(f"⚠️ 无法选择邮箱目录 {MAILBOX}，尝试使用 INBOX")
-            mail.select("INBOX")
+def fetch_recent_messages(server: str, user: str, password: str,
+                          limit: int = RECENT_LIMIT, mailbox: str | None = None) -> list[tuple[bytes, bytes]] | None:
+    """登录并抓取最近 limit 封邮件（批量 UID FETCH），返回 [(UID, 原始字节)]；出错时返回 None"""
+    mail = None
+    try:
+        mail = open_mailbox(server, user, password, mailbox)
 
-        print(f"🔎 正在检索最近 {RECENT_LIMIT} 封邮件...")
-        status, messages = mail.search(None, "ALL")
+        print(f"🔎 正在检索最近 {limit} 封邮件...")
+        status, messages = mail.uid("SEARCH", "ALL")
         if status != "OK":
             print("未找到邮件")
             return None
 
-        mail_ids = messages[0].split()
+        mail_ids = [int(n) for n in messages[0].split()]
         if not mail_ids:
             print("邮箱为空。")
             return None
 
-        recent_mail_ids = mail_ids[-RECENT_LIMIT:]
+        recent_mail_ids = mail_ids[-limit:]
         print(f"📨 共 {len(mail_ids)} 封，处理最近 {len(recent_mail_ids)} 封。")
+        return fetch_full(mail, recent_mail_ids)
 
-        inventory_query_emails = []
+    except imaplib.IMAP4.error as e:
+        print(f"IMAP 错误: {e}")
+        return None
+    except Exception as e:
+        print(f"获取邮件失败: {e}")
+        return None
+    finally:
+        _logout(mail)
+
+# ================================
+# ⚡ 服务器端检索 + 只取头部（全部用 UID，序号会随删除变化）
+# ================================
+_IMAP_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+_UID_RE = re.compile(rb"UID (\d+)")
+_SIZE_RE = re.compile(rb"RFC822\.SIZE (\d+)")
+
+def _imap_date(d) -> str:
+    """IMAP 日期格式 19-Sep-2025（月份固定英文，不受 locale 影响）"""
+    return f"{d.day:02d}-{_IMAP_MONTHS[d.month - 1]}-{d.year}"
+
+def _compact_seqset(ids: list[int]) -> str:
+    """[1,2,3,7,9,10] -> '1:3,7,9:10'"""
+    parts, start, prev = [], None, None
+    for n in sorted(ids):
+        if start is None:
+            start = prev = n
+        elif n == prev + 1:
+            prev = n
+        else:
+            parts.append(f"{start}:{prev}" if prev != start else str(start))
+            start = prev = n
+    if start is not None:
+        parts.append(f"{start}:{prev}" if prev != start else str(start))
+    return ",".join(parts)
+
+def search_candidates(mail: imaplib.IMAP4, keywords: list[str]) -> list[int]:
+    """服务器端按 SINCE (+FROM) + SUBJECT 检索，返回候选 UID（升序，最多 SEARCH_MAX_CANDIDATES 封）"""
+    since = _imap_date(now_shanghai().date() - timedelta(days=SEARCH_SINCE_DAYS))
+    base = ["SINCE", since] + (["FROM", f'"{SEARCH_FROM}"'] if SEARCH_FROM else [])
+    uids = set()
+    try:
+        for keyword in keywords:
+            # 中文主题要用 CHARSET UTF-8 + 字面量；SUBJECT 必须是最后一个条件（imaplib 把字面量附在命令末尾）
+            mail.literal = keyword.encode("utf-8")
+            status, data = mail.uid("SEARCH", "CHARSET", "UTF-8", *base, "SUBJECT")
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"SEARCH {status}")
+            uids.update(int(n) for n in data[0].split())
+        print(f"🔎 服务器端检索（近 {SEARCH_SINCE_DAYS} 天，按主题）: {len(uids)} 封候选")
+    except imaplib.IMAP4.abort:
+        raise
+    except imaplib.IMAP4.error as e:
+        # 不支持 CHARSET / 中文检索的服务器：只按日期缩小范围，主题在头部里过滤
+        mail.literal = None
+        print(f"⚠️ 服务器不支持按主题检索（{e}），改为只按日期检索")
+        status, data = mail.uid("SEARCH", *base)
+        if status != "OK":
+            return []
+        uids = {int(n) for n in data[0].split()}
+        print(f"🔎 服务器端检索（近 {SEARCH_SINCE_DAYS} 天）: {len(uids)} 封候选")
+    return sorted(uids)[-SEARCH_MAX_CANDIDATES:]
+
+def search_new_uids(mail: imaplib.IMAP4, last_uid: int) -> list[int]:
+    """增量同步：一次 UID SEARCH 取回 UID > last_uid 的邮件"""
+    status, data = mail.uid("SEARCH", "UID", f"{last_uid + 1}:*")
+    if status != "OK":
+        return []
+    # “n:*” 在没有新邮件时也会返回当前最大的 UID，需要再过滤一次
+    return sorted(u for u in (int(n) for n in data[0].split()) if u > last_uid)
 
-        for i, mail_id in enumerate(recent_mail_ids, start=1):
-            status, msg_data = mail.fetch(mail_id, "(RFC822)")
-            if status != "OK" or not msg_data or not msg_data[0]:
-                print(f"⚠️ 第 {i} 封抓取失败")
+def fetch_headers(mail: imaplib.IMAP4, uids: list[int]) -> list[dict]:
+    """一次 UID FETCH 取回候选的 Subject/From/Date/Message-ID（BODY.PEEK：不标记已读，不下载正文）"""
+    if not uids:
+        return []
+    items = []
+    with span("imap_fetch_headers", messages=len(uids)) as trace_args:
+        status, data = mail.uid("FETCH", _compact_seqset(uids),
+                                f"(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS {HEADER_FIELDS}])")
+        if status != "OK":
+            return []
+        header_bytes = 0
+        for meta, header in _iter_fetch_parts(data):
+            m = _UID_RE.search(meta)
+            if not m:
                 continue
+            header_bytes += len(header)
+            msg = email.message_from_bytes(header)
+            subject = decode_str(msg.get("Subject"))
+            size = _SIZE_RE.search(meta)
+            items.append({
+                "uid": int(m.group(1)),
+                "subject": subject,
+                "cleaned_subject": clean_subject(subject),
+                "date": _mail_datetime(msg),
+                "message_id": (msg.get("Message-ID") or "").strip(),
+                "size": int(size.group(1)) if size else 0,
+            })
+        trace_args["bytes"] = header_bytes
+    return items
+
+# ================================
+# 📦 批量 UID FETCH（按大小分块，可选流水线）
+# ================================
+def _iter_fetch_parts(data: list):
+    """
+    逐封解析 FETCH 多响应结果，产出 (响应中字面量以外的部分, 字面量)。
+    imaplib 把每封邮件拆成 (b'3 (UID 103 RFC822 {n}', 字面量) 元组和随后的 b')' / b' UID 103)'，
+    UID、RFC822.SIZE 可能出现在字面量前后任一侧。
+    """
+    pending = None
+    for part in data:
+        if isinstance(part, tuple):
+            if pending is not None:
+                yield pending
+            pending = part
+        elif pending is not None:
+            yield pending[0] + (part or b""), pending[1]
+            pending = None
+    if pending is not None:
+        yield pending
+
+def fetch_sizes(mail: imaplib.IMAP4, uids: list[int]) -> dict[int, int]:
+    """一次 UID FETCH 取回各邮件的 RFC822.SIZE（不下载内容）"""
+    status, data = mail.uid("FETCH", _compact_seqset(uids), "(UID RFC822.SIZE)")
+    sizes = {}
+    if status != "OK":
+        return sizes
+    for line in data:
+        if isinstance(line, bytes):
+            uid, size = _UID_RE.search(line), _SIZE_RE.search(line)
+            if uid and size:
+                sizes[int(uid.group(1))] = int(size.group(1))
+    return sizes
+
+def _size_chunks(uids: list[int], sizes: dict[int, int]) -> list[list[int]]:
+    """按 FETCH_CHUNK_BYTES / FETCH_CHUNK_MESSAGES 分块；单封超过上限的自成一块"""
+    chunks, current, current_bytes = [], [], 0
+    for uid in sorted(uids):
+        size = sizes.get(uid, 0)
+        if current and (current_bytes + size > FETCH_CHUNK_BYTES or len(current) >= FETCH_CHUNK_MESSAGES):
+            chunks.append(current)
+            current, current_bytes = [], 0
+        current.append(uid)
+        current_bytes += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _uid_fetch_pipelined(mail: imaplib.IMAP4, seqsets: list[str], items: str) -> list:
+    """
+    每轮连发最多 FETCH_PIPELINE 条 UID FETCH，再按标签依次等待完成（imaplib 按标签分拣响应），
+    返回合并后的 FETCH 响应数据。FETCH_PIPELINE=1 时与 mail.uid("FETCH", …) 相同。
+    """
+    data = []
+    depth = max(1, FETCH_PIPELINE)
+    for i in range(0, len(seqsets), depth):
+        tags = [mail._command("UID", "FETCH", seqset, items) for seqset in seqsets[i:i + depth]]
+        for tag in tags:
+            status, _ = mail._command_complete("UID", tag)
+            if status != "OK":
+                print(f"⚠️ UID FETCH 返回 {status}")
+        _, fetched = mail._untagged_response("OK", [None], "FETCH")
+        data += [part for part in fetched if part is not None]
+    return data
+
+def fetch_full(mail: imaplib.IMAP4, uids: list[int],
+               sizes: dict[int, int] | None = None) -> list[tuple[bytes, bytes]]:
+    """
+    按 UID 下载完整邮件，返回 [(UID, 原始字节)]（按 UID 升序）；已不存在的 UID 不在结果中。
+    多封时合并为少数几条 UID FETCH：sizes 未给出时先取一次 RFC822.SIZE，按大小分块。
+    """
+    if not uids:
+        return []
+    uids = sorted(set(uids))
+    with span("imap_fetch", messages=len(uids)) as trace_args:
+        if sizes is None and len(uids) > 1:
+            sizes = fetch_sizes(mail, uids)
+        chunks = _size_chunks(uids, sizes or {})
+        data = _uid_fetch_pipelined(mail, [_compact_seqset(c) for c in chunks], "(UID RFC822)")
+
+        wanted = set(uids)
+        fetched = {}
+        for meta, raw in _iter_fetch_parts(data):
+            m = _UID_RE.search(meta)
+            if m and int(m.group(1)) in wanted:
+                fetched[int(m.group(1))] = raw
+        for uid in sorted(wanted - set(fetched)):
+            print(f"⚠️ UID {uid} 抓取失败")
+        trace_args["bytes"] = sum(len(raw) for raw in fetched.values())
+        trace_args["commands"] = len(chunks)
+    return [(str(uid).encode(), fetched[uid]) for uid in sorted(fetched)]
 
-            raw_email = msg_data[0][1]
+# ================================
+# 📎 分段下载（BODYSTRUCTURE + BODY.PEEK[n]<起点.长度>）
+# ================================
+_BS_TOKEN_RE = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|\{\d+\}$|[^\s()"]+')
+_SECTION_RE = re.compile(rb"BODY\[([^\]]*)\](?:<\d+>)? \{\d+\}$")
+
+class _Literal(bytes):
+    """BODYSTRUCTURE 中以 {n} 字面量给出的字符串（非 ASCII 文件名等）"""
+
+def _bodystructure_tokens(data: list) -> list:
+    tokens = []
+    for part in data:
+        head, literal = part if isinstance(part, tuple) else (part, None)
+        tokens += [t for t in _BS_TOKEN_RE.findall(head or b"") if not t.startswith(b"{")]
+        if literal is not None:
+            tokens.append(_Literal(literal))
+    return tokens
+
+def _parse_sexp(tokens: list, i: int):
+    """IMAP 括号表达式 → 嵌套 list；字符串为 str，NIL 为 None"""
+    token = tokens[i]
+    if token == b"(":
+        items, i = [], i + 1
+        while tokens[i] != b")":
+            item, i = _parse_sexp(tokens, i)
+            items.append(item)
+        return items, i + 1
+    if isinstance(token, _Literal):
+        return token.decode("utf-8", "replace"), i + 1
+    if token.startswith(b'"'):
+        return re.sub(rb"\\(.)", rb"\1", token[1:-1]).decode("utf-8", "replace"), i + 1
+    return (None if token.upper() == b"NIL" else token.decode("ascii", "replace")), i + 1
+
+def _params(value) -> dict:
+    if not isinstance(value, list):
+        return {}
+    return {str(value[k]).lower(): value[k + 1] for k in range(0, len(value) - 1, 2)}
+
+def _body_node(sexp: list, section: str) -> dict:
+    """BODYSTRUCTURE → {section, type, params, encoding, size, disposition, children}"""
+    if isinstance(sexp[0], list):
+        n = next(k for k, item in enumerate(sexp) if not isinstance(item, list))
+        children = [_body_node(child, f"{section}.{k}" if section else str(k))
+                    for k, child in enumerate(sexp[:n], start=1)]
+        return {"section": section, "type": f"multipart/{str(sexp[n]).lower()}",
+                "params": _params(sexp[n + 1] if len(sexp) > n + 1 else None), "children": children}
+    content_type = f"{sexp[0]}/{sexp[1]}".lower()
+    dsp_index = 9 if content_type.startswith("text/") else 8
+    dsp = sexp[dsp_index] if len(sexp) > dsp_index and content_type != "message/rfc822" else None
+    return {"section": section or "1", "type": content_type, "params": _params(sexp[2]),
+            "encoding": str(sexp[5] or "7bit").lower(), "size": int(sexp[6] or 0),
+            "disposition": str(dsp[0]).lower() if isinstance(dsp, list) and dsp else None,
+            "children": []}
+
+def fetch_bodystructure(mail: imaplib.IMAP4, uid: int) -> dict | None:
+    status, data = mail.uid("FETCH", str(uid), "(UID BODYSTRUCTURE)")
+    if status != "OK" or not data or data[0] is None:
+        return None
+    tokens = _bodystructure_tokens(data)
+    start = next((k + 1 for k, t in enumerate(tokens) if t.upper() == b"BODYSTRUCTURE"), None)
+    if start is None:
+        return None
+    return _body_node(_parse_sexp(tokens, start)[0], "")
+
+def _leaves(node: dict) -> list[dict]:
+    if not node["children"]:
+        return [node]
+    return [leaf for child in node["children"] for leaf in _leaves(child)]
+
+def _walk_nodes(node: dict) -> list[dict]:
+    return [node] + [n for child in node["children"] for n in _walk_nodes(child)]
+
+def _is_attachment(leaf: dict) -> bool:
+    return leaf["disposition"] == "attachment" or "name" in leaf["params"] or not leaf["type"].startswith("text/")
+
+def _wanted_attachment(mime_headers: bytes) -> bool:
+    """按附件部分自己的 MIME 头判断是否为需要的表格（xlsx / xls / csv）"""
+    part = email.message_from_bytes(mime_headers)
+    name = "".join(p.decode(enc or "utf-8", errors="ignore") if isinstance(p, bytes) else p
+                   for p, enc in decode_header(part.get_filename() or ""))
+    if name:
+        return os.path.splitext(name.strip().lower())[1] in ATTACHMENT_EXTS
+    return part.get_content_type() in ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                       "application/vnd.ms-excel", "text/csv")
+
+def _fetch_sections(mail: imaplib.IMAP4, uid: int, items: list[str]) -> dict[str, bytes]:
+    """一条 UID FETCH 取多个 BODY.PEEK[…]，返回 {section: 字节}"""
+    status, data = mail.uid("FETCH", str(uid), "(UID " + " ".join(items) + ")")
+    sections = {}
+    if status != "OK":
+        return sections
+    for part in data:
+        if isinstance(part, tuple):
+            m = _SECTION_RE.search(part[0])
+            if m:
+                sections[m.group(1).decode("ascii").upper()] = part[1]
+    return sections
+
+def _stream_to_spool(mail: imaplib.IMAP4, uid: int, leaf: dict) -> tuple[str, int]:
+    """按 PARTIAL_CHUNK_BYTES 分段取附件，边解码边写入暂存目录；返回 (SHA-256, 解码后字节数)"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    offset, written, leftover = 0, 0, b""
+    encoding = leaf["encoding"]
+    with tempfile.NamedTemporaryFile(dir=SPOOL_DIR, suffix=".part", delete=False) as out:
+        try:
+            while True:
+                sections = _fetch_sections(mail, uid, [f"BODY.PEEK[{leaf['section']}]<{offset}.{PARTIAL_CHUNK_BYTES}>"])
+                chunk = sections.get(leaf["section"], b"")
+                offset += len(chunk)
+                last = len(chunk) < PARTIAL_CHUNK_BYTES
+                if encoding == "base64":
+                    buf = leftover + chunk.translate(None, b" \t\r\n")
+                    cut = len(buf) if last else len(buf) // 4 * 4
+                    decoded, leftover = binascii.a2b_base64(buf[:cut]), buf[cut:]
+                elif encoding == "quoted-printable":
+                    # 软换行 “=\r\n” 可能被块边界切开：只解码到最后一个完整行
+                    buf = leftover + chunk
+                    cut = len(buf) if last else buf.rfind(b"\n") + 1
+                    decoded, leftover = quopri.decodestring(buf[:cut]), buf[cut:]
+                else:
+                    decoded = chunk
+                out.write(decoded)
+                digest.update(decoded)
+                written += len(decoded)
+                if last:
+                    break
+        except BaseException:
+            out.close()
+            os.remove(out.name)
+            raise
+    sha = digest.hexdigest()
+    os.chmod(out.name, attachment_store.FILE_MODE)  # 暂存文件就是附件库的 blob，会被硬链接到 data/
+    os.replace(out.name, os.path.join(SPOOL_DIR, sha))
+    return sha, offset
+
+def _prune_spool() -> None:
+    if SPOOL_RETENTION_DAYS <= 0 or not os.path.isdir(SPOOL_DIR):
+        return
+    # 暂存目录就是附件库的 blobs/ 时由 AttachmentStore.prune 按 ATTACHMENT_RETENTION_DAYS 清理（并同步索引），这里不动
+    if os.path.realpath(SPOOL_DIR) == os.path.realpath(attachment_store.BLOB_DIR):
+        return
+    cutoff = datetime.now().timestamp() - SPOOL_RETENTION_DAYS * 86400
+    for name in os.listdir(SPOOL_DIR):
+        path = os.path.join(SPOOL_DIR, name)
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+def _mime_head(headers: bytes, extra: str = "") -> bytes:
+    return headers.rstrip(b"\r\n") + b"\r\n" + extra.encode() + b"\r\n"
+
+def _assemble(node: dict, sections: dict[str, bytes], spooled: dict[str, str]) -> bytes:
+    """按原结构拼回邮件正文：文本部分原样，表格附件只留头部 + SPOOL_HEADER，其余附件只留头部"""
+    if not node["children"]:
+        return sections.get(node["section"], b"")
+    boundary = str(node["params"].get("boundary", "")).encode()
+    out = []
+    for child in node["children"]:
+        extra = f"{SPOOL_HEADER}: {spooled[child['section']]}\r\n" if child["section"] in spooled else ""
+        out += [b"--" + boundary + b"\r\n", _mime_head(sections.get(child["section"] + ".MIME", b""), extra),
+                _assemble(child, sections, spooled), b"\r\n"]
+    out.append(b"--" + boundary + b"--\r\n")
+    return b"".join(out)
+
+def fetch_partial(mail: imaplib.IMAP4, uid: int) -> bytes | None:
+    """
+    分段下载一封邮件：BODYSTRUCTURE → 一条 FETCH 取邮件头、各部分 MIME 头和文本正文（HTML 只取这一次）
+    → 表格附件按块下载并增量解码到 SPOOL_DIR/<SHA-256>。返回拼回的邮件（附件处为占位），
+    结构无法处理（单部分邮件等）时返回 None，由调用方整封下载。
+    """
+    tree = fetch_bodystructure(mail, uid)
+    if tree is None or not tree["children"]:
+        return None
+    with span("imap_partial_fetch", uid=uid) as trace_args:
+        leaves = _leaves(tree)
+        parts = [n for n in _walk_nodes(tree) if n["section"]]
+        items = ["BODY.PEEK[HEADER]"] + [f"BODY.PEEK[{n['section']}.MIME]" for n in parts] \
+            + [f"BODY.PEEK[{leaf['section']}]" for leaf in leaves if not _is_attachment(leaf)]
+        sections = _fetch_sections(mail, uid, items)
+        if "HEADER" not in sections:
+            return None
+
+        spooled, wire_bytes = {}, sum(len(v) for v in sections.values())
+        for leaf in leaves:
+            if _is_attachment(leaf) and _wanted_attachment(sections.get(leaf["section"] + ".MIME", b"")):
+                spooled[leaf["section"]], fetched = _stream_to_spool(mail, uid, leaf)
+                wire_bytes += fetched
+        trace_args["bytes"] = wire_bytes
+        trace_args["attachments"] = len(spooled)
+    _prune_spool()
+    print(f"📎 UID {uid} 分段下载 {wire_bytes:,} 字节（表格附件 {len(spooled)} 个已写入暂存目录）")
+    return _mime_head(sections["HEADER"]) + _assemble(tree, sections, spooled)
+
+def _spool_path(sha: str) -> str | None:
+    src = os.path.join(SPOOL_DIR, sha)
+    if not os.path.exists(src):
+        print(f"⚠️ 附件暂存文件不存在（已被清理？）: {src}")
+        return None
+    return src
+
+def _fetch_one(mail: imaplib.IMAP4, w: dict) -> tuple[bytes, bytes] | None:
+    uid = w["uid"]
+    if PARTIAL_FETCH and w.get("size", 0) >= PARTIAL_MIN_BYTES:
+        raw = fetch_partial(mail, uid)
+        if raw is not None:
+            return str(uid).encode(), raw
+    fetched = fetch_full(mail, [uid], {uid: w.get("size", 0)})
+    return fetched[0] if fetched else None
+
+def fetch_winners(mail: imaplib.IMAP4, winners: list[dict], store=None,
+                  store_key: tuple[str, int] | None = None, on_message=None) -> list[tuple[bytes, bytes]]:
+    """
+    下载选中邮件的完整内容：先按 (邮箱, UIDVALIDITY, UID) / Message-ID 查本地邮件库，未命中的才 UID FETCH，
+    下载后写入本地库。store_key 为 (邮箱, UIDVALIDITY)。
+    不小于 PARTIAL_MIN_BYTES 的邮件分段下载（fetch_partial），其余批量整封下载（fetch_full）。
+    on_message(UID, 原始字节) 给出时（流水线）：本地命中的先交出，其余按大小从小到大逐封下载、到一封交一封。
+    """
+    local, missing = {}, {}
+    for w in winners:
+        raw = None
+        if store is not None and store_key is not None:
+            raw = store.get(store_key[0], store_key[1], w["uid"]) or store.get_by_message_id(w.get("message_id"))
+        if raw is not None:
+            local[w["uid"]] = raw
+        else:
+            missing[w["uid"]] = w
+    if local:
+        print(f"💾 本地邮件库命中 {len(local)} 封，不再下载")
+
+    fetched = []
+    if on_message is not None:
+        for uid in sorted(local):
+            on_message(str(uid).encode(), local[uid])
+        # 小的（通常是只有正文表格的那封）先下载，解析尽早开始；大邮件随后分段下载
+        for uid in sorted(missing, key=lambda u: (missing[u].get("size", 0), u)):
+            item = _fetch_one(mail, missing[uid])
+            if item is not None:
+                fetched.append(item)
+                on_message(*item)
+    else:
+        if PARTIAL_FETCH:
+            # 大邮件（附件大）：只取正文和表格附件，附件流式写盘
+            for uid in sorted(u for u, w in missing.items() if w.get("size", 0) >= PARTIAL_MIN_BYTES):
+                raw = fetch_partial(mail, uid)
+                if raw is not None:
+                    fetched.append((str(uid).encode(), raw))
+        done = {int(uid) for uid, _ in fetched}
+        rest = {uid: w for uid, w in missing.items() if uid not in done}
+        fetched += fetch_full(mail, sorted(rest), {uid: w.get("size", 0) for uid, w in rest.items()})
+
+    if store is None or store_key is None:
+        return sorted(fetched, key=lambda item: int(item[0]))
+    mailbox, uidvalidity = store_key
+    for uid, raw in fetched:
+        w = missing[int(uid)]
+        store.put(mailbox, uidvalidity, int(uid), raw, message_id=w.get("message_id"),
+                  subject=w["cleaned_subject"], received_at=_stored_received_at(w["date"]))
+    raw_messages = fetched + [(str(uid).encode(), raw) for uid, raw in local.items()]
+    return sorted(raw_messages, key=lambda item: int(item[0]))
+
+# ================================
+# 🔄 UID 增量同步状态（与 mail_meta.json 同目录）
+# ================================
+def load_sync_state(state_dir: str) -> dict:
+    try:
+        with open(os.path.join(state_dir, SYNC_STATE_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"⚠️ 同步状态文件损坏，将全量同步: {e}")
+        return {}
+
+def save_sync_state(state_dir: str, state: dict) -> None:
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, SYNC_STATE_FILENAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+_state_lock = threading.Lock()  # 多个邮箱并发抓取（mail_sources.py）时共用一个状态文件
+
+def update_sync_state(state_dir: str, key: str, entry: dict | None) -> None:
+    """重新读取状态文件，只替换（entry 为 None 时删除）一个邮箱的记录，不覆盖其他邮箱同时写入的记录"""
+    with _state_lock:
+        state = load_sync_state(state_dir)
+        if entry is None:
+            state.pop(key, None)
+        else:
+            state[key] = entry
+        save_sync_state(state_dir, state)
+
+def _sync_key(server: str, user: str, mailbox: str | None = None) -> str:
+    return f"{user}@{server}/{mailbox or MAILBOX}"
+
+def _response_int(mail: imaplib.IMAP4, code: str) -> int | None:
+    """SELECT 时服务器返回的 [UIDVALIDITY n] / [UIDNEXT n]"""
+    _, data = mail.response(code)
+    try:
+        return int(data[-1])
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def _winner_items(entry: dict) -> list[dict]:
+    """状态中记录的上次选中邮件，作为与新邮件比较的候选"""
+    items = []
+    for w in entry.get("winners", {}).values():
+        items.append({"uid": w["uid"], "subject": w["subject"], "cleaned_subject": w["subject"],
+                      "date": datetime.fromisoformat(w["date"]), "message_id": w.get("message_id", ""),
+                      "size": w.get("size", 0)})
+    return items
+
+def fetch_latest_messages(server: str, user: str, password: str,
+                          keyword_sets: list[dict] | None = None,
+                          state_dir: str | None = None, store=None,
+                          mailbox: str | None = None,
+                          on_selected=None, on_message=None) -> list[tuple[bytes, bytes]] | None:
+    """
+    快速选取：检索 → 只取头部 → 只下载每个关键词最新一封的完整邮件。
+    state_dir 给出时做 UID 增量同步：UIDVALIDITY 未变时只检索 UID 大于上次水位的新邮件（一次 UID SEARCH），
+    与上次选中的邮件比较；UIDVALIDITY 变化（或没有状态）时全量检索。
+    keyword_sets 为多个 KEYWORDS（多租户共享抓取时），默认本模块的 KEYWORDS。
+    store 为本地邮件库（open_store()）：选中的邮件已在本地时不再下载。
+    mailbox 为文件夹名，默认 MAILBOX（多个账号 / 文件夹见 mail_sources.py）。
+    on_selected({关键词: UID}) / on_message(UID, 原始字节)：流水线用（见 ingest_pipelined），选出后、每封到达时回调；
+    增量同步失效全量重来时 on_selected 会再调用一次，之前交出的邮件作废。
+    返回 [(UID, 原始字节)]；出错时返回 None。
+    """
+    keywords = list(dict.fromkeys(k for ks in (keyword_sets or [KEYWORDS]) for k in ks.values()))
+    state = load_sync_state(state_dir) if state_dir else {}
+    key = _sync_key(server, user, mailbox)
+    mail = None
+    try:
+        mail = open_mailbox(server, user, password, mailbox)
+        uidvalidity = _response_int(mail, "UIDVALIDITY")
+        uidnext = _response_int(mail, "UIDNEXT")
+        entry = state.get(key)
+
+        with span("imap_search", keywords=len(keywords)) as trace_args:
+            incremental = bool(entry) and uidvalidity is not None and entry.get("uidvalidity") == uidvalidity \
+                and set(keywords) <= set(entry.get("keywords", []))
+            if incremental:
+                uids = search_new_uids(mail, entry["last_uid"])
+                print(f"🔄 增量同步：UID > {entry['last_uid']} 的新邮件 {len(uids)} 封")
+                previous = _winner_items(entry)
+                last_uid = max([entry["last_uid"], *uids])
+            else:
+                if entry and entry.get("uidvalidity") != uidvalidity:
+                    print(f"⚠️ UIDVALIDITY 已变化（{entry.get('uidvalidity')} → {uidvalidity}），全量重新同步")
+                uids = search_candidates(mail, keywords)
+                previous = []
+                last_uid = max([uidnext - 1 if uidnext else 0, *uids])
+            trace_args["candidates"] = len(uids)
+            trace_args["incremental"] = incremental
+        headers = fetch_headers(mail, uids) + previous
+
+        winners = {}
+        for keyword in keywords:
+            latest = _pick_latest(headers, keyword)
+            if latest:
+                winners[keyword] = latest
+        selected = list({w["uid"]: w for w in winners.values()}.values())
+        print(f"📨 新候选 {len(uids)} 封（只取头部），选中完整邮件 {len(selected)} 封。")
+
+        if on_selected is not None:
+            on_selected({k: w["uid"] for k, w in winners.items()})
+        store_key = (key, uidvalidity) if uidvalidity is not None else None
+        raw_messages = fetch_winners(mail, selected, store, store_key, on_message)
+        if incremental and len(raw_messages) < len(selected):
+            # 上次选中的邮件已被删除/移动：丢弃状态，全量重来
+            print("⚠️ 上次选中的邮件已不在邮箱中，全量重新同步")
+            if state_dir:
+                update_sync_state(state_dir, key, None)
+            _logout(mail)
+            mail = None
+            return fetch_latest_messages(server, user, password, keyword_sets, state_dir, store, mailbox,
+                                         on_selected, on_message)
+
+        if state_dir and uidvalidity is not None:
+            update_sync_state(state_dir, key, {
+                "uidvalidity": uidvalidity,
+                "last_uid": last_uid,
+                "keywords": keywords,
+                "winners": {k: {"uid": w["uid"], "subject": w["cleaned_subject"], "date": w["date"].isoformat(),
+                                "message_id": w.get("message_id", ""), "size": w.get("size", 0)}
+                            for k, w in winners.items()},
+                "synced_at": now_shanghai().isoformat(),
+            })
+        return raw_messages
+
+    except imaplib.IMAP4.error as e:
+        print(f"IMAP 错误: {e}")
+        return None
+    except Exception as e:
+        print(f"获取邮件失败: {e}")
+        return None
+    finally:
+        _logout(mail)
+
+# ================================
+# 🎯 按关键词选出邮件并输出 HTML/元数据/附件
+# ================================
+def select_from_messages(raw_messages: list[tuple[bytes, bytes]], save_dir: str, store=None,
+                         attachments: dict[bytes, list[str]] | None = None) -> str | None:
+    """
+    store 给出时，选中邮件的 HTML 正文另存入本地邮件库（保留历史，可按日期/关键词查询）。
+    attachments：流水线已落盘的附件 {UID: SHA-256 列表}，选中的正是这封时不再重复下载。
+    """
+    html_content = None
+
+    meta = {
+        "selected_heyu_da_subject": None,
+        "selected_heyu_da_received_at": None,  # ISO8601（带+08:00）
+        "selected_waiting_subject": None,
+        "selected_waiting_received_at": None,  # ISO8601（带+08:00）
+        "selected_heyu_da_message_id": None,
+        "selected_waiting_message_id": None,
+        "attachment_sha256": [],
+    }
+
+    try:
+        inventory_query_emails = []
+
+        for i, (mail_id, raw_email) in enumerate(raw_messages, start=1):
             msg = email.message_from_bytes(raw_email)
 
             subject = decode_str(msg.get("Subject"))
             from_ = decode_str(msg.get("From"))
-            date_raw = decode_str(msg.get("Date"))
-
-            mail_date = parsedate_tz(date_raw)
-            if mail_date:
-                # mktime_tz 返回 UTC 秒数；直接转换为“北京时间” aware datetime
-                mail_datetime = ts_to_shanghai(mktime_tz(mail_date))
-            else:
-                mail_datetime = datetime(1970, 1, 1, tzinfo=TZ_SH)
+            mail_datetime = _mail_datetime(msg)
 
             cleaned_subject = clean_subject(subject)
-            print(f"  · 第 {i} 封 | 原: {subject} | 清理: {cleaned_subject} | 发件人: {from_} | 收到(北京): {mail_datetime.strftime('%Y-%m-%d %H:%M:%S %z')}")
+            log.debug("  · 第 %s 封 | 原: %s | 清理: %s | 发件人: %s | 收到(北京): %s",
+                      i, subject, cleaned_subject, from_, mail_datetime.strftime('%Y-%m-%d %H:%M:%S %z'))
 
             if (KEYWORDS["waiting"] in cleaned_subject) or (KEYWORDS["heyu_da"] in cleaned_subject):
                 inventory_query_emails.append({
@@ -170,18 +893,25 @@ def fetch_html_from_emails(server: str, user: str, password: str, save_dir: str)
         selected_heyu = _pick_latest(inventory_query_emails, KEYWORDS["heyu_da"])
         if selected_heyu:
             html_content = extract_html_from_msg(selected_heyu["msg"]) or html_content
+            _keep_report(store, selected_heyu, KEYWORDS["heyu_da"], html_content)
             print(f"\n📌 选中(合肥市和裕达): {selected_heyu['cleaned_subject']} | {selected_heyu['date'].strftime('%Y-%m-%d %H:%M:%S %z')}")
             meta["selected_heyu_da_subject"] = selected_heyu["cleaned_subject"]
             meta["selected_heyu_da_received_at"] = selected_heyu["date"].isoformat()
-            download_attachments(selected_heyu["msg"], save_dir)
+            meta["selected_heyu_da_message_id"] = _message_id(selected_heyu["msg"])
+            prepared = (attachments or {}).get(selected_heyu["mail_id"])
+            if prepared is None:
+                prepared = download_attachments(selected_heyu["msg"], save_dir, _attachment_source(selected_heyu))
+            meta["attachment_sha256"] = prepared
 
         # 选出“等待您查看”最新一封
         selected_waiting = _pick_latest(inventory_query_emails, KEYWORDS["waiting"])
         if selected_waiting:
             html_content = extract_html_from_msg(selected_waiting["msg"]) or html_content
+            _keep_report(store, selected_waiting, KEYWORDS["waiting"], html_content)
             print(f"\n📌 选中(等待您查看): {selected_waiting['cleaned_subject']} | {selected_waiting['date'].strftime('%Y-%m-%d %H:%M:%S %z')}")
             meta["selected_waiting_subject"] = selected_waiting["cleaned_subject"]
             meta["selected_waiting_received_at"] = selected_waiting["date"].isoformat()
+            meta["selected_waiting_message_id"] = _message_id(selected_waiting["msg"])
 
         _write_meta(meta, os.path.join(save_dir, META_FILENAME))
 
@@ -192,18 +922,157 @@ def fetch_html_from_emails(server: str, user: str, password: str, save_dir: str)
 
         return html_content
 
-    except imaplib.IMAP4.error as e:
-        print(f"IMAP 错误: {e}")
+    except Exception as e:
+        print(f"处理邮件失败: {e}")
         return None
+
+def _attachment_source(item: dict) -> dict:
+    """附件库索引中记录的来源邮件"""
+    return {
+        "uid": item["mail_id"].decode(errors="replace"),
+        "message_id": _message_id(item["msg"]),
+        "subject": item["cleaned_subject"],
+        "received_at": item["date"].isoformat(),
+    }
+
+def _keep_report(store, item: dict, keyword: str, html: str | None) -> None:
+    if store is None or not html:
+        return
+    try:
+        store.put_report(_message_id(item["msg"]), keyword, item["cleaned_subject"],
+                          _stored_received_at(item["date"]), html)
     except Exception as e:
-        print(f"获取邮件失败: {e}")
+        print(f"⚠️ 报表 HTML 未能存入本地邮件库: {e}")
+
+def fetch_html_from_emails(server: str, user: str, password: str, save_dir: str, store=None) -> str | None:
+    if FAST_SELECT:
+        raw_messages = fetch_latest_messages(server, user, password, state_dir=save_dir, store=store)
+    else:
+        raw_messages = fetch_recent_messages(server, user, password)
+    if not raw_messages:
         return None
-    finally:
+    return select_from_messages(raw_messages, save_dir, store)
+
+def _table_html(winners: dict[str, int], html_by_uid: dict[int, str | None]) -> str | None:
+    """与 select_from_messages 相同的取舍：“等待您查看”有 HTML 用它，否则用“合肥市和裕达”的；还没到时返回 None"""
+    waiting, heyu = winners.get(KEYWORDS["waiting"]), winners.get(KEYWORDS["heyu_da"])
+    if waiting is not None:
+        if waiting not in html_by_uid:
+            return None
+        if html_by_uid[waiting]:
+            return html_by_uid[waiting]
+    return html_by_uid.get(heyu) if heyu is not None else None
+
+def _discard_excel(future) -> None:
+    """作废流水线预先导出的 Excel"""
+    try:
+        path = future.result()
+    except Exception:
+        return
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def ingest_pipelined(server: str, user: str, password: str, save_dir: str,
+                     store=None) -> tuple[str | None, dict | None]:
+    """
+    抓取与处理重叠：IMAP 线程逐封下载选中的邮件（见 fetch_winners 的 on_message），经有界队列交给当前线程；
+    每到一封就在线程池中落盘附件（合肥市和裕达那封）、解析正文表格并边解析边写 Excel（提供表格的那封），
+    不等其他邮件下载完。全部到齐后仍由 select_from_messages 选取并写元数据 / 报表，已落盘的附件直接复用；
+    选出的 HTML 与预先解析的不同时（少见）丢弃预先导出的 Excel，由调用方重新解析。
+    返回 (HTML 正文, {"excel_path": 已导出的 Excel 或 None（表格为空）})；后者为 None 时调用方照常 parse_and_save。
+    """
+    inbox = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+
+    def produce():
+        raw_messages = None
+        own_store = open_store() if store is not None else None  # sqlite 连接不能跨线程使用
         try:
-            if mail is not None:
-                mail.logout()
-        except Exception:
-            pass
+            raw_messages = fetch_latest_messages(
+                server, user, password, state_dir=save_dir, store=own_store,
+                on_selected=lambda winners: inbox.put(("selected", winners)),
+                on_message=lambda uid, raw: inbox.put(("message", (uid, raw))))
+        finally:
+            _close_store(own_store)
+            inbox.put(("done", raw_messages))
+
+    producer = threading.Thread(target=produce, name="imap-fetch", daemon=True)
+    producer.start()
+
+    winners, html_by_uid, attachments, table = {}, {}, {}, None
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="ingest") as pool:
+        while True:
+            kind, payload = inbox.get()
+            if kind == "done":
+                raw_messages = payload
+                break
+            if kind == "selected":
+                if winners:
+                    # 增量同步失效、全量重来：之前交出的邮件作废（已链接的附件留着，随后按新的选取重新链接）
+                    if table is not None:
+                        _discard_excel(table[1])
+                    html_by_uid, attachments, table = {}, {}, None
+                winners = payload
+                continue
+
+            uid, raw = payload
+            msg = email.message_from_bytes(raw)
+            if int(uid) == winners.get(KEYWORDS["heyu_da"]):
+                item = {"mail_id": uid, "cleaned_subject": clean_subject(decode_str(msg.get("Subject"))),
+                        "date": _mail_datetime(msg), "msg": msg}
+                attachments[uid] = pool.submit(download_attachments, msg, save_dir, _attachment_source(item))
+            html_by_uid[int(uid)] = extract_html_from_msg(msg)
+            if table is None and (html := _table_html(winners, html_by_uid)):
+                table = (html, pool.submit(parse_and_save, html, save_dir))
+
+        producer.join()
+        prepared = {}
+        for uid, future in attachments.items():
+            try:
+                prepared[uid] = future.result()
+            except Exception as e:
+                print(f"⚠️ 流水线附件落盘失败，选取时重试: {e}")
+
+    if not raw_messages:
+        if table is not None:
+            _discard_excel(table[1])
+        return None, None
+    html_content = select_from_messages(raw_messages, save_dir, store, attachments=prepared)
+    if table is None:
+        return html_content, None
+    if html_content != table[0]:
+        _discard_excel(table[1])
+        return html_content, None
+    try:
+        return html_content, {"excel_path": table[1].result()}
+    except Exception as e:
+        print(f"⚠️ 流水线解析表格失败，重新解析: {e}")
+        return html_content, None
+
+def replay_messages(store, day: str, keyword_sets: list[dict] | None = None) -> list[tuple[bytes, bytes]]:
+    """补跑 / 重跑：从本地邮件库取某天（YYYY-MM-DD，北京时间）收到的命中关键词的邮件，不连邮箱"""
+    if store is None:
+        raise RuntimeError("❌ 补跑需要本地邮件库（MAIL_STORE 未关闭且 MAIL_STORE_PATH 可用）")
+    keywords = list(dict.fromkeys(k for ks in (keyword_sets or [KEYWORDS]) for k in ks.values()))
+    raw_messages = store.messages_on(day, keywords)
+    print(f"💾 补跑 {day}：本地邮件库中命中关键词的邮件 {len(raw_messages)} 封")
+    return raw_messages
+
+def _mail_datetime(msg) -> datetime:
+    """Date 头转为北京时间；缺失或无法解析时为 1970-01-01"""
+    mail_date = parsedate_tz(decode_str(msg.get("Date")))
+    if mail_date:
+        # mktime_tz 返回 UTC 秒数；直接转换为“北京时间” aware datetime
+        return ts_to_shanghai(mktime_tz(mail_date))
+    return datetime(1970, 1, 1, tzinfo=TZ_SH)
+
+def _stored_received_at(mail_datetime: datetime) -> str:
+    """存入本地邮件库的收到时间：Date 头缺失 / 无法解析（1970）时记抓取时间，否则 prune 当次就会把它当过期删掉"""
+    return (mail_datetime if mail_datetime.year > 1970 else now_shanghai()).isoformat()
+
+def _message_id(msg) -> str:
+    """Message-ID；缺失时用 主题+日期 代替"""
+    mid = (msg.get("Message-ID") or "").strip()
+    return mid or f"{decode_str(msg.get('Subject'))}|{msg.get('Date')}"
 
 def _pick_latest(candidates: list[dict], keyword: str) -> dict | None:
     selected = None
@@ -241,10 +1110,15 @@ def extract_html_from_msg(msg) -> str | None:
 # ================================
 # 📎 下载附件（文件名追加“北京时间”时间戳）
 # ================================
-def download_attachments(msg, download_folder: str) -> None:
-    """下载邮件附件：文件名按 原名_YYYYMMDD_HHMMSS（北京）+扩展名。"""
+def download_attachments(msg, download_folder: str, source: dict | None = None) -> list[str]:
+    """
+    下载邮件附件：文件名按 原名_YYYYMMDD_HHMMSS（邮件收到时间，北京）+扩展名。返回各附件内容的 SHA-256。
+    附件库可用时内容只存一份（attachment_store.py），download_folder 中放链接；同一封邮件重跑不再产生新文件。
+    source: 来源邮件 {uid, message_id, subject, received_at}，记入附件库索引。
+    """
+    digests = []
     if not msg.is_multipart():
-        return
+        return digests
 
     import mimetypes
     import unicodedata
@@ -286,97 +1160,147 @@ def download_attachments(msg, download_folder: str) -> None:
                 return candidate
             i += 1
 
-    for part in msg.walk():
-        if part.get_content_maintype() == "multipart":
-            continue
-
-        content_disposition = str(part.get("Content-Disposition") or "")
-        raw_name = part.get_filename()
-
-        if "attachment" not in content_disposition and not raw_name:
-            continue
-
-        if raw_name:
-            filename = _decode_filename(raw_name)
-        else:
-            filename = f"attachment{_guess_ext(part.get_content_type())}"
+    blobs = attachment_store.open_store()
+    # 附件库中的文件名用邮件收到时间（重跑时不变）；关闭附件库时仍用当前时间 + 去重后缀，每次写新文件
+    received = _mail_datetime(msg)
+    stamp = received if blobs is not None and received.year > 1970 else None
+    try:
+        for part in msg.walk():
+            if part.get_content_maintype() == "multipart":
+                continue
 
-        base_name, ext = os.path.splitext(filename)
-        if not ext:
-            ext = _guess_ext(part.get_content_type())
+            content_disposition = str(part.get("Content-Disposition") or "")
+            raw_name = part.get_filename()
 
-        ts = now_shanghai().strftime("%Y%m%d_%H%M%S")  # 北京时间
-        safe_base = _sanitize(base_name)
-        safe_name = f"{safe_base}_{ts}{ext}"
-        file_path = os.path.join(download_folder, safe_name)
-        file_path = _ensure_unique(file_path)
+            if "attachment" not in content_disposition and not raw_name:
+                continue
 
-        file_data = part.get_payload(decode=True)
-        if not file_data:
-            continue
-        with open(file_path, "wb") as f:
-            f.write(file_data)
+            if raw_name:
+                filename = _decode_filename(raw_name)
+            else:
+                filename = f"attachment{_guess_ext(part.get_content_type())}"
+
+            base_name, ext = os.path.splitext(filename)
+            if not ext:
+                ext = _guess_ext(part.get_content_type())
+
+            ts = (stamp or now_shanghai()).strftime("%Y%m%d_%H%M%S")  # 北京时间
+            safe_base = _sanitize(base_name)
+            safe_name = f"{safe_base}_{ts}{ext}"
+            file_path = os.path.join(download_folder, safe_name)
+
+            spooled = part.get(SPOOL_HEADER)
+            if spooled:
+                # 分段下载的附件已在暂存目录（见 fetch_partial）
+                digest = str(spooled).strip()
+                src = _spool_path(digest)
+                if not src:
+                    continue
+                if blobs is not None:
+                    blobs.add_file(src, digest)
+                else:
+                    file_path = _ensure_unique(file_path)
+                    shutil.copyfile(src, file_path)
+            else:
+                file_data = part.get_payload(decode=True)
+                if not file_data:
+                    continue
+                if blobs is not None:
+                    digest, _ = blobs.put_bytes(file_data)
+                else:
+                    digest = hashlib.sha256(file_data).hexdigest()
+                    file_path = _ensure_unique(file_path)
+                    with open(file_path, "wb") as f:
+                        f.write(file_data)
+            digests.append(digest)
+
+            if blobs is not None:
+                file_path = blobs.link(digest, file_path)
+                blobs.record(digest, safe_name, file_path, source)
+            print(f"📥 附件已下载(北京时): {file_path}")
+    finally:
+        if blobs is not None:
+            blobs.close()
 
-        print(f"📥 附件已下载(北京时): {file_path}")
+    return digests
 
 # ================================
 # 🧠 解析 HTML 表格并导出 Excel
 # ================================
-def parse_html_table(html_content: str) -> list[list[str]]:
+def parse_html_tables(html_content: str, snapshot_dir: str | None = None, sink=None) -> list[dict]:
+    """
+    解析正文中的所有表格，按表头签名归类：[{header, rows(含表头), tables(表格序号)}]，按首次出现的顺序。
+    表头相同的表格（发件方把存量查询拆成几张表）合并为一组；每张表格各自按原规则识别表头、跳过异常行。
+    sink 给出时，表头含 MAIN_TABLE_COLUMNS 的第一组（主表）的行一经确认就逐行交给 sink（先是表头），供边解析边写。
+    """
     print("正在解析 HTML 内容中的表格...")
 
     try:
-        snap_path = os.path.join(excel_save_path, "last_mail_html.html")
+        snap_path = os.path.join(snapshot_dir or default_save_path, "last_mail_html.html")
         with open(snap_path, "w", encoding="utf-8") as f:
             f.write(html_content)
         print(f"🔎 HTML 快照: {snap_path}")
     except Exception:
         pass
 
-    soup = BeautifulSoup(html_content, "html.parser")
-    table = soup.find("table")
-    if not table:
-        print("未找到 HTML 表格！")
-        return []
-
-    data = []
-    rows = table.find_all("tr")
-    header = None
-
-    for idx, row in enumerate(rows):
-        cols = [ele.get_text(strip=True) for ele in row.find_all(["td", "th"])]
+    # 解析后端（lxml 增量解析默认 / bs4）只负责逐行产出单元格文本，下面的规则两者共用（见 html_table.py）
+    backend, iter_rows = html_table.get_backend()
+    log.debug("HTML 表格解析后端: %s", backend)
+
+    tables = {}  # 表格序号 → {idx: 表内行号, header, group}
+    groups = {}  # 表头签名 → 组
+    streamed = None  # 交给 sink 的组
+    for t, cols in iter_rows(html_content):
+        state = tables.setdefault(t, {"idx": -1, "header": None, "group": None})
+        state["idx"] += 1
+        idx = state["idx"]
+        where = f"表 {t + 1} " if t else ""
         if not cols:
-            print(f"第 {idx + 1} 行是空行，跳过")
+            print(f"{where}第 {idx + 1} 行是空行，跳过")
             continue
-        if header is None:
+        if state["header"] is None:
             if idx == 0 and len(cols) > 10:
-                print("第一行列数过多，认为其为正文内容，跳过")
+                print(f"{where}第一行列数过多，认为其为正文内容，跳过")
                 continue
-            header = cols
-            data.append(header)
+            state["header"] = cols
+            group = groups.setdefault(tuple(cols), {"header": cols, "rows": [cols], "tables": []})
+            group["tables"].append(t)
+            state["group"] = group
+            if sink is not None and streamed is None and all(col in cols for col in MAIN_TABLE_COLUMNS):
+                streamed = group
+                sink(cols)
             continue
-        if len(cols) != len(header):
-            print(f"第 {idx + 1} 行列数与表头不匹配，跳过")
+        if len(cols) != len(state["header"]):
+            print(f"{where}第 {idx + 1} 行列数与表头不匹配，跳过")
             continue
-        if cols == header:
-            print(f"第 {idx + 1} 行是重复表头，跳过")
+        if cols == state["header"]:
+            print(f"{where}第 {idx + 1} 行是重复表头，跳过")
             continue
-        data.append(cols)
-
-    print(f"成功提取 {len(data)} 行表格数据。")
-
-    for i in range(len(data)):
-        for j in range(len(data[i])):
-            if isinstance(data[i][j], str) and data[i][j].isdigit():
-                data[i][j] = str(data[i][j])
-
-    return data
-
-def save_to_excel(data: list[list[str]], save_dir: str, file_prefix="存量查询") -> None:
-    if not data:
-        print("ℹ️ 没有可导出的数据。")
-        return
+        state["group"]["rows"].append(cols)
+        if state["group"] is streamed:
+            sink(cols)
 
+    if not tables:
+        print("未找到 HTML 表格！")
+        return []
+    for group in groups.values():
+        merged = f"（{len(group['tables'])} 个表格合并）" if len(group["tables"]) > 1 else ""
+        print(f"成功提取 {len(group['rows'])} 行表格数据{merged}，表头: {' | '.join(group['header'][:6])}")
+    return list(groups.values())
+
+def main_table_group(groups: list[dict]) -> dict | None:
+    """存量查询主表：表头含 MAIN_TABLE_COLUMNS 的第一组；都不含时取第一组（与只解析第一个表格时一致）"""
+    for group in groups:
+        if all(col in group["header"] for col in MAIN_TABLE_COLUMNS):
+            return group
+    return groups[0] if groups else None
+
+def parse_html_table(html_content: str, snapshot_dir: str | None = None) -> list[list[str]]:
+    """只要存量查询主表的行（含表头）"""
+    group = main_table_group(parse_html_tables(html_content, snapshot_dir))
+    return group["rows"] if group else []
+
+def _dedupe_rows(data: list[list[str]]) -> list[list[str]]:
     seen = set()
     unique_data = []
     for row in data:
@@ -384,45 +1308,225 @@ def save_to_excel(data: list[list[str]], save_dir: str, file_prefix="存量查
         if tup not in seen:
             seen.add(tup)
             unique_data.append(row)
+    return unique_data
+
+def _extra_sheet_titles(groups: list[dict]) -> list[str]:
+    """附表工作表名：附表N_表头前几列（去掉 Excel 不允许的字符，不超过 31 个字符）"""
+    titles = []
+    for n, group in enumerate(groups, start=1):
+        label = "_".join(group["header"][:3])
+        titles.append(re.sub(r"[\[\]:*?/\\]", "", f"附表{n}_{label}")[:31])
+    return titles
+
+def _decimal_values(rows: list[list[str]], columns: tuple[int, ...]) -> dict[int, list[float]]:
+    """
+    一次向量化推断各列是否为数值列（去掉千分位逗号后能转成数字的行 ≥ 一半）；
+    返回 {列号: 每个数据行的数值}，转不了的行为 NaN（原样写文本）。rows 第一行为表头。
+    """
+    body = pd.DataFrame(rows[1:])
+    decimals = {}
+    for col in columns:
+        if body.empty or col >= body.shape[1]:
+            continue
+        text = body[col].astype(str).str.replace(",", "", regex=False).str.strip()
+        values = pd.to_numeric(text, errors="coerce")
+        if values.notna().sum() >= len(body) / 2:
+            decimals[col] = values.astype("float64").tolist()  # 与边解析边写的逐个转换（_parse_decimal）一致
+    return decimals
+
+def _parse_decimal(text: str) -> float:
+    """_decimal_values 的单值版本：去掉千分位逗号和首尾空白后转数字，转不了为 NaN"""
+    try:
+        return float(text.replace(",", "").strip())
+    except (AttributeError, ValueError):
+        return math.nan
+
+def _blank_to_none(row: list[str]) -> list:
+    # 空字符串写成空单元格（与 DataFrame.to_excel 一致），而不是长度为 0 的文本
+    return [value if value != "" else None for value in row]
+
+def _decimal_style():
+    # 命名样式只能属于一个工作簿，每次保存新建
+    return NamedStyle(name=DECIMAL_STYLE_NAME, number_format="#,##0.00", alignment=Alignment(horizontal="right"))
+
+def save_to_excel(data: list[list[str]], save_dir: str, file_prefix="存量查询",
+                  extra_tables: list[dict] | None = None) -> str | None:
+    """
+    主表写入“第一页”；extra_tables（parse_html_tables 的其他组，如汇总表）各写一个附表工作表。
+    第 5/6 列（0-based 4/5）为数值列时写成 #,##0.00 的数字；write_only 流式写一遍，不再回读改写。
+    """
+    if not data:
+        print("ℹ️ 没有可导出的数据。")
+        return None
 
-    df = pd.DataFrame(unique_data)
+    unique_data = _dedupe_rows(data)
+    decimals = _decimal_values(unique_data, DECIMAL_COLUMNS)
 
+    full_path = _excel_path(save_dir, file_prefix)
+    print(f"💾 正在保存 Excel（北京时）: {full_path}")
+    wb, ws = _new_workbook()
+    ws.append(_blank_to_none(unique_data[0]))
+    for r, row in enumerate(unique_data[1:]):
+        row = _blank_to_none(row)
+        if decimals:
+            for col, values in decimals.items():
+                value = values[r]
+                if value == value:  # NaN：不是数字，保留原文本
+                    cell = WriteOnlyCell(ws, value=value)
+                    cell.style = DECIMAL_STYLE_NAME
+                    row[col] = cell
+        ws.append(row)
+
+    _append_extra_sheets(wb, extra_tables)
+    wb.save(full_path)
+    print("✅ Excel 保存完成。")
+    return full_path
+
+def _excel_path(save_dir: str, file_prefix: str) -> str:
     # 文件名用北京时间
     timestamp = now_shanghai().strftime("%Y%m%d_%H%M%S")
-    file_name = f"{file_prefix}_{timestamp}.xlsx"
-    full_path = os.path.join(save_dir, file_name)
+    return os.path.join(save_dir, f"{file_prefix}_{timestamp}.xlsx")
 
-    print(f"💾 正在保存 Excel（北京时）: {full_path}")
-    df.to_excel(full_path, index=False, header=False)
-
-    wb = openpyxl.load_workbook(full_path)
-    ws = wb.active
-    ws.title = "第一页"
-
-    decimal_columns = [4, 5]  # 第5/6列（0-based）
-    max_row = ws.max_row
-    for col in decimal_columns:
-        numeric_count = 0
-        for r in range(2, max_row + 1):
-            val = ws.cell(row=r, column=col + 1).value
-            try:
-                float(str(val).replace(",", ""))
-                numeric_count += 1
-            except Exception:
-                pass
-        if numeric_count >= (max_row - 1) / 2:
-            for r in range(2, max_row + 1):
-                cell = ws.cell(row=r, column=col + 1)
-                try:
-                    v = float(str(cell.value).replace(",", ""))
-                    cell.value = v
-                    cell.number_format = '#,##0.00'
-                    cell.alignment = Alignment(horizontal='right')
-                except Exception:
-                    pass
+def _new_workbook():
+    """write_only 工作簿 + 主表工作表“第一页”"""
+    wb = openpyxl.Workbook(write_only=True)
+    wb.add_named_style(_decimal_style())
+    return wb, wb.create_sheet("第一页")
+
+def _append_extra_sheets(wb, extra_tables: list[dict] | None) -> None:
+    for group, title in zip(extra_tables or [], _extra_sheet_titles(extra_tables or [])):
+        extra_ws = wb.create_sheet(title)
+        for row in _dedupe_rows(group["rows"]):
+            extra_ws.append(_blank_to_none(row))
+        print(f"📑 附表 {title}: {len(group['rows'])} 行")
 
+# ================================
+# 🏭 边解析边写：主表的行经有界队列交给写线程
+# ================================
+def _write_streamed_rows(ws, batches: queue.Queue, numbers: dict[int, list[float]], errors: list) -> None:
+    """
+    写线程：去重后逐行追加；DECIMAL_COLUMNS 中能转成数字的单元格先按数字写（是否真是数值列要等整表看完，
+    见 _same_decimals），每个数据行的转换结果记在 numbers 中。出错后只消费不写，解析线程不会因队列满而卡住。
+    """
+    seen = set()
+    while (batch := batches.get()) is not None:
+        if errors:
+            continue
+        try:
+            for row in batch:
+                key = tuple(row)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if len(seen) == 1:
+                    ws.append(_blank_to_none(row))  # 表头
+                    continue
+                cells = _blank_to_none(row)
+                for col, values in numbers.items():
+                    value = _parse_decimal(row[col]) if col < len(row) else math.nan
+                    values.append(value)
+                    if value == value:
+                        cell = WriteOnlyCell(ws, value=value)
+                        cell.style = DECIMAL_STYLE_NAME
+                        cells[col] = cell
+                ws.append(cells)
+        except Exception as e:
+            errors.append(e)
+
+def _same_decimals(numbers: dict[int, list[float]], decimals: dict[int, list[float]]) -> bool:
+    """边写边转的结果与整表推断（_decimal_values）是否一致（NaN 视为相等）"""
+    for col, values in numbers.items():
+        expected = decimals.get(col)
+        if expected is None:
+            if any(v == v for v in values):
+                return False  # 不是数值列，却有单元格按数字写了
+        elif len(values) != len(expected) or any(a != b and (a == a or b == b) for a, b in zip(values, expected)):
+            return False
+    return True
+
+def _parse_and_save_streaming(html_content: str, save_dir: str, file_prefix: str) -> tuple[list[dict], str | None]:
+    """
+    解析线程（当前线程）把主表的行按 ROW_BATCH 一批放进有界队列，写线程同时写 write_only 工作簿；
+    解析完再用整表推断核对数值列，不一致（或主表不是表头含 MAIN_TABLE_COLUMNS 的那组）时按 save_to_excel 重写。
+    """
+    batches = queue.Queue(maxsize=ROW_QUEUE_BATCHES)
+    batch = []
+
+    def sink(row):
+        nonlocal batch
+        batch.append(row)
+        if len(batch) >= ROW_BATCH:
+            batches.put(batch)
+            batch = []
+
+    wb, ws = _new_workbook()
+    numbers = {col: [] for col in DECIMAL_COLUMNS}
+    errors = []
+    writer = threading.Thread(target=_write_streamed_rows, args=(ws, batches, numbers, errors),
+                              name="excel-writer", daemon=True)
+    writer.start()
+    try:
+        groups = parse_html_tables(html_content, save_dir, sink=sink)
+        if batch:
+            batches.put(batch)
+    finally:
+        batches.put(None)
+        writer.join()
+
+    main_group = main_table_group(groups)
+    streamed = not errors and bool(main_group) and all(col in main_group["header"] for col in MAIN_TABLE_COLUMNS)
+    if streamed:
+        unique_data = _dedupe_rows(main_group["rows"])
+        streamed = _same_decimals(numbers, _decimal_values(unique_data, DECIMAL_COLUMNS))
+    if not streamed:
+        try:
+            ws.close()  # 放弃写了一半的工作簿（否则回收时 openpyxl 报流未正常结束）
+        except Exception:
+            pass
+    if not main_group:
+        return groups, None
+    extra_tables = [g for g in groups if g is not main_group] if SAVE_EXTRA_TABLES else None
+    if not streamed:
+        if errors:
+            print(f"⚠️ 边解析边写失败，改为整表写入: {errors[0]}")
+        return groups, save_to_excel(main_group["rows"], save_dir, file_prefix=file_prefix, extra_tables=extra_tables)
+
+    full_path = _excel_path(save_dir, file_prefix)
+    print(f"💾 正在保存 Excel（北京时）: {full_path}")
+    _append_extra_sheets(wb, extra_tables)
     wb.save(full_path)
     print("✅ Excel 保存完成。")
+    return groups, full_path
+
+def parse_and_save(html_content: str, save_dir: str, file_prefix="存量查询") -> str | None:
+    """解析正文表格并导出 Excel，返回 Excel 路径；表格为空时返回 None"""
+    with span("parse_html_table", html_bytes=len(html_content.encode("utf-8"))) as trace_args:
+        if INGEST_PIPELINE:
+            groups, excel_path = _parse_and_save_streaming(html_content, save_dir, file_prefix)
+        else:
+            groups = parse_html_tables(html_content, save_dir)
+            main_group = main_table_group(groups)
+            excel_path = None
+            if main_group:
+                extra_tables = [g for g in groups if g is not main_group] if SAVE_EXTRA_TABLES else None
+                excel_path = save_to_excel(main_group["rows"], save_dir, file_prefix=file_prefix,
+                                           extra_tables=extra_tables)
+        trace_args["rows"] = sum(len(g["rows"]) for g in groups)
+        trace_args["tables"] = sum(len(g["tables"]) for g in groups)
+    if excel_path is None:
+        print("表格为空，未导出 Excel。")
+    return excel_path
+
+def _source_fingerprint(meta_path: str) -> str | None:
+    """选中邮件的 Message-ID + 附件摘要；没有选中任何邮件时返回 None（下游不走缓存）"""
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except Exception:
+        return None
+    if not (meta.get("selected_heyu_da_message_id") or meta.get("selected_waiting_message_id")):
+        return None
+    return hashlib.sha256(json.dumps(meta, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
 
 def _write_meta(meta: dict, path: str) -> None:
     try:
@@ -435,18 +1539,53 @@ def _write_meta(meta: dict, path: str) -> None:
 # ================================
 # 🚀 主程序
 # ================================
-if __name__ == '__main__':
-    print(f"程序启动（北京时）: {now_shanghai().strftime('%Y-%m-%d %H:%M:%S %z')}")
-    html_content = fetch_html_from_emails(email_server, email_user, email_password, excel_save_path)
+def run(context: dict) -> dict:
+    excel_save_path = context["data_dir"]
+    os.makedirs(excel_save_path, exist_ok=True)
+    print(f"📂 保存路径: {os.path.abspath(excel_save_path)}")
+
+    shared_messages = context.get("mail_messages")
+    replay_date = context.get("replay_date")
+    store = open_store()
+    prepared = None  # 流水线已解析导出的结果
+    try:
+        if shared_messages is not None:
+            # 多租户运行：主进程已用一个 IMAP 会话抓取，按本租户的 KEYWORDS 选取（见 tenants.py）
+            print(f"📨 使用共享抓取的 {len(shared_messages)} 封邮件")
+            html_content = select_from_messages(shared_messages, excel_save_path, store)
+        elif replay_date:
+            html_content = select_from_messages(replay_messages(store, replay_date), excel_save_path, store)
+        elif os.getenv("MAIL_SOURCES"):
+            # 多个账号 / 文件夹并发抓取，合并后统一选取（见 mail_sources.py）
+            import mail_sources
+            raw_messages = mail_sources.ingest(mail_sources.load_sources(), state_dir=excel_save_path)
+            html_content = select_from_messages(raw_messages, excel_save_path, store) if raw_messages else None
+        else:
+            email_user, email_password, email_server = load_credentials()
+
+            print(f"程序启动（北京时）: {now_shanghai().strftime('%Y-%m-%d %H:%M:%S %z')}")
+            if INGEST_PIPELINE and FAST_SELECT:
+                html_content, prepared = ingest_pipelined(email_server, email_user, email_password,
+                                                          excel_save_path, store)
+            else:
+                html_content = fetch_html_from_emails(email_server, email_user, email_password, excel_save_path, store)
+    finally:
+        _close_store(store)
 
+    excel_path = None
     if html_content:
         preview = html_content[:400].replace("\n", " ")
         print(f"HTML 预览: {preview} ...")
-
-        table_data = parse_html_table(html_content)
-        if table_data:
-            save_to_excel(table_data, excel_save_path, file_prefix="存量查询")
+        if prepared is not None:
+            excel_path = prepared["excel_path"]
         else:
-            print("表格为空，未导出 Excel。")
+            excel_path = parse_and_save(html_content, excel_save_path, file_prefix="存量查询")
     else:
         print("未获取到 HTML，程序结束。")
+
+    fingerprint = _source_fingerprint(os.path.join(excel_save_path, META_FILENAME)) if html_content else None
+    return {"html_found": bool(html_content), "excel_path": excel_path, "fingerprint": fingerprint}
+
+
+if __name__ == '__main__':
+    run({"data_dir": sys.argv[1] if len(sys.argv) >= 2 else default_save_path})
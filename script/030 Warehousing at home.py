@@ -3,7 +3,7 @@
 021 Merge excel.py
 说明：
 - 在库存表中插入所需列、生成“第一页副本/家里库存”、按 4 位/5 位编码把“家里库存”的数量回填到库存表 M 列，
-  并逐条打印匹配详情。
+  逐条匹配详情写入 data/audit/030_backfill.jsonl（LOG_LEVEL=DEBUG 时也打印）。
 - ⚠️ 将“等待您查看”的收到时间写入 M3 的动作放在**全部匹配与格式化完成之后**再执行。
 """
 
@@ -17,6 +17,11 @@ from openpyxl.styles import PatternFill, Alignment
 from openpyxl.utils import get_column_letter
 from openpyxl.worksheet.views import Selection
 
+from tracer import span
+from stage_log import get_logger, counters, audit_file
+
+log = get_logger(__file__)
+
 # =========================================
 # 🔧 CONFIG｜集中配置（只改这里）
 # -----------------------------------------
@@ -76,6 +81,7 @@ CONFIG = {
     "backfill_target_col_index": 13,  # 回填到库存表的列索引（M列=13）
     "regex_4digit_dash": r"\d{4}-",   # 'dddd-' 用后4位匹配
     "regex_5digit": r"\d{5}",         # 5位标准编号匹配
+    "backfill_audit_name": "030_backfill",  # 逐条匹配明细：data/audit/030_backfill.jsonl
 
     # 8) 会计格式与对齐（G~Q）
     "acc_fmt_cols": (7, 17),  # 列范围（G=7 ~ Q=17）
@@ -89,6 +95,13 @@ CONFIG = {
 }
 # =========================================
 
+# 修改 pipeline 工作簿会话中的“总库存”（独立运行时自行读写文件）
+WORKBOOK_ACCESS = "write"
+
+# 阶段依赖声明（见 scheduler.py）：插入列会移动整张库存表
+INPUTS = ["sheet:库存表", "sheet:第一页", "file:mail_meta.json"]
+OUTPUTS = ["sheet:库存表", "sheet:第一页副本", "sheet:家里库存"]
+
 
 def _read_waiting_time(folder, meta_name, key):
     """读取 mail_meta.json 中的 selected_waiting_received_at（字符串）"""
@@ -105,22 +118,27 @@ def _read_waiting_time(folder, meta_name, key):
     return None
 
 
-def main(cfg: dict):
+def main(cfg: dict, folder_path: str, session=None):
     # ---------- 路径 ----------
-    folder_path = sys.argv[1] if len(sys.argv) >= 2 else cfg["default_folder"]
     if not os.path.exists(folder_path):
         print(f"❌ 路径不存在: {folder_path}")
         sys.exit(1)
 
-    files = glob.glob(os.path.join(folder_path, cfg["inventory_pattern"]))
-    if not files:
-        print("❌ 未找到包含“总库存”的文件")
-        sys.exit(1)
-    latest_file = max(files, key=os.path.getmtime)
-    print(f"📄 处理文件：{latest_file}")
-
-    # ---------- 打开工作簿 ----------
-    wb = load_workbook(latest_file)
+    if session is not None:
+        # ---------- 共用会话中的工作簿 ----------
+        wb = session.workbook()
+        latest_file = session.path
+        print(f"📄 处理文件：{latest_file}")
+    else:
+        files = glob.glob(os.path.join(folder_path, cfg["inventory_pattern"]))
+        if not files:
+            print("❌ 未找到包含“总库存”的文件")
+            sys.exit(1)
+        latest_file = max(files, key=os.path.getmtime)
+        print(f"📄 处理文件：{latest_file}")
+
+        # ---------- 打开工作簿 ----------
+        wb = load_workbook(latest_file)
     if cfg["target_sheet"] not in wb.sheetnames:
         print(f"❌ 缺少工作表：{cfg['target_sheet']}")
         sys.exit(1)
@@ -140,8 +158,9 @@ def main(cfg: dict):
         sh.unmerge_cells(str(rng))
 
     # ---------- 插入列 ----------
-    sh.insert_cols(10, cfg["insert_after_J_cols"])  # J 后插入
-    sh.insert_cols(3,  cfg["insert_after_B_cols"])  # B 后插入（编号列）
+    with span("insert_cols", rows=sh.max_row, cols=sh.max_column):
+        sh.insert_cols(10, cfg["insert_after_J_cols"])  # J 后插入
+        sh.insert_cols(3,  cfg["insert_after_B_cols"])  # B 后插入（编号列）
 
     # ---------- 对齐 ----------
     for c in sh[cfg["center_col_letter"]]:
@@ -206,57 +225,69 @@ def main(cfg: dict):
                     if c.value is not None:
                         c.number_format = "#,##0.00"
 
-    # ---------- 回填到库存表 M列（逐条打印匹配） ----------
-    if cfg["home_sheet_name"] in wb.sheetnames:
-        s_home = wb[cfg["home_sheet_name"]]
-        tgt_col = cfg["backfill_target_col_index"]  # 13 = M
-
-        # 构建映射：key -> (该行的 Cell 列表, 行号)
-        map4, map5 = {}, {}
-        for r in sh.iter_rows(min_row=2, max_row=last_empty_row - 1, max_col=tgt_col):
-            cval = r[2].value  # C列（编号）
-            if not cval:
-                continue
-            s = str(cval)
-            if len(s) >= 4:
-                map4[s[-4:]] = (r, r[0].row)      # 后4位映射
-            map5[s.zfill(5)] = (r, r[0].row)       # 5位映射
-
-        cnt_4 = cnt_5 = cnt_miss = 0
-
-        for idx, row in enumerate(s_home.iter_rows(min_row=2, values_only=True), start=2):
-            raw = str(row[0]).strip() if row[0] else ""
-            name = row[1]
-            qty = row[2]
-
-            if re.fullmatch(cfg["regex_4digit_dash"], raw):
-                k = raw[:4]
-                if k in map4:
-                    cells, rownum = map4[k]
-                    c_val = cells[2].value
-                    sh.cell(row=rownum, column=tgt_col).value = qty
-                    print(f"✅ 回填(后4位匹配) 源行{idx} [{raw} | {name}] 数量={qty} → 目标行{rownum} (C={c_val}) → M{rownum}")
-                    cnt_4 += 1
+    # ---------- 回填到库存表 M列（逐条匹配明细写入审计文件，DEBUG 级别时也打印） ----------
+    with span("backfill") as trace_args, audit_file(folder_path, cfg["backfill_audit_name"]) as audit:
+        if cfg["home_sheet_name"] in wb.sheetnames:
+            s_home = wb[cfg["home_sheet_name"]]
+            tgt_col = cfg["backfill_target_col_index"]  # 13 = M
+
+            # 构建映射：key -> (该行的 Cell 列表, 行号)
+            map4, map5 = {}, {}
+            for r in sh.iter_rows(min_row=2, max_row=last_empty_row - 1, max_col=tgt_col):
+                cval = r[2].value  # C列（编号）
+                if not cval:
+                    continue
+                s = str(cval)
+                if len(s) >= 4:
+                    map4[s[-4:]] = (r, r[0].row)      # 后4位映射
+                map5[s.zfill(5)] = (r, r[0].row)       # 5位映射
+
+            cnt_4 = cnt_5 = cnt_miss = 0
+
+            for idx, row in enumerate(s_home.iter_rows(min_row=2, values_only=True), start=2):
+                raw = str(row[0]).strip() if row[0] else ""
+                name = row[1]
+                qty = row[2]
+
+                if re.fullmatch(cfg["regex_4digit_dash"], raw):
+                    k = raw[:4]
+                    if k in map4:
+                        cells, rownum = map4[k]
+                        c_val = cells[2].value
+                        sh.cell(row=rownum, column=tgt_col).value = qty
+                        audit.write({"source_row": idx, "code": raw, "name": name, "qty": qty,
+                                     "match": "4", "target_row": rownum, "c": c_val})
+                        log.debug("✅ 回填(后4位匹配) 源行%s [%s | %s] 数量=%s → 目标行%s (C=%s) → M%s",
+                                  idx, raw, name, qty, rownum, c_val, rownum)
+                        cnt_4 += 1
+                    else:
+                        audit.write({"source_row": idx, "code": raw, "name": name, "qty": qty, "match": "miss4"})
+                        log.debug("❔ 未匹配(后4位) 源行%s [%s | %s]", idx, raw, name)
+                        cnt_miss += 1
+
+                elif re.fullmatch(cfg["regex_5digit"], raw):
+                    k = raw.zfill(5)
+                    if k in map5:
+                        cells, rownum = map5[k]
+                        c_val = cells[2].value
+                        sh.cell(row=rownum, column=tgt_col).value = qty
+                        audit.write({"source_row": idx, "code": raw, "name": name, "qty": qty,
+                                     "match": "5", "target_row": rownum, "c": c_val})
+                        log.debug("✅ 回填(5位匹配)  源行%s [%s | %s] 数量=%s → 目标行%s (C=%s) → M%s",
+                                  idx, raw, name, qty, rownum, c_val, rownum)
+                        cnt_5 += 1
+                    else:
+                        audit.write({"source_row": idx, "code": raw, "name": name, "qty": qty, "match": "miss5"})
+                        log.debug("❔ 未匹配(5位)   源行%s [%s | %s]", idx, raw, name)
+                        cnt_miss += 1
                 else:
-                    print(f"❔ 未匹配(后4位) 源行{idx} [{raw} | {name}]")
+                    audit.write({"source_row": idx, "code": raw, "name": name, "qty": qty, "match": "skip"})
+                    log.debug("⏭️ 跳过(格式不符) 源行%s [%s | %s]", idx, raw, name)
                     cnt_miss += 1
 
-            elif re.fullmatch(cfg["regex_5digit"], raw):
-                k = raw.zfill(5)
-                if k in map5:
-                    cells, rownum = map5[k]
-                    c_val = cells[2].value
-                    sh.cell(row=rownum, column=tgt_col).value = qty
-                    print(f"✅ 回填(5位匹配)  源行{idx} [{raw} | {name}] 数量={qty} → 目标行{rownum} (C={c_val}) → M{rownum}")
-                    cnt_5 += 1
-                else:
-                    print(f"❔ 未匹配(5位)   源行{idx} [{raw} | {name}]")
-                    cnt_miss += 1
-            else:
-                print(f"⏭️ 跳过(格式不符) 源行{idx} [{raw} | {name}]")
-                cnt_miss += 1
-
-        print(f"📊 回填汇总：后4位匹配 {cnt_4} 条，5位匹配 {cnt_5} 条，未命中/跳过 {cnt_miss} 条。")
+            log.info("📊 回填汇总：后4位匹配 %d 条，5位匹配 %d 条，未命中/跳过 %d 条。", cnt_4, cnt_5, cnt_miss)
+            counters().update(backfill_matched_4=cnt_4, backfill_matched_5=cnt_5, backfill_missed=cnt_miss)
+            trace_args.update(rows=s_home.max_row - 1, matched_4=cnt_4, matched_5=cnt_5, missed=cnt_miss)
 
     # ---------- 会计格式与右对齐（G~Q） ----------
     c1, c2 = cfg["acc_fmt_cols"]
@@ -300,10 +331,18 @@ def main(cfg: dict):
         print("🕒 没有可写入的等待时间（mail_meta.json 缺失或键为空）")
 
     # ---------- 保存 ----------
-    wb.save(latest_file)
-    wb.close()
-    print(f"🎉 已完成处理并保存: {latest_file}")
+    if session is None:
+        wb.save(latest_file)
+        wb.close()
+        print(f"🎉 已完成处理并保存: {latest_file}")
+    else:
+        print(f"🎉 已完成处理（由工作簿会话统一保存）: {latest_file}")
+    return {"inventory_path": latest_file}
+
+
+def run(context: dict) -> dict:
+    return main(CONFIG, context["data_dir"], context.get("workbook_session"))
 
 
 if __name__ == "__main__":
-    main(CONFIG)
+    main(CONFIG, sys.argv[1] if len(sys.argv) >= 2 else CONFIG["default_folder"])
@@ -21,116 +21,157 @@ BORDER_COLS = (11, 20)        # 列 K(11)~T(20)（含端点）
 FONT7_COLS = [11, 14]         # K、N 列设 7 号字
 FONT7_ROWS = (4, 54)          # 行 4~54（含端点）
 
-# =======================
-# 路径与文件
-# =======================
-inv_dir = sys.argv[1] if len(sys.argv) >= 2 else DEFAULT_INV_DIR
-if not os.path.exists(inv_dir):
-    print(f"❌ 库存目录不存在: {inv_dir}"); sys.exit(1)
-
-demand_file = os.path.join(DATA_DIR, DEMAND_XLSX)
-if not os.path.exists(demand_file):
-    print(f"❌ 需求文件不存在: {demand_file}"); sys.exit(1)
-
-inventory_file = None
-for f in os.listdir(inv_dir):
-    if f.endswith(".xlsx") and "总库存" in f:
-        inventory_file = os.path.join(inv_dir, f); break
-if not inventory_file:
-    print("❌ 未找到包含“总库存”的文件"); sys.exit(1)
-
-# =======================
-# 打开工作簿
-# =======================
-wb_demand = openpyxl.load_workbook(demand_file, data_only=True)
-if DEMAND_SHEET not in wb_demand.sheetnames:
-    print(f"❌ 需求缺少工作表: {DEMAND_SHEET}"); sys.exit(1)
-sheet_demand = wb_demand[DEMAND_SHEET]
-
-wb_inventory = openpyxl.load_workbook(inventory_file)
-if INV_SHEET not in wb_inventory.sheetnames:
-    print(f"❌ 库存缺少工作表: {INV_SHEET}"); sys.exit(1)
-sheet_inventory = wb_inventory[INV_SHEET]
-
-# =======================
-# 构建映射：编码 → (B,C,D,E)
-# =======================
-demand_data = {}
-for a, b, c, d, e in sheet_demand.iter_rows(min_row=2, max_col=5, values_only=True):
-    if a is None: continue
-    key = str(a).strip()
-    if not key: continue
-    demand_data[key] = (b, c, d, e)
-
-# =======================
-# 写入：K/N/P/T
-# =======================
-updated = 0
-for row in sheet_inventory.iter_rows(min_row=START_ROW, max_col=20):
-    code = row[2].value  # C列
-    if code is None: continue
-    code = str(code).strip()
-    vals = demand_data.get(code)
-    if not vals: continue
-    r = row[0].row
-    sheet_inventory.cell(row=r, column=11, value=vals[0])  # K ← B
-    sheet_inventory.cell(row=r, column=14, value=vals[1])  # N ← C
-    sheet_inventory.cell(row=r, column=16, value=vals[2])  # P ← D
-    sheet_inventory.cell(row=r, column=20, value=vals[3])  # T ← E
-    updated += 1
-
-# =======================
-# 对齐（K~T，右对齐）
-# =======================
-def align_range(sheet, start_row, c1, c2, h='right'):
-    for col in range(c1, c2 + 1):
-        for r in sheet.iter_rows(min_row=start_row, min_col=col, max_col=col):
-            for cell in r:
-                cell.alignment = Alignment(horizontal=h)
-
-align_range(sheet_inventory, START_ROW, *ALIGN_COL_RANGE)
-
-# >>> 新增：T 列左对齐 <<<
-for r in sheet_inventory.iter_rows(min_row=START_ROW, min_col=20, max_col=20):
-    for cell in r:
-        cell.alignment = Alignment(horizontal='left')
-
-
-# =======================
-# 边框与字体
-# =======================
-thin = Border(top=Side(style="thin"), left=Side(style="thin"),
-              right=Side(style="thin"), bottom=Side(style="thin"))
-
-r1, r2 = BORDER_ROWS
-c1, c2 = BORDER_COLS
-
-# 边框 + 基础10号字
-for rows in sheet_inventory.iter_rows(min_row=r1, max_row=r2, min_col=c1, max_col=c2):
-    for cell in rows:
-        cell.border = thin
-        cell.font = Font(size=10)
-
-# 指定列改 7 号
-fr1, fr2 = FONT7_ROWS
-for col in FONT7_COLS:
-    for rows in sheet_inventory.iter_rows(min_row=fr1, max_row=fr2, min_col=col, max_col=col):
-        for cell in rows:
-            cell.font = Font(size=7)
-
-# 中文缩小为 5 号（K、N 从第 5 行起）
-def has_cn(s): return bool(re.search(r'[\u4e00-\u9fff]', str(s)))
-for col in [11, 14]:
-    for rows in sheet_inventory.iter_rows(min_row=START_ROW, min_col=col, max_col=col):
+# 修改 pipeline 工作簿会话中的“总库存”（独立运行时自行读写文件）
+WORKBOOK_ACCESS = "write"
+
+# 阶段依赖声明（见 scheduler.py）：K~T 列写值并统一对齐/边框/字体
+INPUTS = ["file:list.xlsx", "sheet:库存表!C"]
+OUTPUTS = ["sheet:库存表!K:T"]
+
+def cache_inputs(context: dict) -> list[str]:
+    """阶段缓存键的额外输入：需求表 list.xlsx 的内容"""
+    return [os.path.join(DATA_DIR, DEMAND_XLSX)]
+
+
+def load_demand_index() -> dict:
+    """读取 list.xlsx 需求表，构建映射：编码 → (B,C,D,E)"""
+    demand_file = os.path.join(DATA_DIR, DEMAND_XLSX)
+    if not os.path.exists(demand_file):
+        print(f"❌ 需求文件不存在: {demand_file}"); sys.exit(1)
+
+    wb_demand = openpyxl.load_workbook(demand_file, data_only=True)
+    if DEMAND_SHEET not in wb_demand.sheetnames:
+        print(f"❌ 需求缺少工作表: {DEMAND_SHEET}"); sys.exit(1)
+    sheet_demand = wb_demand[DEMAND_SHEET]
+
+    demand_data = {}
+    for a, b, c, d, e in sheet_demand.iter_rows(min_row=2, max_col=5, values_only=True):
+        if a is None: continue
+        key = str(a).strip()
+        if not key: continue
+        demand_data[key] = (b, c, d, e)
+    return demand_data
+
+
+def prefetch(context: dict) -> dict:
+    """scheduler 在进程池中提前构建需求映射（不依赖总库存，可与前序阶段并行）"""
+    return load_demand_index()
+
+
+def run(context: dict) -> dict:
+    # =======================
+    # 路径与文件
+    # =======================
+    inv_dir = context["data_dir"]
+    if not os.path.exists(inv_dir):
+        print(f"❌ 库存目录不存在: {inv_dir}"); sys.exit(1)
+
+    # =======================
+    # 构建映射：编码 → (B,C,D,E)（scheduler 已提前构建时直接使用）
+    # =======================
+    demand_data = context.get("prefetched", {}).get(os.path.basename(__file__))
+    if demand_data is None:
+        demand_data = load_demand_index()
+
+    session = context.get("workbook_session")
+    inventory_file = None
+    if session is not None:
+        wb_inventory = session.workbook()
+        inventory_file = session.path
+    else:
+        for f in os.listdir(inv_dir):
+            if f.endswith(".xlsx") and "总库存" in f:
+                inventory_file = os.path.join(inv_dir, f); break
+        if not inventory_file:
+            print("❌ 未找到包含“总库存”的文件"); sys.exit(1)
+
+    # =======================
+    # 打开工作簿
+    # =======================
+    if session is None:
+        wb_inventory = openpyxl.load_workbook(inventory_file)
+    if INV_SHEET not in wb_inventory.sheetnames:
+        print(f"❌ 库存缺少工作表: {INV_SHEET}"); sys.exit(1)
+    sheet_inventory = wb_inventory[INV_SHEET]
+
+    # =======================
+    # 写入：K/N/P/T
+    # =======================
+    updated = 0
+    for row in sheet_inventory.iter_rows(min_row=START_ROW, max_col=20):
+        code = row[2].value  # C列
+        if code is None: continue
+        code = str(code).strip()
+        vals = demand_data.get(code)
+        if not vals: continue
+        r = row[0].row
+        sheet_inventory.cell(row=r, column=11, value=vals[0])  # K ← B
+        sheet_inventory.cell(row=r, column=14, value=vals[1])  # N ← C
+        sheet_inventory.cell(row=r, column=16, value=vals[2])  # P ← D
+        sheet_inventory.cell(row=r, column=20, value=vals[3])  # T ← E
+        updated += 1
+
+    # =======================
+    # 对齐（K~T，右对齐）
+    # =======================
+    def align_range(sheet, start_row, c1, c2, h='right'):
+        for col in range(c1, c2 + 1):
+            for r in sheet.iter_rows(min_row=start_row, min_col=col, max_col=col):
+                for cell in r:
+                    cell.alignment = Alignment(horizontal=h)
+
+    align_range(sheet_inventory, START_ROW, *ALIGN_COL_RANGE)
+
+    # >>> 新增：T 列左对齐 <<<
+    for r in sheet_inventory.iter_rows(min_row=START_ROW, min_col=20, max_col=20):
+        for cell in r:
+            cell.alignment = Alignment(horizontal='left')
+
+
+    # =======================
+    # 边框与字体
+    # =======================
+    thin = Border(top=Side(style="thin"), left=Side(style="thin"),
+                  right=Side(style="thin"), bottom=Side(style="thin"))
+
+    r1, r2 = BORDER_ROWS
+    c1, c2 = BORDER_COLS
+
+    # 边框 + 基础10号字
+    for rows in sheet_inventory.iter_rows(min_row=r1, max_row=r2, min_col=c1, max_col=c2):
         for cell in rows:
-            if cell.value is not None and has_cn(cell.value):
-                cell.font = Font(size=5)
-
-# =======================
-# 保存
-# =======================
-try:
-    wb_inventory.save(inventory_file)
-    print(f"✅ 更新 {updated} 行 | 文件: {os.path.basename(inventory_file)}")
-except Exception as e:
-    print(f"❌ 保存失败: {e}")
+            cell.border = thin
+            cell.font = Font(size=10)
+
+    # 指定列改 7 号
+    fr1, fr2 = FONT7_ROWS
+    for col in FONT7_COLS:
+        for rows in sheet_inventory.iter_rows(min_row=fr1, max_row=fr2, min_col=col, max_col=col):
+            for cell in rows:
+                cell.font = Font(size=7)
+
+    # 中文缩小为 5 号（K、N 从第 5 行起）
+    def has_cn(s): return bool(re.search(r'[\u4e00-\u9fff]', str(s)))
+    for col in [11, 14]:
+        for rows in sheet_inventory.iter_rows(min_row=START_ROW, min_col=col, max_col=col):
+            for cell in rows:
+                if cell.value is not None and has_cn(cell.value):
+                    cell.font = Font(size=5)
+
+    # =======================
+    # 保存
+    # =======================
+    if session is not None:
+        print(f"✅ 更新 {updated} 行 | 文件: {os.path.basename(inventory_file)}（由工作簿会话统一保存）")
+    else:
+        try:
+            wb_inventory.save(inventory_file)
+            print(f"✅ 更新 {updated} 行 | 文件: {os.path.basename(inventory_file)}")
+        except Exception as e:
+            print(f"❌ 保存失败: {e}")
+
+    return {"inventory_path": inventory_file, "updated": updated}
+
+
+if __name__ == "__main__":
+    run({"data_dir": sys.argv[1] if len(sys.argv) >= 2 else DEFAULT_INV_DIR})
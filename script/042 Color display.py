@@ -11,12 +11,18 @@
 import os
 import sys
 import glob
+import logging
 from pathlib import Path
 
 import openpyxl
 from openpyxl.styles import PatternFill
 from openpyxl.utils import column_index_from_string, get_column_letter
 
+from tracer import span
+from stage_log import get_logger, counters
+
+log = get_logger(__file__)
+
 
 # =========================================================
 # ✅ 配置区（只改这里即可）
@@ -52,8 +58,14 @@ COLOR_GREEN       = "00FF00"     # 绿：仅涂 COL_N（不扩展淡色）
 COLOR_LIGHT_PURPLE = "CCC0DA"    # 淡紫：扩展到 ROW_FILL_RANGES
 COLOR_LIGHT_RED    = "E6B8B7"    # 淡红：扩展到 ROW_FILL_RANGES
 
-# 6) 输出
-VERBOSE = True                   # True=打印每行着色信息（会比较多）
+# 6) 输出：每行着色信息为 DEBUG 级别日志（LOG_LEVEL=DEBUG 时打印），各颜色行数计入阶段计数器
+
+# 修改 pipeline 工作簿会话中的“总库存”（独立运行时自行读写文件）
+WORKBOOK_ACCESS = "write"
+
+# 阶段依赖声明（见 scheduler.py）
+INPUTS = ["sheet:库存表!C", "sheet:库存表!J", "sheet:库存表!L"]
+OUTPUTS = ["sheet:库存表!A:T"]
 
 
 # =========================================================
@@ -161,6 +173,9 @@ def process_inventory_data(sheet):
     # 淡色扩展时，保护深色列不被覆盖
     exclude_light = {COL_N}
 
+    verbose = log.isEnabledFor(logging.DEBUG)
+    stats = counters()
+
     # 遍历：A ~ max_col（比如到T=20列）
     for row in sheet.iter_rows(min_row=2, max_col=max_col, values_only=False):
         row_idx = row[0].row
@@ -170,8 +185,9 @@ def process_inventory_data(sheet):
         if skip_val in SKIP_CODES:
             if CLEAR_FILL_ON_SKIPPED_ROW:
                 clear_row_fills(sheet, row_idx, max_col)
-            if VERBOSE:
-                print(f"行 {row_idx} → 跳过着色（{SKIP_COL}列={skip_val}）")
+            stats["skipped"] += 1
+            if verbose:
+                log.debug("行 %s → 跳过着色（%s列=%s）", row_idx, SKIP_COL, skip_val)
             continue
 
         # 2) 取 m / n
@@ -188,42 +204,59 @@ def process_inventory_data(sheet):
         if (m == 0 and n > 0) or (m < 0):
             cell_n.fill = deep_purple
             apply_light_fill(sheet, row_idx, light_purple, exclude_light)
-            if VERBOSE:
-                print(f"行 {row_idx} → 深紫({COL_N}) + 淡紫铺色: n={n}, m={m}")
+            stats["purple"] += 1
+            if verbose:
+                log.debug("行 %s → 深紫(%s) + 淡紫铺色: n=%s, m=%s", row_idx, COL_N, n, m)
 
         # 情况2：绿色（不扩展淡色）
         elif m != 0 and (n / m) < 1:
             cell_n.fill = green
-            if VERBOSE:
-                print(f"行 {row_idx} → 绿色({COL_N}): n={n}, m={m}")
+            stats["green"] += 1
+            if verbose:
+                log.debug("行 %s → 绿色(%s): n=%s, m=%s", row_idx, COL_N, n, m)
 
         # 情况3：深红 + 淡红扩展
         elif m != 0 and (n / m) >= 1:
             cell_n.fill = deep_red
             apply_light_fill(sheet, row_idx, light_red, exclude_light)
-            if VERBOSE:
-                print(f"行 {row_idx} → 深红({COL_N}) + 淡红铺色: n={n}, m={m}")
+            stats["red"] += 1
+            if verbose:
+                log.debug("行 %s → 深红(%s) + 淡红铺色: n=%s, m=%s", row_idx, COL_N, n, m)
 
 
-def main(folder_path: str):
+def main(folder_path: str, session=None):
     folder = Path(folder_path).resolve()
     if not folder.exists():
         print(f"❌ 文件夹路径不存在: {folder}")
         sys.exit(1)
 
-    inventory_file = pick_inventory_file(folder)
-    print(f"✅ 找到文件：{inventory_file}")
+    if session is not None:
+        wb = session.workbook()
+        inventory_file = session.path
+        print(f"✅ 找到文件：{inventory_file}")
+    else:
+        inventory_file = pick_inventory_file(folder)
+        print(f"✅ 找到文件：{inventory_file}")
 
-    wb = openpyxl.load_workbook(inventory_file, data_only=LOAD_DATA_ONLY)
+        wb = openpyxl.load_workbook(inventory_file, data_only=LOAD_DATA_ONLY)
     if SHEET_NAME not in wb.sheetnames:
         print(f"❌ 工作表不存在：{SHEET_NAME}，实际为：{wb.sheetnames}")
         sys.exit(1)
 
     sheet = wb[SHEET_NAME]
-    process_inventory_data(sheet)
+    with span("process_inventory_data", rows=sheet.max_row, cols=sheet.max_column):
+        process_inventory_data(sheet)
+
+    if session is not None:
+        print(f"✅ 着色完成（由工作簿会话统一保存）：{inventory_file}")
+    else:
+        wb.save(inventory_file)
+        print(f"✅ 处理后的文件已保存（覆盖原文件）：{inventory_file}")
+    return {"inventory_path": inventory_file}
+
 
-    wb.save(inventory_file)
-    print(f"✅ 处理后的文件已保存（覆盖原文件）：{inventory_file}")
+def run(context: dict) -> dict:
+    return main(context["data_dir"], context.get("workbook_session"))
 
 
 if __name__ == "__main__":
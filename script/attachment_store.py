@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+attachment_store.py
+- 附件按内容存一份：blobs/<SHA-256>，data/ 中只放指向它的硬链接（跨文件系统时退回符号链接 / 复制），文件名可读
+- 同一封邮件重跑、补跑：blob 已存在 → 不写盘；链接已存在且内容相同 → 只刷新修改时间（021 按 mtime 选最新的基底文件）
+- index.sqlite3 记录每个 blob 来自哪封邮件（Message-ID、UID、主题、收到时间）以及链接到了哪里
+- 020 分段下载的附件直接解码写入 blobs/（SPOOL_DIR 默认就是这里），不再复制
+- 位置：ATTACHMENT_STORE_DIR（默认 ~/.cache/meidiauto/attachments）；ATTACHMENT_STORE=0 关闭（退回每次写新文件）
+- 链接方式：ATTACHMENT_LINK=hardlink（默认）| symlink | copy
+- 超过 ATTACHMENT_RETENTION_DAYS（默认同 MAIL_STORE_RETENTION_DAYS，按最后使用时间）的 blob 在关闭时清理
+- 查询：
+    python script/attachment_store.py list --name 合肥市 --since 2025-09-01
+    python script/attachment_store.py which data/合肥市和裕达_20250919_100005.xlsx
+    python script/attachment_store.py stats | prune
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "meidiauto", "attachments")
+BLOB_DIR = os.path.join(os.getenv("ATTACHMENT_STORE_DIR") or DEFAULT_ROOT, "blobs")
+INDEX_FILENAME = "index.sqlite3"
+LINK_MODES = ("hardlink", "symlink", "copy")
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK  # 临时文件是 0600；blob 与 data/ 中的硬链接共用权限，按普通新文件处理
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attachments (
+    sha256      TEXT    NOT NULL,
+    name        TEXT    NOT NULL,
+    message_id  TEXT    NOT NULL DEFAULT '',
+    uid         TEXT,
+    subject     TEXT,
+    received_at TEXT,
+    size        INTEGER,
+    path        TEXT,
+    stored_at   REAL    NOT NULL,
+    PRIMARY KEY (sha256, message_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_attachments_received_at ON attachments (received_at);
+"""
+
+
+def enabled() -> bool:
+    return os.getenv("ATTACHMENT_STORE", "1") != "0"
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class AttachmentStore:
+    def __init__(self, root: str | None = None, link_mode: str | None = None, retention_days: int | None = None):
+        self.root = root or os.getenv("ATTACHMENT_STORE_DIR") or DEFAULT_ROOT
+        self.blob_dir = os.path.join(self.root, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.link_mode = (link_mode or os.getenv("ATTACHMENT_LINK") or "hardlink").lower()
+        if self.link_mode not in LINK_MODES:
+            raise ValueError(f"❌ 未知的附件链接方式: {self.link_mode}（可选 {', '.join(LINK_MODES)}）")
+        if retention_days is None:
+            retention_days = int(os.getenv("ATTACHMENT_RETENTION_DAYS") or os.getenv("MAIL_STORE_RETENTION_DAYS", "90"))
+        self.retention_days = retention_days
+        self.db = sqlite3.connect(os.path.join(self.root, INDEX_FILENAME), timeout=30)  # 多租户子进程同时写
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(_SCHEMA)
+
+    def blob_path(self, sha: str) -> str:
+        return os.path.join(self.blob_dir, sha)
+
+    # ---------- 写入 blob ----------
+    def put_bytes(self, data: bytes) -> tuple[str, bool]:
+        """返回 (SHA-256, 是否新写入)；已有相同内容时不写盘"""
+        sha = hashlib.sha256(data).hexdigest()
+        blob = self.blob_path(sha)
+        if os.path.exists(blob):
+            return sha, False
+        with tempfile.NamedTemporaryFile(dir=self.blob_dir, suffix=".part", delete=False) as out:
+            out.write(data)
+        os.chmod(out.name, FILE_MODE)
+        os.replace(out.name, blob)
+        return sha, True
+
+    def add_file(self, path: str, sha: str) -> bool:
+        """把已在磁盘上的文件（如分段下载的暂存文件）收进 blobs/；已存在或本身就是 blob 时什么都不做"""
+        blob = self.blob_path(sha)
+        if os.path.exists(blob):
+            return False
+        try:
+            os.link(path, blob)
+        except OSError:
+            shutil.copyfile(path, blob)
+        os.chmod(blob, FILE_MODE)
+        return True
+
+    # ---------- 链接到工作目录 ----------
+    def link(self, sha: str, dest: str) -> str:
+        """在 dest 放一个指向 blob 的链接；dest 已是相同内容时复用，不同内容时改名为 原名_<sha 前 8 位>"""
+        blob = self.blob_path(sha)
+        if os.path.lexists(dest) and not _same_content(dest, blob, sha):
+            base, ext = os.path.splitext(dest)
+            dest = f"{base}_{sha[:8]}{ext}"
+        if os.path.lexists(dest) and _same_content(dest, blob, sha):
+            os.utime(blob)  # prune 按 blob 的 mtime 判断是否还在用；复制模式下 dest 是独立文件，必须显式刷新 blob
+            return dest
+        if os.path.lexists(dest):
+            os.remove(dest)
+        self._make_link(blob, dest)
+        os.utime(blob)
+        return dest
+
+    def _make_link(self, blob: str, dest: str) -> None:
+        if self.link_mode == "hardlink":
+            try:
+                os.link(blob, dest)
+                return
+            except OSError:
+                pass  # 跨文件系统 / 不支持硬链接
+        if self.link_mode in ("hardlink", "symlink"):
+            try:
+                os.symlink(os.path.abspath(blob), dest)
+                return
+            except OSError:
+                pass  # Windows 无权限创建符号链接
+        shutil.copyfile(blob, dest)
+
+    # ---------- 索引 ----------
+    def record(self, sha: str, name: str, path: str, source: dict | None = None) -> None:
+        source = source or {}
+        self.db.execute(
+            "INSERT OR REPLACE INTO attachments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (sha, name, source.get("message_id") or "", source.get("uid"), source.get("subject"),
+             source.get("received_at"), os.path.getsize(self.blob_path(sha)), os.path.abspath(path), time.time()))
+        self.db.commit()
+
+    def find(self, name: str | None = None, since: str | None = None, sha: str | None = None) -> list[dict]:
+        sql = "SELECT * FROM attachments WHERE 1=1"
+        args = []
+        if name:
+            sql += " AND name LIKE ?"
+            args.append(f"%{name}%")
+        if since:
+            sql += " AND received_at >= ?"
+            args.append(since)
+        if sha:
+            sql += " AND sha256 = ?"
+            args.append(sha)
+        return [dict(r) for r in self.db.execute(sql + " ORDER BY received_at", args)]
+
+    # ---------- 维护 ----------
+    def prune(self) -> int:
+        """删除超过保留期未使用的 blob（及残留的 .part），以及 blob 已不存在的索引记录；返回删除的 blob 数"""
+        removed = 0
+        if self.retention_days > 0:
+            cutoff = time.time() - self.retention_days * 86400
+            for name in os.listdir(self.blob_dir):
+                path = os.path.join(self.blob_dir, name)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+        present = set(os.listdir(self.blob_dir))
+        stale = [(r["sha256"],) for r in self.db.execute("SELECT DISTINCT sha256 FROM attachments")
+                 if r["sha256"] not in present]
+        if stale:
+            self.db.executemany("DELETE FROM attachments WHERE sha256 = ?", stale)
+            self.db.commit()
+        return removed
+
+    def stats(self) -> dict:
+        blobs = [e for e in os.scandir(self.blob_dir) if e.is_file() and not e.name.endswith(".part")]
+        r = self.db.execute("SELECT COUNT(*), COUNT(DISTINCT sha256), COALESCE(SUM(size), 0) FROM attachments").fetchone()
+        return {"blobs": len(blobs), "blob_bytes": sum(e.stat().st_size for e in blobs),
+                "records": r[0], "recorded_blobs": r[1], "recorded_bytes": r[2]}
+
+    def close(self) -> None:
+        removed = self.prune()
+        if removed:
+            print(f"🧹 附件库清理了 {removed} 个超过 {self.retention_days} 天未使用的文件")
+        self.db.close()
+
+
+def _same_content(path: str, blob: str, sha: str) -> bool:
+    try:
+        if os.path.samefile(path, blob):
+            return True
+        return os.path.getsize(path) == os.path.getsize(blob) and file_digest(path) == sha
+    except OSError:
+        return False  # 断开的符号链接 / blob 已被清理
+
+
+def open_store() -> AttachmentStore | None:
+    if not enabled():
+        return None
+    try:
+        return AttachmentStore()
+    except Exception as e:
+        print(f"⚠️ 附件库不可用，本次直接写文件: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="附件内容寻址库查询")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_list = sub.add_parser("list", help="按附件名 / 收到日期列出")
+    p_list.add_argument("--name")
+    p_list.add_argument("--since", help="YYYY-MM-DD")
+    p_which = sub.add_parser("which", help="某个文件来自哪封邮件")
+    p_which.add_argument("path")
+    sub.add_parser("stats", help="统计")
+    sub.add_parser("prune", help="按保留期清理")
+    args = parser.parse_args()
+
+    store = AttachmentStore()
+    if args.cmd == "list":
+        for row in store.find(args.name, args.since):
+            print(f"{row['received_at']}  {row['sha256'][:12]}  {row['size']:>10,}B  {row['name']}  "
+                  f"UID {row['uid']}  {row['message_id']}")
+    elif args.cmd == "which":
+        rows = store.find(sha=file_digest(args.path))
+        if not rows:
+            print(f"❌ 附件库中没有与此文件内容相同的记录: {args.path}", file=sys.stderr)
+            sys.exit(1)
+        for row in rows:
+            print(f"{row['received_at']}  {row['subject']}  UID {row['uid']}  {row['message_id']}  → {row['path']}")
+    elif args.cmd == "stats":
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+    elif args.cmd == "prune":
+        print(f"🧹 删除 {store.prune()} 个")
+    store.db.close()
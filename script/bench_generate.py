@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+bench_generate.py
+- 为 benchmark.py 生成指定 SKU 数量的合成输入（结构与真实邮件/附件一致）：
+    合肥市和裕达_*.xlsx   基底工作簿：库存表（第4行表头）+ 出入库明细表（第3行表头）
+    存量查询.eml          HTML 表格正文的“等待您查看”邮件（由 020 的解析函数离线转成 存量查询_*.xlsx）
+    list.xlsx            需求表（工作表 2503：编号/外应存/家应存/月计划/备注）
+    mail_meta.json       030 写入 M3 用的邮件时间
+- 同一 (skus, seed) 生成的内容相同
+- 单独运行：python bench_generate.py <输出目录> <SKU数> [seed]
+"""
+import os
+import sys
+import json
+import random
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.header import Header
+
+import openpyxl
+
+BASE_FILENAME = "合肥市和裕达_20250919_100000.xlsx"
+MAIL_FILENAME = "存量查询.eml"
+DEMAND_FILENAME = "list.xlsx"
+DEMAND_SHEET = "2503"
+META_FILENAME = "mail_meta.json"
+
+INVENTORY_HEADERS = ["序号", "美的编码", "物料品名", "单位", "规格", "仓库", "期初", "入库", "库存"]
+DETAIL_HEADERS = ["录入日期", "客户子库", "单号", "美的编码", "物料品名", "单位", "仓库",
+                  "库存变动类别", "本期收入", "本期发出", "条形码", "备注", "代编码", "出入库日期"]
+STOCK_HEADERS = ["仓库", "存货编码", "存货名称", "规格", "主数量", "数量"]
+
+DETAIL_ROWS_PER_SKU = 2  # 出入库明细表行数 = SKU 数 × 2
+
+
+def sku_code(i: int) -> str:
+    """美的编码：030 取其中数字的后 5 位作为“编号”"""
+    return f"1{i % 100000:05d}-{i % 7}"
+
+
+def sku_number(i: int) -> str:
+    return f"{i % 100000:05d}"
+
+
+# ================================
+# 📗 合肥市 基底工作簿
+# ================================
+def write_base_workbook(path: str, skus: int, rng: random.Random) -> None:
+    wb = openpyxl.Workbook(write_only=True)
+
+    ws = wb.create_sheet("库存表")
+    ws.append(["", "重庆俊都仓储库存"])
+    ws.append([])
+    ws.append([None] * 7 + ["2025-09-19 10:00:00"])
+    ws.append(INVENTORY_HEADERS)
+    for i in range(skus):
+        ws.append([i + 1, sku_code(i), f"物料{i}", "件", f"S{i % 13}", "外仓",
+                   rng.randint(0, 500), rng.randint(0, 100), rng.randint(0, 800)])
+
+    det = wb.create_sheet("出入库明细表")
+    det.append(["出入库明细"])
+    det.append([])
+    det.append(DETAIL_HEADERS)
+    kinds = ["入库", "出库", "调整"]
+    for n in range(skus * DETAIL_ROWS_PER_SKU):
+        i = rng.randrange(skus)
+        det.append(["2025-09-01", "k", f"D{n}", sku_code(i), f"物料{i}", "件", "外仓", rng.choice(kinds),
+                    rng.randint(0, 50), rng.randint(0, 50), "", "", "", "2025-09-01"])
+    wb.save(path)
+
+
+# ================================
+# ✉️ 存量查询 HTML 邮件
+# ================================
+def write_stock_mail(path: str, skus: int, rng: random.Random) -> None:
+    rows = ["<tr>" + "".join(f"<th>{h}</th>" for h in STOCK_HEADERS) + "</tr>"]
+    for i in range(skus):
+        # 约三分之一用 “dddd-名称” 形式，对应 030 的后 4 位匹配
+        name = f"{sku_number(i)[-4:]}-物料{i}" if i % 3 == 0 else f"{sku_number(i)}物料{i}"
+        cells = [rng.choice(["成品库", "原料库"]), f"C{i}", name, "S",
+                 f"{rng.randint(0, 3000)}.00", f"{rng.randint(0, 30)}.00"]
+        rows.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>")
+    html = ("<html><head><meta charset='utf-8'></head><body>"
+            "<p>您好，存量查询结果如下：</p><table border='1'>" + "".join(rows) + "</table></body></html>")
+
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = Header("等待您查看：存量查询", "utf-8").encode()
+    msg["From"] = "report@example.com"
+    msg["Date"] = "Fri, 19 Sep 2025 10:00:05 +0800"
+    msg["Message-ID"] = f"<bench-{skus}@example.com>"
+    msg.attach(MIMEText(html, "html", "utf-8"))
+    with open(path, "wb") as f:
+        f.write(msg.as_bytes())
+
+
+# ================================
+# 📋 需求表 list.xlsx
+# ================================
+def write_demand(path: str, skus: int, rng: random.Random) -> None:
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(DEMAND_SHEET)
+    ws.append(["编号", "外应存", "家应存", "月计划", "备注"])
+    for i in range(0, skus, 2):  # 一半 SKU 有需求
+        ws.append([sku_number(i), rng.choice([0, 500, 1000, 3000]), rng.choice([0, 500, 1000]),
+                   rng.choice([0, 2800, 9000]), ""])
+    wb.save(path)
+
+
+def generate(folder: str, skus: int, seed: int = 1) -> dict:
+    """生成全部输入文件，返回 {类型: 路径}"""
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    paths = {
+        "base": os.path.join(folder, BASE_FILENAME),
+        "mail": os.path.join(folder, MAIL_FILENAME),
+        "demand": os.path.join(folder, DEMAND_FILENAME),
+        "meta": os.path.join(folder, META_FILENAME),
+    }
+    write_base_workbook(paths["base"], skus, rng)
+    write_stock_mail(paths["mail"], skus, rng)
+    write_demand(paths["demand"], skus, rng)
+    with open(paths["meta"], "w", encoding="utf-8") as f:
+        json.dump({"selected_waiting_received_at": "2025-09-19T10:00:05+08:00"}, f, ensure_ascii=False, indent=2)
+    return paths
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("用法: python bench_generate.py <输出目录> <SKU数> [seed]")
+        sys.exit(1)
+    out = generate(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 1)
+    for kind, path in out.items():
+        print(f"✅ {kind}: {path}")
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark.py
+- 端到端规模基准：按不同 SKU 数量生成合成输入（bench_generate.py），离线运行 020 解析 ~ 050，
+  记录每个阶段的用时、峰值内存（RSS）和每秒处理行数，结果保存为 JSON 便于对比
+- 每个规模在独立子进程中运行（互不影响内存峰值）；子进程逐阶段写进度，
+  超时/内存不足被杀时也能看出是哪个阶段撑不住
+- 用法：
+    python script/benchmark.py                          # 默认 1k / 10k / 100k
+    python script/benchmark.py --sizes 1000 5000 --with-image
+    python script/benchmark.py --compare 旧.json 新.json
+- 阶段输出写入 <工作目录>/<规模>/stages.log，不刷屏
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from contextlib import redirect_stdout
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+OFFLINE_PARSE_STAGE = "020 parse (offline)"
+STAGES = [
+    "021 Merge excel.py",
+    "030 Warehousing at home.py",
+    "032 Warehousing at out.py",
+    "033 list insertion.py",
+    "041 operation.py",
+    "042 Color display.py",
+    "050 mailtxt.py",
+]
+IMAGE_STAGE = "050 image.py"  # dpi=1200 整表绘图，规模大时极慢，默认不跑
+SAVE_STEP = "workbook_save"
+PROGRESS_FILENAME = "progress.json"
+
+
+# ================================
+# 📏 峰值内存
+# ================================
+def _read_hwm_kb() -> int | None:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Linux 下清零进程的峰值 RSS（VmHWM），使每个阶段单独统计；不支持时返回 False"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    kb = _read_hwm_kb()
+    if kb is None:
+        import resource
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            kb //= 1024  # macOS 单位为字节
+    return kb / 1024
+
+
+# ================================
+# 👶 子进程：跑一个规模
+# ================================
+def _offline_parse(data_dir: str, mail_path: str) -> int:
+    """020 的离线部分：邮件 → HTML 表格 → 存量查询_*.xlsx；返回表格行数"""
+    import email
+    from pipeline import load_stage
+
+    m020 = load_stage("020 Email download.py")
+    with open(mail_path, "rb") as f:
+        msg = email.message_from_bytes(f.read())
+    html = m020.extract_html_from_msg(msg)
+    rows = m020.parse_html_table(html, data_dir)
+    m020.save_to_excel(rows, data_dir, file_prefix="存量查询")
+    return len(rows)
+
+
+def run_size(skus: int, workdir: str, with_image: bool) -> None:
+    from pipeline import load_stage, run_stage
+    from workbook_session import WorkbookSession
+    import bench_generate
+
+    inputs_dir = os.path.join(workdir, "inputs")
+    data_dir = os.path.join(workdir, "data")
+    progress_path = os.path.join(workdir, PROGRESS_FILENAME)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+
+    _write_json(progress_path, {"skus": skus, "stages": [], "running": "generate"})
+    t = time.perf_counter()
+    paths = bench_generate.generate(inputs_dir, skus)
+    generate_seconds = time.perf_counter() - t
+    shutil.copy(paths["base"], data_dir)
+    shutil.copy(paths["meta"], data_dir)
+
+    # 033 从自己的 DATA_DIR 读取 list.xlsx：指向生成的需求表
+    load_stage("033 list insertion.py").DATA_DIR = inputs_dir
+
+    per_stage_peak = reset_peak_rss()
+    progress = {"skus": skus, "generate_seconds": generate_seconds,
+                "peak_is_per_stage": per_stage_peak, "stages": [], "running": None}
+
+    def record(name, ok, seconds, error=None):
+        rows_per_s = skus / seconds if seconds > 0 else None
+        progress["stages"].append({"stage": name, "ok": ok, "seconds": seconds, "rows": skus,
+                                   "rows_per_s": rows_per_s, "peak_rss_mb": peak_rss_mb(), "error": error})
+        progress["running"] = None
+        _write_json(progress_path, progress)
+        reset_peak_rss()
+
+    def start(name):
+        progress["running"] = name
+        _write_json(progress_path, progress)
+
+    context = {"data_dir": data_dir, "workbook_session": WorkbookSession(data_dir)}
+    stages = STAGES + ([IMAGE_STAGE] if with_image else [])
+
+    with open(os.path.join(workdir, "stages.log"), "w", encoding="utf-8") as log, redirect_stdout(log):
+        start(OFFLINE_PARSE_STAGE)
+        t = time.perf_counter()
+        try:
+            _offline_parse(data_dir, paths["mail"])
+            record(OFFLINE_PARSE_STAGE, True, time.perf_counter() - t)
+        except Exception as e:
+            record(OFFLINE_PARSE_STAGE, False, time.perf_counter() - t, f"{type(e).__name__}: {e}")
+
+        for stage in stages:
+            start(stage)
+            outcome = run_stage(stage, context)
+            record(stage, outcome["ok"], outcome["seconds"], outcome["error"])
+            if not outcome["ok"]:
+                break
+
+        start(SAVE_STEP)
+        t = time.perf_counter()
+        context["workbook_session"].close()
+        record(SAVE_STEP, True, time.perf_counter() - t)
+
+
+def _write_json(path: str, obj) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+# ================================
+# 🧑‍💼 父进程：调度各规模并汇总
+# ================================
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(sizes: list[int], workdir: str, with_image: bool, timeout: float | None) -> dict:
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "runs": [],
+    }
+    for skus in sizes:
+        size_dir = os.path.join(workdir, str(skus))
+        os.makedirs(size_dir, exist_ok=True)
+        progress_path = os.path.join(size_dir, PROGRESS_FILENAME)
+        if os.path.exists(progress_path):
+            os.remove(progress_path)  # 不读到上一次运行的进度
+        print(f"🚀 规模 {skus} SKU ...")
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", str(skus), size_dir]
+        if with_image:
+            cmd.append("--with-image")
+
+        started = time.perf_counter()
+        status = "completed"
+        try:
+            proc = subprocess.run(cmd, timeout=timeout, capture_output=True, text=True)
+            if proc.returncode != 0:
+                status = f"exit {proc.returncode}"
+                if proc.stderr:
+                    print(proc.stderr.strip()[-2000:])
+        except subprocess.TimeoutExpired:
+            status = "timeout"
+
+        try:
+            with open(progress_path, "r", encoding="utf-8") as f:
+                run = json.load(f)
+        except (OSError, ValueError):
+            run = {"skus": skus, "stages": [], "running": None}
+        run["status"] = status
+        run["wall_seconds"] = time.perf_counter() - started
+        failed = next((s["stage"] for s in run["stages"] if not s["ok"]), None)
+        run["broke_at"] = run.get("running") or failed
+        report["runs"].append(run)
+        print_run(run)
+    return report
+
+
+def print_run(run: dict) -> None:
+    print(f"\n📊 {run['skus']} SKU（{run.get('status')}，总计 {run.get('wall_seconds', 0):.1f}s）")
+    print(f"  {'阶段':<30} {'用时(s)':>9} {'峰值RSS(MB)':>12} {'行/秒':>12}")
+    for s in run["stages"]:
+        flag = "✅" if s["ok"] else "❌"
+        rps = f"{s['rows_per_s']:,.0f}" if s["rows_per_s"] else "-"
+        print(f"  {flag} {s['stage']:<28} {s['seconds']:>9.2f} {s['peak_rss_mb']:>12.1f} {rps:>12}")
+    if run.get("broke_at"):
+        print(f"  ⛔ 停在：{run['broke_at']}")
+    if not run.get("peak_is_per_stage", True):
+        print("  ℹ️ 当前平台无法按阶段清零峰值内存，峰值为进程累计值")
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    old_runs = {r["skus"]: {s["stage"]: s for s in r["stages"]} for r in old["runs"]}
+    print(f"📈 对比 {old.get('git_commit')} → {new.get('git_commit')}")
+    for run in new["runs"]:
+        before = old_runs.get(run["skus"])
+        if before is None:
+            continue
+        print(f"\n  {run['skus']} SKU")
+        for s in run["stages"]:
+            b = before.get(s["stage"])
+            if b is None or not b["seconds"]:
+                continue
+            ratio = s["seconds"] / b["seconds"]
+            flag = "🔺" if ratio > 1.1 else ("🔻" if ratio < 0.9 else "  ")
+            print(f"  {flag} {s['stage']:<28} {b['seconds']:>8.2f}s → {s['seconds']:>8.2f}s  ×{ratio:.2f}"
+                  f"   RSS {b['peak_rss_mb']:.0f} → {s['peak_rss_mb']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="美的仓储自动化 规模基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="SKU 数量列表")
+    parser.add_argument("--with-image", action="store_true", help=f"同时运行 {IMAGE_STAGE}")
+    parser.add_argument("--workdir", default=None, help="生成数据与日志的目录（默认临时目录）")
+    parser.add_argument("--timeout", type=float, default=None, help="单个规模的超时时间（秒）")
+    parser.add_argument("--out", default=None, help="结果 JSON 路径（默认 benchmark_results/bench_时间.json）")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两份结果 JSON")
+    parser.add_argument("--child", nargs=2, metavar=("SKUS", "DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_size(int(args.child[0]), args.child[1], args.with_image)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="meidi_bench_")
+    report = run_benchmark(args.sizes, workdir, args.with_image, args.timeout)
+
+    out = args.out or os.path.join("benchmark_results", f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    _write_json(out, report)
+    print(f"\n💾 结果已保存：{out}（数据目录：{workdir}）")
+
+
+if __name__ == "__main__":
+    main()
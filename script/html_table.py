@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+html_table.py
+- 020 解析邮件 HTML 表格的后端（可切换）：
+    lxml（默认）：HTMLPullParser 分块增量解析，每个 <tr> 结束就产出并释放，20 MB 的报表邮件内存也不随行数增长
+    bs4：原实现（BeautifulSoup + html.parser），整篇建树，作为对照和兜底
+- 后端产出正文中所有最外层 <table> 的行：(表格序号, 单元格文本列表)，按文档顺序；
+  文本语义与 bs4 的 get_text(strip=True) 一致：每段文本去首尾空白后直接拼接，忽略注释和 <script>/<style>；
+  嵌套表格的行与单元格算在外层表格里，同样按文档顺序计入
+- 未闭合的单元格 / 行（<tr><td>a<td>b</tr>，报表邮件里常见）按 HTML 规则隐式闭合（与浏览器、libxml2 一致）：
+  html.parser 不懂这条规则，会把后一个单元格嵌进前一个里；bs4 后端先把它们移回兄弟位置再取文本
+- 表头识别、跳过过宽的首行、重复表头、列数校验、按表头签名归类等规则在 020 的 parse_html_tables 中，两个后端共用
+- 选择：环境变量 HTML_TABLE_BACKEND=lxml|bs4；lxml 未安装时自动退回 bs4
+- 一致性自检（两个后端逐行比对并计时，不一致时返回非 0）：
+    python script/html_table.py data/last_mail_html.html [更多 .html / .eml ...]
+    python script/html_table.py --skus 5000              # 用 bench_generate 生成的合成邮件
+    python -m pytest script/html_table.py               # 残缺 HTML 的固定用例
+"""
+import os
+import sys
+import time
+from collections.abc import Iterator
+
+from lazy_import import lazy_import
+
+bs4 = lazy_import("bs4")
+lxml_etree = lazy_import("lxml.etree")
+
+ENV_VAR = "HTML_TABLE_BACKEND"
+DEFAULT_BACKEND = "lxml"
+FEED_CHARS = 64 * 1024  # lxml 每次喂入的字符数
+
+
+# ================================
+# 🍲 bs4 + html.parser（原实现）
+# ================================
+def iter_rows_bs4(html_content: str) -> Iterator[tuple[int, list[str]]]:
+    soup = bs4.BeautifulSoup(html_content, "html.parser")
+    _close_implicit(soup)
+    # 只按最外层表格编号；嵌套表格的行算在外层表格里（find_all 本来就会取到）
+    tables = (t for t in soup.find_all("table") if t.find_parent("table") is None)
+    for index, table in enumerate(tables):
+        for row in table.find_all("tr"):
+            yield index, [ele.get_text(strip=True) for ele in row.find_all(["td", "th"])]
+
+
+_ROW_PARENTS = ("table", "tbody", "thead", "tfoot")
+
+
+def _close_implicit(soup) -> None:
+    """
+    html.parser 不做隐式闭合：<td>a<td>b 成了 td(a, td(b))，<td>a<tr> 成了 td(a, tr)。
+    按 HTML 规则把这样的单元格移到外层单元格之后、行移到外层行之后（之间隔着 <table> 的是真正的嵌套表格，不动）
+    """
+    for elem in soup.find_all(["tr", "td", "th"]):
+        if elem.parent.name in (_ROW_PARENTS if elem.name == "tr" else ("tr",)):
+            continue  # 结构正常（绝大多数），不必往上找
+        outer = elem.find_parent(["table", "tr", "td", "th"])
+        if outer is None or outer.name == "table":
+            continue
+        if elem.name == "tr":
+            if outer.name != "tr":
+                outer = outer.find_parent(["table", "tr"])
+            if outer is not None and outer.name == "tr":
+                outer.insert_after(elem)
+        elif outer.name in ("td", "th"):
+            outer.insert_after(elem)
+
+
+# ================================
+# ⚡ lxml 增量解析（HTMLPullParser）
+# ================================
+def iter_rows_lxml(html_content: str, feed_chars: int = FEED_CHARS) -> Iterator[tuple[int, list[str]]]:
+    """分块喂给 libxml2，每个最外层 <tr> 一结束就产出其单元格并释放，整棵树从不驻留内存"""
+    # 按字节解析：str 输入带 <?xml encoding=…?> 声明时 lxml 会拒绝；按字符切块再编码，不会切断多字节字符
+    # 只要 <table>/<tr> 的事件：单元格不逐个回调，整行结束时一次取出
+    parser = lxml_etree.HTMLPullParser(events=("start", "end"), tag=("table", "tr"), encoding="utf-8")
+    table_depth = tr_depth = 0
+    table_index = -1
+
+    def drain():
+        nonlocal table_depth, tr_depth, table_index
+        for event, elem in parser.read_events():
+            tag = elem.tag
+            if event == "start":
+                if tag == "table":
+                    table_depth += 1
+                    if table_depth == 1:
+                        table_index += 1
+                elif table_depth:
+                    tr_depth += 1
+                continue
+
+            if tag == "tr" and table_depth:
+                tr_depth -= 1
+                if tr_depth:
+                    continue  # 嵌套表格里的行，随外层行一起产出
+                # bs4 的 get_text 不含 <script>/<style> 内容
+                lxml_etree.strip_elements(elem, "script", "style", with_tail=False)
+                for row in elem.iter("tr"):
+                    yield table_index, _row_cells(row)
+                _release(elem)
+            elif tag == "table" and table_depth:
+                table_depth -= 1
+                if not table_depth:
+                    _release(elem)  # 连同表格前面的正文、图片等
+
+    for offset in range(0, len(html_content), feed_chars):
+        parser.feed(html_content[offset:offset + feed_chars].encode("utf-8"))
+        yield from drain()
+    try:
+        parser.close()
+    except lxml_etree.XMLSyntaxError:
+        return  # 空文档
+    yield from drain()
+
+
+def _release(elem) -> None:
+    """iterparse 惯用法：清空已处理的元素，并删掉它前面已处理完的兄弟节点"""
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+_CELL_TAGS = ("td", "th")
+
+
+def _row_cells(row) -> list[str]:
+    children = list(row)
+    if all(len(child) == 0 for child in children):
+        # 常见情况：单元格里只有文字，直接取 .text（注释节点的 tag 不是字符串，自然被跳过）
+        return [(child.text or "").strip() for child in children if child.tag in _CELL_TAGS]
+    # 单元格里有标签（<span>、<br>、嵌套表格…）：与 find_all(["td", "th"]) 一样取所有后代单元格
+    return ["".join(s.strip() for s in cell.itertext()) for cell in row.iter(*_CELL_TAGS)]
+
+
+BACKENDS = {
+    "lxml": iter_rows_lxml,
+    "bs4": iter_rows_bs4,
+}
+
+
+def get_backend(name: str | None = None):
+    """返回 (后端名称, 函数)；lxml 不可用时退回 bs4"""
+    name = (name or os.getenv(ENV_VAR) or DEFAULT_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"❌ 未知的 HTML 表格解析后端: {name}（可选 {', '.join(BACKENDS)}）")
+    if name == "lxml":
+        try:
+            import lxml.etree  # noqa: F401
+        except ImportError:
+            print("⚠️ 未安装 lxml，HTML 表格解析退回 bs4")
+            name = "bs4"
+    return name, BACKENDS[name]
+
+
+def split_tables(rows) -> list[list[list[str]]]:
+    """把 (表格序号, 单元格) 流按表格收拢成 [表格的行列表]（自检用；020 直接消费流）"""
+    tables: dict[int, list[list[str]]] = {}
+    for index, cells in rows:
+        tables.setdefault(index, []).append(cells)
+    return list(tables.values())
+
+
+# ================================
+# 🔍 一致性自检
+# ================================
+def _read_html(path: str) -> str:
+    if path.lower().endswith(".eml"):
+        import email
+        with open(path, "rb") as f:
+            msg = email.message_from_bytes(f.read())
+        for part in msg.walk():
+            if part.get_content_type() == "text/html":
+                return part.get_payload(decode=True).decode(part.get_content_charset() or "utf-8", errors="ignore")
+        return ""
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+
+def check_parity(html_content: str, label: str) -> bool:
+    results = {}
+    for name, extract in BACKENDS.items():
+        started = time.perf_counter()
+        results[name] = split_tables(extract(html_content))
+        rows = sum(len(t) for t in results[name])
+        print(f"  {name:<5} {time.perf_counter() - started:8.3f}s  {len(results[name])} 个表格 {rows} 行")
+    expected, actual = results["bs4"], results["lxml"]
+    if expected == actual:
+        print(f"✅ {label}: 两个后端结果一致")
+        return True
+    if len(expected) != len(actual):
+        print(f"❌ {label}: 表格数不一致（bs4 {len(expected)} 个，lxml {len(actual)} 个）")
+        return False
+    for t, (rows_a, rows_b) in enumerate(zip(expected, actual), start=1):
+        for idx, (a, b) in enumerate(zip(rows_a, rows_b), start=1):
+            if a != b:
+                print(f"❌ {label}: 表 {t} 第 {idx} 行不一致\n    bs4 : {a}\n    lxml: {b}")
+                return False
+        if len(rows_a) != len(rows_b):
+            print(f"❌ {label}: 表 {t} 行数不一致（bs4 {len(rows_a)} 行，lxml {len(rows_b)} 行）")
+            return False
+    return False
+
+
+# 残缺 HTML：两个后端都按 HTML 规则隐式闭合（python -m pytest script/html_table.py）
+MALFORMED_CASES = {
+    "<table><tr><td>a<td>b</tr></table>": [[["a", "b"]]],
+    "<table><tr><td>a<td>b<td>c</tr><tr><td>d</td></tr></table>": [[["a", "b", "c"], ["d"]]],
+    "<table><tr><th>x<th>y<tr><td>1<td>2</table>": [[["x", "y"], ["1", "2"]]],
+    "<table><tr><td>a</td><tr><td>b</td></tr></table>": [[["a"], ["b"]]],
+    "<table><tr><td><font>a<td>b</font></td></tr></table>": [[["a", "b"]]],
+    # 真正的嵌套表格不受影响：外层单元格含内层文本，内层行随后计入
+    "<table><tr><td>a<table><tr><td>x<td>y</tr></table></td><td>b</td></tr></table>":
+        [[["axy", "x", "y", "b"], ["x", "y"]]],
+}
+
+
+def test_unclosed_cells():
+    for html_content, expected in MALFORMED_CASES.items():
+        for name, extract in BACKENDS.items():
+            assert split_tables(extract(html_content)) == expected, (name, html_content)
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="HTML 表格解析后端一致性自检")
+    parser.add_argument("paths", nargs="*", help=".html 或 .eml 文件")
+    parser.add_argument("--skus", type=int, default=None, help="另用 bench_generate 生成这么多行的合成邮件")
+    args = parser.parse_args()
+
+    paths = list(args.paths)
+    if args.skus:
+        import bench_generate
+        workdir = tempfile.mkdtemp(prefix="html_table_")
+        paths.append(bench_generate.generate(workdir, args.skus)["mail"])
+    if not paths:
+        parser.error("请给出 .html / .eml 文件或 --skus")
+
+    bs4.BeautifulSoup, lxml_etree.HTMLPullParser  # 先导入，计时只算解析
+    ok = True
+    for path in paths:
+        print(f"📄 {path}")
+        ok = check_parity(_read_html(path), os.path.basename(path)) and ok
+    sys.exit(0 if ok else 1)
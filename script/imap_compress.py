@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+imap_compress.py
+- IMAP COMPRESS=DEFLATE（RFC 4978）：登录后服务器声明支持时协商压缩，之后双向都是原始 deflate 流（无 zlib 头）
+- 邮件流量主要是 HTML 表格和 base64 的 xlsx，压缩后通常只剩几分之一；连接慢时 020 的下载时间随之缩短
+- 服务器不支持或协商失败时照常不压缩（不报错）；IMAP_COMPRESS=0 关闭
+- 客户端类：CompressIMAP4 / CompressIMAP4_SSL（imaplib 的子类，020 的 connect_imap 使用），
+  统计线上字节（wire_in / wire_out）与解码后字节（data_in / data_out），logout 前由 020 打印
+- 用法：
+    mail = connect_imap(server); mail.login(user, password)
+    start_compression(mail)            # True = 已启用
+    print(describe(mail))              # 📉 IMAP 流量（DEFLATE）: 下行 线上 1.20 MB / 解码后 9.80 MB（省 88%）…
+- 本地测试：imap_standin.py 默认声明 COMPRESS=DEFLATE（--no-compress 关闭）
+"""
+import os
+import zlib
+import imaplib
+
+ENABLED = os.getenv("IMAP_COMPRESS", "1") != "0"
+COMPRESS_LEVEL = int(os.getenv("IMAP_COMPRESS_LEVEL", "6"))  # 只影响上行（命令），下行由服务器决定
+READ_CHUNK = 64 * 1024
+CAPABILITY = "COMPRESS=DEFLATE"
+
+# imaplib 只接受 Commands 中登记过的命令
+imaplib.Commands.setdefault("COMPRESS", ("AUTH", "SELECTED"))
+
+
+class _CompressMixin:
+    """替换 imaplib 的 read / readline / send：启用压缩后经 deflate 收发，并统计字节数"""
+    _inflate = None
+    _deflate = None
+
+    def _init_counters(self) -> None:
+        self.wire_in = self.wire_out = self.data_in = self.data_out = 0
+        self._rbuf = bytearray()
+
+    @property
+    def compressed(self) -> bool:
+        return self._inflate is not None
+
+    def pending(self) -> bool:
+        """已解压但未读取的数据（select 看不到），IDLE 等待时要先检查"""
+        return bool(self._rbuf)
+
+    def enable_deflate(self) -> None:
+        self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._deflate = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    # ---------- 发送 ----------
+    def send(self, data: bytes) -> None:
+        self.data_out += len(data)
+        if self._deflate is not None:
+            data = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+        self.wire_out += len(data)
+        super().send(data)
+
+    # ---------- 接收 ----------
+    def _fill(self) -> None:
+        chunk = self.file.read1(READ_CHUNK)
+        if not chunk:
+            raise self.abort("socket error: EOF")
+        self.wire_in += len(chunk)
+        self._rbuf += self._inflate.decompress(chunk)
+
+    def read(self, size: int) -> bytes:
+        if self._inflate is None:
+            data = super().read(size)
+            self.wire_in += len(data)
+        else:
+            while len(self._rbuf) < size:
+                self._fill()
+            data = bytes(self._rbuf[:size])
+            del self._rbuf[:size]
+        self.data_in += len(data)
+        return data
+
+    def readline(self) -> bytes:
+        if self._inflate is None:
+            line = super().readline()
+            self.wire_in += len(line)
+        else:
+            start = 0
+            while (end := self._rbuf.find(b"\n", start)) < 0:
+                if len(self._rbuf) > imaplib._MAXLINE:
+                    raise self.error(f"got more than {imaplib._MAXLINE} bytes")
+                start = len(self._rbuf)
+                self._fill()
+            line = bytes(self._rbuf[:end + 1])
+            del self._rbuf[:end + 1]
+        self.data_in += len(line)
+        return line
+
+
+class CompressIMAP4(_CompressMixin, imaplib.IMAP4):
+    def __init__(self, *args, **kwargs):
+        self._init_counters()
+        super().__init__(*args, **kwargs)
+
+
+class CompressIMAP4_SSL(_CompressMixin, imaplib.IMAP4_SSL):
+    def __init__(self, *args, **kwargs):
+        self._init_counters()
+        super().__init__(*args, **kwargs)
+
+
+# ================================
+# 🤝 协商
+# ================================
+def _advertised(mail: imaplib.IMAP4) -> bool:
+    # 登录成功的响应常带 [CAPABILITY …]（imaplib 存在 untagged_responses 里）；没有时再问一次
+    caps = mail.untagged_responses.pop("CAPABILITY", None)
+    if caps is None:
+        if CAPABILITY in mail.capabilities:
+            return True
+        typ, caps = mail.capability()
+        if typ != "OK":
+            return False
+    words = b" ".join(c for c in caps if isinstance(c, bytes)).upper().split()
+    return CAPABILITY.encode() in words
+
+
+def start_compression(mail: imaplib.IMAP4) -> bool:
+    """登录后调用；服务器支持时启用 DEFLATE，返回是否已启用"""
+    if not ENABLED or not isinstance(mail, _CompressMixin) or mail.compressed:
+        return bool(getattr(mail, "compressed", False))
+    try:
+        if not _advertised(mail):
+            return False
+        typ, data = mail._simple_command("COMPRESS", "DEFLATE")
+    except imaplib.IMAP4.error as e:
+        print(f"⚠️ IMAP 压缩协商失败，不压缩: {e}")
+        return False
+    if typ != "OK":
+        print(f"⚠️ 服务器拒绝 COMPRESS DEFLATE，不压缩: {data}")
+        return False
+    mail.enable_deflate()
+    return True
+
+
+def describe(mail: imaplib.IMAP4) -> str | None:
+    """一行字节统计；不是本模块的连接时返回 None"""
+    if not isinstance(mail, _CompressMixin):
+        return None
+
+    def size(n: int) -> str:
+        return f"{n / 1e6:.2f} MB" if n >= 1e6 else f"{n / 1e3:.1f} KB"
+
+    def side(wire: int, data: int) -> str:
+        saved = f"（省 {1 - wire / data:.0%}）" if mail.compressed and data else ""
+        return f"线上 {size(wire)} / 解码后 {size(data)}{saved}"
+
+    mode = "DEFLATE" if mail.compressed else "未压缩"
+    return (f"📉 IMAP 流量（{mode}）: 下行 {side(mail.wire_in, mail.data_in)}；"
+            f"上行 {side(mail.wire_out, mail.data_out)}")
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+imap_idle.py
+- 常驻模式：保持一个已登录的 IMAP 连接处于 IDLE（RFC 2177），新邮件到达时服务器主动推送 “* N EXISTS”
+- 只取新邮件的 Subject 头（BODY.PEEK[HEADER.FIELDS]，不标已读、不下载正文），主题命中 020 的 KEYWORDS 才触发
+- 突发到达合并：第一封命中后再等 IDLE_COALESCE_SECONDS，期间到达的邮件与之合并为一次运行
+- 断线自动重连（指数退避 + 抖动，上限 IDLE_BACKOFF_MAX）；重连后补扫断线期间到达的邮件
+- 已处理到哪封按 UID 记（与 020 的增量同步一样，UIDVALIDITY 变化时重新定起点）：
+  EXPUNGE 只改变序号、不影响 UID，删掉任何邮件都不会让新邮件被漏扫
+- 每 IDLE_REFRESH_SECONDS 重新发起 IDLE（RFC 2177 建议不超过 29 分钟），避免被服务器断开
+- 用法：python main.py --daemon [--workers N --no-cache --log-level …]（每次触发以子进程运行一次 main.py）
+- 本地测试：python script/imap_standin.py --port 1143 --spool ./spool，
+  再以 IMAP_SERVER=127.0.0.1 IMAP_PORT=1143 IMAP_SSL=0 启动守护进程，把 .eml 放进 spool
+"""
+import os
+import re
+import sys
+import time
+import email
+import random
+import select
+import imaplib
+import subprocess
+
+from pipeline import load_stage
+from stage_log import get_logger
+
+log = get_logger(__file__)
+
+MAIL_STAGE = "020 Email download.py"
+
+IDLE_REFRESH_SECONDS = float(os.getenv("IDLE_REFRESH_SECONDS", str(25 * 60)))
+IDLE_COALESCE_SECONDS = float(os.getenv("IDLE_COALESCE_SECONDS", "20"))
+IDLE_BACKOFF_INITIAL = float(os.getenv("IDLE_BACKOFF_INITIAL", "1"))
+IDLE_BACKOFF_MAX = float(os.getenv("IDLE_BACKOFF_MAX", "300"))
+
+HEADER_FIELDS = "(SUBJECT MESSAGE-ID)"
+_EXISTS_RE = re.compile(rb"^\* (\d+) EXISTS", re.I)
+
+
+class IdleNotSupported(Exception):
+    pass
+
+
+# ================================
+# 💤 IDLE 命令（imaplib 3.14 之前没有 idle()）
+# ================================
+def _readable(mail: imaplib.IMAP4, timeout: float) -> bool:
+    sock = mail.sock
+    if hasattr(sock, "pending") and sock.pending():
+        return True  # SSL 层已解密但未读取的数据，select 看不到
+    if hasattr(mail, "pending") and mail.pending():
+        return True  # COMPRESS=DEFLATE 已解压但未读取的数据（见 imap_compress.py）
+    readable, _, _ = select.select([sock], [], [], max(0.0, timeout))
+    return bool(readable)
+
+
+def idle_wait(mail: imaplib.IMAP4, timeout: float) -> list[bytes]:
+    """发起 IDLE，等到第一条推送或超时后发送 DONE；返回期间收到的全部未打标签响应行"""
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    line = mail.readline()
+    if not line.startswith(b"+"):
+        raise IdleNotSupported(line.decode("utf-8", "replace").strip())
+
+    events = []
+    if _readable(mail, timeout):
+        line = mail.readline()
+        if not line:
+            raise mail.abort("IDLE 期间连接被关闭")
+        events.append(line.strip())
+
+    mail.send(b"DONE\r\n")
+    while True:
+        line = mail.readline()
+        if not line:
+            raise mail.abort("IDLE 结束时连接被关闭")
+        if line.startswith(tag):
+            mail.tagged_commands.pop(tag, None)
+            if b" OK" not in line.upper():
+                raise mail.error(line.decode("utf-8", "replace").strip())
+            return events
+        events.append(line.strip())
+
+
+# ================================
+# 👀 监视器
+# ================================
+class IdleWatcher:
+    """保持 IDLE 连接，命中关键词的新邮件合并后调用 on_trigger(subjects)"""
+
+    def __init__(self, on_trigger, keywords: list[str] | None = None,
+                 coalesce_seconds: float = IDLE_COALESCE_SECONDS,
+                 refresh_seconds: float = IDLE_REFRESH_SECONDS):
+        self.m020 = load_stage(MAIL_STAGE)
+        self.on_trigger = on_trigger
+        self.keywords = keywords or list(self.m020.KEYWORDS.values())
+        self.coalesce_seconds = coalesce_seconds
+        self.refresh_seconds = refresh_seconds
+        self.uidvalidity = None
+        self.last_uid = None  # 已处理到的最大 UID；跨重连保留，用于补扫
+        self.exists_at_connect = 0
+        self.runs = 0
+
+    def connect(self, server: str, user: str, password: str) -> imaplib.IMAP4:
+        mail = self.m020.connect_imap(server)
+        mail.login(user, password)
+        if b"IDLE" not in b" ".join(c.encode() if isinstance(c, str) else c for c in mail.capabilities):
+            raise IdleNotSupported(f"{server} 不支持 IDLE")
+        # 文件夹名与 020 一样按修改版 UTF-7 编码（中文文件夹）
+        status, data = mail.select(self.m020._imap_mailbox_name(self.m020.MAILBOX))
+        if status != "OK":
+            log.warning("⚠️ 无法选择邮箱目录 %s，尝试使用 INBOX", self.m020.MAILBOX)
+            status, data = mail.select("INBOX")
+        exists = int(data[0])
+        mail.untagged_responses.pop("EXISTS", None)
+        uidvalidity = self.m020._response_int(mail, "UIDVALIDITY")
+        if self.last_uid is None or uidvalidity != self.uidvalidity:
+            # 首次连接（或 UID 被重新编号）：只关心之后到达的邮件
+            uidnext = self.m020._response_int(mail, "UIDNEXT")
+            self.last_uid = uidnext - 1 if uidnext else self._highest_uid(mail, exists)
+        self.uidvalidity = uidvalidity
+        self.exists_at_connect = exists
+        return mail
+
+    def _highest_uid(self, mail: imaplib.IMAP4, exists: int) -> int:
+        """服务器没给 UIDNEXT 时：取最后一封的 UID"""
+        if exists <= 0:
+            return 0
+        status, data = mail.fetch(str(exists), "(UID)")
+        m = self.m020._UID_RE.search(data[0] or b"") if status == "OK" and data else None
+        return int(m.group(1)) if m else 0
+
+    def scan_new(self, mail: imaplib.IMAP4) -> list[str]:
+        """取 UID 大于 last_uid 的邮件主题，返回命中关键词的（清理后）主题"""
+        status, data = mail.uid("FETCH", f"{self.last_uid + 1}:*",
+                                f"(UID BODY.PEEK[HEADER.FIELDS {HEADER_FIELDS}])")
+        if status != "OK":
+            return []
+        matched, newest = [], self.last_uid
+        for part in data:
+            if not isinstance(part, tuple):
+                continue
+            m = self.m020._UID_RE.search(part[0])
+            # 没有新邮件时 “n:*” 仍会返回 UID 最大的那封
+            if not m or int(m.group(1)) <= self.last_uid:
+                continue
+            newest = max(newest, int(m.group(1)))
+            headers = email.message_from_bytes(part[1])
+            subject = self.m020.clean_subject(self.m020.decode_str(headers.get("Subject")))
+            hit = any(k in subject for k in self.keywords)
+            log.info("📨 新邮件: %s%s", subject, " ✅ 命中" if hit else "")
+            if hit:
+                matched.append(subject)
+        self.last_uid = newest
+        return matched
+
+    def _apply(self, mail: imaplib.IMAP4, events: list[bytes]) -> list[str]:
+        # 只要有 EXISTS 就按 UID 补扫；EXPUNGE 只改变序号，不用处理
+        if any(_EXISTS_RE.match(line) for line in events):
+            return self.scan_new(mail)
+        return []
+
+    def watch(self, mail: imaplib.IMAP4, should_stop=lambda: False) -> None:
+        """在一个连接上循环 IDLE；连接出错时抛出，由 serve() 重连"""
+        # 断线期间到达的邮件：UID 大于 last_uid
+        pending = self.scan_new(mail)
+        first_hit = time.monotonic() if pending else None
+
+        while not should_stop():
+            if pending:
+                remaining = first_hit + self.coalesce_seconds - time.monotonic()
+                if remaining <= 0:
+                    self._trigger(pending)
+                    pending, first_hit = [], None
+                    # 运行期间没有 IDLE：用 NOOP 取回这段时间的 EXISTS
+                    mail.noop()
+                    mail.untagged_responses.pop("EXPUNGE", None)
+                    if mail.untagged_responses.pop("EXISTS", None):
+                        pending = self.scan_new(mail)
+                        first_hit = time.monotonic() if pending else None
+                    continue
+                timeout = remaining
+            else:
+                timeout = self.refresh_seconds
+
+            matched = self._apply(mail, idle_wait(mail, timeout))
+            if matched:
+                if not pending:
+                    first_hit = time.monotonic()
+                    log.info("⏳ %.0fs 内到达的邮件合并为一次运行", self.coalesce_seconds)
+                pending += matched
+
+    def _trigger(self, subjects: list[str]) -> None:
+        self.runs += 1
+        log.info("🚀 第 %d 次触发（合并 %d 封）: %s", self.runs, len(subjects), "；".join(subjects))
+        self.on_trigger(subjects)
+
+    def serve(self, server: str, user: str, password: str, should_stop=lambda: False) -> None:
+        """常驻运行：连接 → IDLE 循环；出错后按指数退避重连"""
+        delay = IDLE_BACKOFF_INITIAL
+        while not should_stop():
+            mail = None
+            try:
+                mail = self.connect(server, user, password)
+                log.info("💤 已进入 IDLE: %s / %s（当前 %d 封）", server, self.m020.MAILBOX, self.exists_at_connect)
+                delay = IDLE_BACKOFF_INITIAL
+                self.watch(mail, should_stop)
+            except IdleNotSupported:
+                raise
+            except (imaplib.IMAP4.error, OSError) as e:
+                wait = min(delay, IDLE_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+                log.warning("⚠️ IMAP 连接中断（%s: %s），%.1fs 后重连", type(e).__name__, e, wait)
+                time.sleep(wait)
+                delay = min(delay * 2, IDLE_BACKOFF_MAX)
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+
+
+# ================================
+# 🚀 入口
+# ================================
+def run_main_subprocess(main_args: list[str]):
+    """每次触发以子进程运行一次 main.py：各阶段模块状态互不影响，与原先手动/定时运行一致"""
+    main_py = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+    def trigger(subjects: list[str]) -> None:
+        started = time.perf_counter()
+        code = subprocess.call([sys.executable, main_py, *main_args])
+        flag = "✅" if code == 0 else "❌"
+        log.info("%s 主程序运行结束（退出码 %s，用时 %.1fs）", flag, code, time.perf_counter() - started)
+
+    return trigger
+
+
+def serve_daemon(main_args: list[str]) -> None:
+    m020 = load_stage(MAIL_STAGE)
+    user, password, server = m020.load_credentials()
+    watcher = IdleWatcher(run_main_subprocess(main_args))
+    try:
+        watcher.serve(server, user, password)
+    except KeyboardInterrupt:
+        log.info("👋 已停止守护进程")
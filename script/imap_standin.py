@@ -0,0 +1,677 @@
+# -*- coding: utf-8 -*-
+"""
+imap_standin.py
+- 本地 IMAP 替身服务器（明文 TCP，单个邮箱目录），用于在不连真实邮箱的情况下测试 020 / IDLE 守护进程
+- 支持的命令：CAPABILITY / LOGIN / SELECT / EXAMINE / SEARCH / FETCH / NOOP / IDLE / COMPRESS DEFLATE / LOGOUT
+    SEARCH 条件：ALL、SINCE、BEFORE、SUBJECT、FROM、UID（可带 CHARSET UTF-8 与 {n} 字面量），多个条件为“与”
+    UID SEARCH / UID FETCH：参数与结果用 UID；SELECT 返回 UIDVALIDITY / UIDNEXT
+    FETCH 数据项：RFC822、RFC822.SIZE、BODY[]、BODY.PEEK[HEADER.FIELDS (…)]、UID、INTERNALDATE、
+               BODYSTRUCTURE、BODY.PEEK[HEADER]、BODY.PEEK[n]、BODY.PEEK[n.MIME]、分段 BODY.PEEK[n]<起点.长度>
+- 作为库使用：
+    server = ImapStandIn(user="u", password="p")
+    host, port = server.start()
+    server.add_message(open("x.eml", "rb").read())   # IDLE 中的客户端会立即收到 “* N EXISTS”
+    server.drop_connections()                        # 模拟断线，测试重连
+    ImapStandIn(latency=0.2)                         # 每条命令延迟响应，模拟到真实服务器的往返时间
+    ImapStandIn(compress=False)                      # 不声明 COMPRESS=DEFLATE（测试客户端的退回路径）
+    server.wire_bytes                                # 实际发出的字节数（压缩后）
+    server.stop()
+- 命令行（把 .eml 放进 spool 目录即视为新邮件到达）：
+    python script/imap_standin.py --port 1143 --spool ./spool
+  客户端设置 IMAP_SERVER=127.0.0.1 IMAP_PORT=1143 IMAP_SSL=0
+"""
+import os
+import re
+import sys
+import time
+import email
+import zlib
+import select
+import socket
+import threading
+import socketserver
+from email.header import decode_header, make_header
+from datetime import datetime, timezone
+
+CAPABILITIES = "IMAP4rev1 IDLE"
+COMPRESS_CAPABILITY = "COMPRESS=DEFLATE"
+POLL_SECONDS = 0.1  # IDLE 中检查新邮件的间隔
+
+
+class _Message:
+    def __init__(self, uid: int, raw: bytes):
+        self.uid = uid
+        self.raw = raw
+        self.internaldate = datetime.now(timezone.utc).astimezone()
+        self._parsed = None
+
+    @property
+    def parsed(self):
+        if self._parsed is None:
+            self._parsed = email.message_from_bytes(self.raw)
+        return self._parsed
+
+
+class Mailbox:
+    def __init__(self, uidvalidity: int | None = None):
+        self.lock = threading.Lock()
+        self.messages: list[_Message] = []
+        self.uidvalidity = uidvalidity or int(time.time())
+        self.uidnext = 1
+
+    def add(self, raw: bytes) -> int:
+        with self.lock:
+            msg = _Message(self.uidnext, raw)
+            self.uidnext += 1
+            self.messages.append(msg)
+            return len(self.messages)
+
+    def snapshot(self) -> list[_Message]:
+        with self.lock:
+            return list(self.messages)
+
+
+# ================================
+# 🧩 协议辅助
+# ================================
+def _parse_seqset(spec: str, count: int) -> list[int]:
+    """'1:3,7,9:*' -> [1, 2, 3, 7, 9..count]（1 起始，超出范围的丢弃）"""
+    result = []
+    for part in spec.split(","):
+        if ":" in part:
+            a, b = part.split(":", 1)
+            lo = count if a == "*" else int(a)
+            hi = count if b == "*" else int(b)
+            lo, hi = min(lo, hi), max(lo, hi)
+            result.extend(range(lo, hi + 1))
+        else:
+            result.append(count if part == "*" else int(part))
+    return [n for n in result if 1 <= n <= count]
+
+
+def _header_fields(raw: bytes, names: list[str]) -> bytes:
+    """只取指定头字段（含折行），末尾带空行，与真实服务器一致"""
+    head = raw.split(b"\r\n\r\n", 1)[0] if b"\r\n\r\n" in raw else raw.split(b"\n\n", 1)[0]
+    wanted = {n.lower() for n in names}
+    out, keep = [], False
+    for line in re.split(rb"\r?\n", head):
+        if line[:1] in (b" ", b"\t"):
+            if keep:
+                out.append(line)
+            continue
+        keep = line.split(b":", 1)[0].strip().decode("ascii", "ignore").lower() in wanted
+        if keep:
+            out.append(line)
+    return b"\r\n".join(out) + b"\r\n\r\n"
+
+
+def _tokenize(args: str, literals: list[bytes]) -> list:
+    """按空格切分参数，支持 "带引号的字符串" 与 {n} 字面量（已读出的字面量按顺序替换）"""
+    tokens, i = [], 0
+    while i < len(args):
+        ch = args[i]
+        if ch == " ":
+            i += 1
+        elif ch == '"':
+            j = i + 1
+            buf = ""
+            while j < len(args) and args[j] != '"':
+                if args[j] == "\\" and j + 1 < len(args):
+                    j += 1
+                buf += args[j]
+                j += 1
+            tokens.append(buf)
+            i = j + 1
+        elif ch == "{" and re.match(r"\{\d+\}", args[i:]):
+            m = re.match(r"\{\d+\}", args[i:])
+            tokens.append(literals.pop(0).decode("utf-8", "replace"))
+            i += m.end()
+        else:
+            j = args.find(" ", i)
+            j = len(args) if j < 0 else j
+            tokens.append(args[i:j])
+            i = j
+    return tokens
+
+
+_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def _parse_imap_date(value: str):
+    day, mon, year = value.split("-")
+    return datetime(int(year), _MONTHS.index(mon.capitalize()) + 1, int(day)).date()
+
+
+def _decoded_header(raw: bytes, name: str) -> str:
+    value = email.message_from_bytes(_header_fields(raw, [name])).get(name) or ""
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def _search(messages: list["_Message"], tokens: list[str]) -> list[int]:
+    """返回满足全部条件的序号"""
+    if tokens[:1] and tokens[0].upper() == "CHARSET":
+        tokens = tokens[2:]
+    tests = []
+    i = 0
+    while i < len(tokens):
+        key = tokens[i].upper()
+        if key == "ALL":
+            i += 1
+            continue
+        if key in ("SINCE", "BEFORE"):
+            day = _parse_imap_date(tokens[i + 1])
+            if key == "SINCE":
+                tests.append(lambda m, d=day: m.internaldate.date() >= d)
+            else:
+                tests.append(lambda m, d=day: m.internaldate.date() < d)
+        elif key == "UID":
+            max_uid = messages[-1].uid if messages else 0
+            wanted = set(_parse_seqset(tokens[i + 1], max_uid))
+            tests.append(lambda m, w=wanted: m.uid in w)
+        elif key in ("SUBJECT", "FROM"):
+            needle = tokens[i + 1].lower()
+            tests.append(lambda m, h=key, n=needle: n in _decoded_header(m.raw, h).lower())
+        else:
+            raise ValueError(f"unsupported search key {key}")
+        i += 2
+    return [n for n, m in enumerate(messages, start=1) if all(t(m) for t in tests)]
+
+
+def _imap_string(value) -> bytes:
+    """NIL / 带引号字符串；非 ASCII 或含引号时用 {n} 字面量（与真实服务器一样）"""
+    if value is None:
+        return b"NIL"
+    data = str(value).encode("utf-8", "surrogateescape")
+    if data.isascii() and b'"' not in data and b"\\" not in data and b"\n" not in data:
+        return b'"' + data + b'"'
+    return f"{{{len(data)}}}\r\n".encode() + data
+
+
+def _param_list(pairs: list[tuple]) -> bytes:
+    if not pairs:
+        return b"NIL"
+    items = []
+    for key, value in pairs:
+        if isinstance(value, tuple):
+            value = email.utils.collapse_rfc2231_value(value)
+        items += [_imap_string(key.upper().rstrip("*")), _imap_string(value)]
+    return b"(" + b" ".join(items) + b")"
+
+
+def _part_headers(part) -> bytes:
+    return b"".join(f"{k}: {v}\r\n".encode("utf-8", "surrogateescape") for k, v in part.items()) + b"\r\n"
+
+
+def _part_body(part) -> bytes:
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        raise ValueError("multipart body section not supported")
+    return payload.encode("utf-8", "surrogateescape")
+
+
+def _body_structure(part) -> bytes:
+    """RFC 3501 BODYSTRUCTURE（含扩展数据中的 disposition）"""
+    if part.is_multipart():
+        children = b"".join(_body_structure(child) for child in part.get_payload())
+        params = [(k, v) for k, v in (part.get_params() or [])[1:]]
+        return (b"(" + children + b" " + _imap_string(part.get_content_subtype().upper())
+                + b" " + _param_list(params) + b" NIL NIL)")
+    body = _part_body(part)
+    params = [(k, v) for k, v in (part.get_params() or [])[1:]]
+    fields = [_imap_string(part.get_content_maintype().upper()), _imap_string(part.get_content_subtype().upper()),
+              _param_list(params), b"NIL", b"NIL",
+              _imap_string((part.get("Content-Transfer-Encoding") or "7BIT").upper()), str(len(body)).encode()]
+    if part.get_content_maintype() == "text":
+        fields.append(str(body.count(b"\n")).encode())
+    disposition = part.get_params(header="content-disposition")
+    dsp = b"NIL"
+    if disposition:
+        dsp = b"(" + _imap_string(disposition[0][0].upper()) + b" " + _param_list(disposition[1:]) + b")"
+    fields += [b"NIL", dsp, b"NIL"]
+    return b"(" + b" ".join(fields) + b")"
+
+
+def _section_part(msg, section: str):
+    part = msg
+    for n in section.split("."):
+        if not part.is_multipart():
+            if n != "1":
+                raise ValueError(f"no section {section}")
+            continue
+        children = part.get_payload()
+        if not 1 <= int(n) <= len(children):
+            raise ValueError(f"no section {section}")
+        part = children[int(n) - 1]
+    return part
+
+
+def _section_data(msg: "_Message", section: str) -> bytes:
+    if section == "HEADER":
+        raw = msg.raw
+        sep = b"\r\n\r\n" if b"\r\n\r\n" in raw else b"\n\n"
+        return raw.split(sep, 1)[0] + b"\r\n\r\n"
+    if section.endswith(".MIME"):
+        return _part_headers(_section_part(msg.parsed, section[:-5]))
+    return _part_body(_section_part(msg.parsed, section))
+
+
+def _split_items(spec: str) -> list[str]:
+    """'(UID BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)])' -> ['UID', 'BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)]']"""
+    spec = spec.strip()
+    if spec.startswith("(") and spec.endswith(")"):
+        spec = spec[1:-1]
+    items, buf, depth = [], "", 0
+    for ch in spec:
+        if ch in "[(":
+            depth += 1
+        elif ch in "])":
+            depth -= 1
+        if ch == " " and depth == 0:
+            if buf:
+                items.append(buf)
+            buf = ""
+        else:
+            buf += ch
+    if buf:
+        items.append(buf)
+    return items
+
+
+def _fetch_item(msg: _Message, item: str) -> bytes:
+    upper = item.upper()
+    if upper == "UID":
+        return f"UID {msg.uid}".encode()
+    if upper == "RFC822.SIZE":
+        return f"RFC822.SIZE {len(msg.raw)}".encode()
+    if upper == "INTERNALDATE":
+        return f'INTERNALDATE "{msg.internaldate.strftime("%d-%b-%Y %H:%M:%S %z")}"'.encode()
+    if upper in ("RFC822", "BODY[]", "BODY.PEEK[]"):
+        name = "RFC822" if upper == "RFC822" else "BODY[]"
+        return f"{name} {{{len(msg.raw)}}}\r\n".encode() + msg.raw
+    if upper == "BODYSTRUCTURE":
+        return b"BODYSTRUCTURE " + _body_structure(msg.parsed)
+    m = re.match(r"BODY(?:\.PEEK)?\[HEADER\.FIELDS \(([^)]*)\)\]", item, re.I)
+    if m:
+        data = _header_fields(msg.raw, m.group(1).split())
+        name = f"BODY[HEADER.FIELDS ({m.group(1).upper()})]"
+        return f"{name} {{{len(data)}}}\r\n".encode() + data
+    m = re.match(r"BODY(?:\.PEEK)?\[((?:\d+\.)*(?:\d+|MIME)|HEADER)\](?:<(\d+)\.(\d+)>)?$", item, re.I)
+    if m:
+        section = m.group(1).upper()
+        data = _section_data(msg, section)
+        name = f"BODY[{section}]"
+        if m.group(2) is not None:
+            start = int(m.group(2))
+            data = data[start:start + int(m.group(3))]
+            name += f"<{start}>"
+        return f"{name} {{{len(data)}}}\r\n".encode() + data
+    raise ValueError(f"unsupported fetch item {item}")
+
+
+class _Wrapped:
+    """包在 rfile / wfile 外面；StreamRequestHandler.finish 要用 closed / close"""
+    raw = None
+
+    @property
+    def closed(self) -> bool:
+        return self.raw.closed
+
+    def close(self) -> None:
+        self.raw.close()
+
+
+class _InflateReader(_Wrapped):
+    """COMPRESS DEFLATE 之后的读端：原始 deflate 流 → 明文（readline / read）"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.buf = bytearray()
+
+    def pending(self) -> bool:
+        return bool(self.buf)
+
+    def _fill(self) -> bool:
+        chunk = self.raw.read1(65536)
+        if not chunk:
+            return False
+        self.buf += self.inflate.decompress(chunk)
+        return True
+
+    def readline(self) -> bytes:
+        while b"\n" not in self.buf:
+            if not self._fill():
+                break
+        end = self.buf.find(b"\n") + 1 or len(self.buf)
+        line = bytes(self.buf[:end])
+        del self.buf[:end]
+        return line
+
+    def read(self, size: int) -> bytes:
+        while len(self.buf) < size and self._fill():
+            pass
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data
+
+
+class _DeflateWriter(_Wrapped):
+    """写端：每次 flush 做一次 Z_SYNC_FLUSH，客户端收到的都是可以立即解压的完整块"""
+
+    def __init__(self, raw, counter):
+        self.raw = raw
+        self.deflate = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.counter = counter
+
+    def write(self, data: bytes) -> None:
+        out = self.deflate.compress(data)
+        if out:
+            self.counter(len(out))
+            self.raw.write(out)
+
+    def flush(self) -> None:
+        out = self.deflate.flush(zlib.Z_SYNC_FLUSH)
+        self.counter(len(out))
+        self.raw.write(out)
+        self.raw.flush()
+
+
+class _CountingWriter(_Wrapped):
+    """未压缩时的写端：只统计字节数"""
+
+    def __init__(self, raw, counter):
+        self.raw = raw
+        self.counter = counter
+
+    def write(self, data: bytes) -> None:
+        self.counter(len(data))
+        self.raw.write(data)
+
+    def flush(self) -> None:
+        self.raw.flush()
+
+
+# ================================
+# 🔌 连接处理
+# ================================
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.server.standin._register(self.request)
+        self.wfile = _CountingWriter(self.wfile, self.server.standin._count)
+        self.compressed = False
+        self.selected = False
+        self.known = 0
+        self.literals = []
+
+    def finish(self):
+        self.server.standin._unregister(self.request)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def send(self, data: bytes | str) -> None:
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data + b"\r\n")
+        self.wfile.flush()
+
+    def read_command(self) -> tuple[str, list[bytes]] | None:
+        """读一条命令；行尾为 {n} 时回复继续请求并读入字面量"""
+        text, literals = "", []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            m = re.search(r"\{(\d+)\}$", line)
+            if not m:
+                return text + line, literals
+            self.send("+ Ready for literal data")
+            literals.append(self.rfile.read(int(m.group(1))))
+            text += line
+
+    def handle(self):
+        self.send(f"* OK [CAPABILITY {self.server.standin.capabilities}] IMAP stand-in ready")
+        try:
+            while True:
+                command = self.read_command()
+                if command is None:
+                    return
+                text, self.literals = command
+                parts = text.split(" ", 2)
+                if len(parts) < 2:
+                    self.send("* BAD empty command")
+                    continue
+                tag, cmd = parts[0], parts[1].upper()
+                args = parts[2] if len(parts) > 2 else ""
+                if self.server.standin.latency:
+                    time.sleep(self.server.standin.latency)
+                if not self.dispatch(tag, cmd, args):
+                    return
+        except (OSError, ValueError):
+            return
+
+    def dispatch(self, tag: str, cmd: str, args: str) -> bool:
+        standin = self.server.standin
+        mailbox = standin.mailbox
+        if cmd == "CAPABILITY":
+            self.send(f"* CAPABILITY {standin.capabilities}")
+            self.send(f"{tag} OK CAPABILITY completed")
+        elif cmd == "COMPRESS":
+            if not standin.compress or args.upper() != "DEFLATE":
+                self.send(f"{tag} BAD unsupported COMPRESS {args}")
+            elif self.compressed:
+                self.send(f"{tag} NO [COMPRESSIONACTIVE] DEFLATE active")
+            else:
+                self.send(f"{tag} OK DEFLATE active")
+                # 响应本身不压缩，之后双向都是 deflate 流
+                self.rfile = _InflateReader(self.rfile)
+                self.wfile = _DeflateWriter(self.wfile.raw, standin._count)
+                self.compressed = True
+        elif cmd == "LOGIN":
+            user, _, password = args.partition(" ")
+            if standin.user is not None and (user.strip('"'), password.strip('"')) != (standin.user, standin.password):
+                self.send(f"{tag} NO [AUTHENTICATIONFAILED] invalid credentials")
+            else:
+                self.send(f"{tag} OK LOGIN completed")
+        elif cmd in ("SELECT", "EXAMINE"):
+            self.selected = True
+            self.known = len(mailbox.snapshot())
+            self.send(f"* {self.known} EXISTS")
+            self.send("* 0 RECENT")
+            self.send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid")
+            self.send(f"* OK [UIDNEXT {mailbox.uidnext}] predicted next UID")
+            mode = "READ-ONLY" if cmd == "EXAMINE" else "READ-WRITE"
+            self.send(f"{tag} OK [{mode}] {cmd} completed")
+        elif cmd == "SEARCH":
+            self.search(tag, args)
+        elif cmd == "FETCH":
+            self.fetch(tag, args)
+        elif cmd == "UID":
+            sub, _, rest = args.partition(" ")
+            if sub.upper() == "SEARCH":
+                self.search(tag, rest, by_uid=True)
+            elif sub.upper() == "FETCH":
+                self.fetch(tag, rest, by_uid=True)
+            else:
+                self.send(f"{tag} BAD unsupported UID {sub}")
+        elif cmd == "NOOP":
+            self.report_exists()
+            self.send(f"{tag} OK NOOP completed")
+        elif cmd == "IDLE":
+            return self.idle(tag)
+        elif cmd == "LOGOUT":
+            self.send("* BYE logging out")
+            self.send(f"{tag} OK LOGOUT completed")
+            return False
+        else:
+            self.send(f"{tag} BAD unsupported command {cmd}")
+        return True
+
+    def search(self, tag: str, args: str, by_uid: bool = False) -> None:
+        messages = self.server.standin.mailbox.snapshot()
+        try:
+            found = _search(messages, _tokenize(args, list(self.literals)))
+        except (ValueError, IndexError) as e:
+            self.send(f"{tag} BAD {e}")
+            return
+        if by_uid:
+            found = [messages[n - 1].uid for n in found]
+        self.send(f"* SEARCH {' '.join(map(str, found))}".rstrip())
+        self.send(f"{tag} OK SEARCH completed")
+
+    def fetch(self, tag: str, args: str, by_uid: bool = False) -> None:
+        seqset, _, spec = args.partition(" ")
+        messages = self.server.standin.mailbox.snapshot()
+        try:
+            items = _split_items(spec)
+            if by_uid:
+                wanted = set(_parse_seqset(seqset, messages[-1].uid if messages else 0))
+                numbers = [n for n, m in enumerate(messages, start=1) if m.uid in wanted]
+                if not any(item.upper() == "UID" for item in items):
+                    items = ["UID"] + items  # UID FETCH 的响应总是带 UID
+            else:
+                numbers = _parse_seqset(seqset, len(messages))
+            for n in numbers:
+                msg = messages[n - 1]
+                body = b" ".join(_fetch_item(msg, item) for item in items)
+                self.wfile.write(f"* {n} FETCH (".encode() + body + b")\r\n")
+            self.wfile.flush()
+        except ValueError as e:
+            self.send(f"{tag} BAD {e}")
+            return
+        self.send(f"{tag} OK FETCH completed")
+
+    def report_exists(self) -> None:
+        count = len(self.server.standin.mailbox.snapshot())
+        if self.selected and count != self.known:
+            self.known = count
+            self.send(f"* {count} EXISTS")
+
+    def idle(self, tag: str) -> bool:
+        self.send("+ idling")
+        while True:
+            self.report_exists()
+            pending = self.compressed and self.rfile.pending()
+            readable, _, _ = select.select([self.request], [], [], 0 if pending else POLL_SECONDS)
+            if readable or pending:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b"DONE":
+                    self.send(f"{tag} OK IDLE terminated")
+                    return True
+                self.send(f"{tag} BAD expected DONE")
+                return True
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# ================================
+# 🧪 替身服务器
+# ================================
+class ImapStandIn:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 user: str | None = None, password: str | None = None, latency: float = 0.0,
+                 compress: bool = True):
+        self.mailbox = Mailbox()
+        self.latency = latency
+        self.compress = compress
+        self.wire_bytes = 0
+        self._wire_lock = threading.Lock()
+        self.user = user
+        self.password = password
+        self._server = _Server((host, port), _Handler)
+        self._server.standin = self
+        self._thread = None
+        self._conns_lock = threading.Lock()
+        self._conns: set[socket.socket] = set()
+
+    @property
+    def capabilities(self) -> str:
+        return f"{CAPABILITIES} {COMPRESS_CAPABILITY}" if self.compress else CAPABILITIES
+
+    def _count(self, n: int) -> None:
+        with self._wire_lock:
+            self.wire_bytes += n
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> tuple[str, int]:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.address
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self.drop_connections()
+        self._server.server_close()
+
+    def add_message(self, raw: bytes) -> int:
+        """追加一封邮件，返回其序号"""
+        return self.mailbox.add(raw)
+
+    def drop_connections(self) -> None:
+        """强制断开所有客户端连接（模拟网络中断 / 服务器重启）"""
+        with self._conns_lock:
+            conns = list(self._conns)
+        for sock in conns:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _register(self, sock) -> None:
+        with self._conns_lock:
+            self._conns.add(sock)
+
+    def _unregister(self, sock) -> None:
+        with self._conns_lock:
+            self._conns.discard(sock)
+
+
+def _watch_spool(server: ImapStandIn, spool: str) -> None:
+    """按文件名顺序把 spool 目录中新出现的 .eml 作为新邮件投递"""
+    seen = set()
+    while True:
+        for name in sorted(os.listdir(spool)):
+            if name.lower().endswith(".eml") and name not in seen:
+                seen.add(name)
+                with open(os.path.join(spool, name), "rb") as f:
+                    n = server.add_message(f.read())
+                print(f"📨 投递 {name} → 第 {n} 封")
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地 IMAP 替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1143)
+    parser.add_argument("--spool", required=True, help="邮件目录：已有及新放入的 .eml 都会投递到邮箱")
+    parser.add_argument("--user", default=None, help="设置后 LOGIN 需匹配")
+    parser.add_argument("--password", default=None)
+    parser.add_argument("--latency", type=float, default=0.0, help="每条命令的响应延迟（秒），模拟往返时间")
+    parser.add_argument("--no-compress", action="store_true", help="不声明 COMPRESS=DEFLATE")
+    args = parser.parse_args()
+
+    os.makedirs(args.spool, exist_ok=True)
+    standin = ImapStandIn(args.host, args.port, args.user, args.password, args.latency, compress=not args.no_compress)
+    host, port = standin.start()
+    print(f"📮 IMAP 替身已启动: {host}:{port}（IMAP_SSL=0），监视目录 {args.spool}")
+    try:
+        _watch_spool(standin, args.spool)
+    except KeyboardInterrupt:
+        standin.stop()
+        sys.exit(0)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+lazy_import.py
+- 重依赖（pandas / bs4 / matplotlib / numpy …）延迟到第一次真正使用时才导入：
+    pd = lazy_import("pandas")          # 此时不导入
+    pd.DataFrame(...)                   # 第一次访问属性时才导入
+  提前 sys.exit 的路径（没有邮件、没有“总库存”文件等）不再付出导入开销
+- 每个模块的导入用时记录在 IMPORT_TIMES（秒），pipeline.print_summary 会一并打印；
+  pipeline.load_stage 也会记录各阶段脚本自身的导入用时（键为 "stage:文件名"）
+- 导入耗时回归检查：python script/lazy_import.py --check
+    每个阶段脚本在全新的解释器里（先导入 pipeline / workbook_session 作为基线）导入一次：
+    导入时加载了 HEAVY_MODULES 中的模块，或导入用时超过 IMPORT_BUDGET_SECONDS，即返回非 0
+"""
+import os
+import sys
+import time
+import types
+import importlib
+
+# 阶段脚本导入时不应加载的重依赖（应在函数内用到时再导入）
+HEAVY_MODULES = ["pandas", "numpy", "matplotlib", "bs4", "lxml", "xlwings", "PIL", "pyecharts"]
+
+# 单个阶段脚本导入用时上限（秒，不含 pipeline 自身；可用环境变量覆盖）
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "0.5"))
+
+IMPORT_TIMES = {}
+
+
+def timed_import(name: str):
+    """导入模块并记录用时（已导入过的模块直接返回，不重复记录）"""
+    if name in sys.modules:
+        return sys.modules[name]
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - started
+    return module
+
+
+class LazyModule(types.ModuleType):
+    """模块代理：第一次访问属性时才真正导入"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_target"]
+        if module is None:
+            module = timed_import(self.__name__)
+            self.__dict__["_lazy_target"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "已导入" if self.__dict__["_lazy_target"] is not None else "未导入"
+        return f"<lazy module {self.__name__!r}（{state}）>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def print_import_report() -> None:
+    if not IMPORT_TIMES:
+        return
+    print("\n📦 模块导入用时：")
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda kv: kv[1], reverse=True):
+        print(f"  {name:<40} {seconds:>8.3f}s")
+
+
+# ================================
+# 🧪 导入耗时回归检查
+# ================================
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {script_dir!r})
+import pipeline, workbook_session  # 与 main.py 相同的基线（openpyxl 已由会话导入）
+before = set(sys.modules)
+t = time.perf_counter()
+pipeline.load_stage({stage!r})
+seconds = time.perf_counter() - t
+loaded = sorted(m for m in set(sys.modules) - before if m.split(".")[0] in {heavy!r})
+print(json.dumps({{"seconds": seconds, "heavy": sorted({{m.split(".")[0] for m in loaded}})}}))
+"""
+
+
+def check_stage_imports(stages: list[str]) -> bool:
+    import json
+    import subprocess
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    ok = True
+    for stage in stages:
+        code = _PROBE.format(script_dir=script_dir, stage=stage, heavy=HEAVY_MODULES)
+        proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=script_dir)
+        if proc.returncode != 0:
+            print(f"❌ {stage} 导入失败：\n{proc.stderr.strip()}")
+            ok = False
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        problems = []
+        if result["heavy"]:
+            problems.append(f"导入时加载了重依赖 {result['heavy']}")
+        if result["seconds"] > IMPORT_BUDGET_SECONDS:
+            problems.append(f"导入用时超过上限 {IMPORT_BUDGET_SECONDS:.2f}s")
+        flag = "❌" if problems else "✅"
+        print(f"{flag} {stage:<32} {result['seconds']:>7.3f}s  {'；'.join(problems)}")
+        ok = ok and not problems
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="阶段脚本导入耗时检查")
+    parser.add_argument("--check", action="store_true", help="逐个阶段检查导入用时与重依赖")
+    parser.add_argument("stages", nargs="*", help="要检查的阶段脚本（默认 pipeline.DEFAULT_STAGES）")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from pipeline import DEFAULT_STAGES
+        sys.exit(0 if check_stage_imports(args.stages or DEFAULT_STAGES) else 1)
+    parser.print_help()
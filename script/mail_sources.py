@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+mail_sources.py
+- 多账号 / 多文件夹并发抓取：报表邮件分散在不同邮箱账号和文件夹时，各邮箱同时检索、下载，
+  合并后交给 020 的 select_from_messages 统一按关键词选最新一封（同一份 mail_meta.json 与附件）
+- asyncio 调度，每个（账号, 文件夹）一个任务；imaplib 是阻塞的，放在 asyncio.to_thread 中执行
+- 每个服务器的并发连接数有上限 IMAP_MAX_CONNECTIONS_PER_SERVER（默认 2，QQ 邮箱同一账号连接过多会被拒绝）
+- 总用时约等于最慢的一个邮箱，而不是各邮箱之和；单个邮箱失败不影响其他邮箱
+- 配置：环境变量 MAIL_SOURCES=配置文件路径（JSON，示例见 mail_sources.example.json）；未设置时仍是单账号单文件夹
+    {"sources": [{
+        "name": "qq",                              → 日志与邮件编号前缀
+        "server": "imap.qq.com",
+        "user_env": "EMAIL_ADDRESS_QQ",            → 或直接写 "user": "xxx@qq.com"
+        "password_env": "EMAIL_PASSWORD_QQ",       → 密码只从环境变量 / .env 读取
+        "mailboxes": ["INBOX", "其他文件夹/存量报表"]
+    }]}
+"""
+import os
+import json
+import time
+import asyncio
+
+from dotenv import load_dotenv
+
+import tracer
+from pipeline import load_stage
+
+MAIL_STAGE = "020 Email download.py"
+ENV_VAR = "MAIL_SOURCES"
+MAX_CONNECTIONS_PER_SERVER = int(os.getenv("IMAP_MAX_CONNECTIONS_PER_SERVER", "2"))
+
+
+# ================================
+# 📋 配置
+# ================================
+def load_sources(path: str | None = None) -> list[dict]:
+    """读取邮箱来源配置，展开为 [{name, server, user, password, mailbox}]；未配置时返回空列表"""
+    path = path or os.getenv(ENV_VAR)
+    if not path:
+        return []
+    load_dotenv()
+    with open(path, "r", encoding="utf-8") as f:
+        sources = json.load(f)["sources"]
+
+    jobs = []
+    for source in sources:
+        name = source.get("name") or source["server"]
+        user = source.get("user") or os.getenv(source.get("user_env", ""), "")
+        password = os.getenv(source.get("password_env", ""), "")
+        if not user or not password:
+            raise ValueError(f"❌ 邮箱来源 {name} 的账号或密码未配置（user / user_env / password_env）")
+        for mailbox in source.get("mailboxes") or ["INBOX"]:
+            jobs.append({"name": name, "server": source["server"], "user": user,
+                         "password": password, "mailbox": mailbox})
+    return jobs
+
+
+# ================================
+# 📨 单个邮箱（在线程中运行）
+# ================================
+def _fetch_one(job: dict, keyword_sets: list[dict] | None, state_dir: str | None, limit: int | None):
+    m020 = load_stage(MAIL_STAGE)
+    store = m020.open_store()  # sqlite 连接不能跨线程共用，每个任务各开一个
+    try:
+        if m020.FAST_SELECT:
+            messages = m020.fetch_latest_messages(job["server"], job["user"], job["password"], keyword_sets,
+                                                  state_dir=state_dir, store=store, mailbox=job["mailbox"])
+        else:
+            messages = m020.fetch_recent_messages(job["server"], job["user"], job["password"],
+                                                  limit=limit or m020.RECENT_LIMIT, mailbox=job["mailbox"])
+    finally:
+        m020._close_store(store)
+    if messages is None:
+        raise RuntimeError("抓取失败（详见上方日志）")
+    # UID 只在一个文件夹内唯一：加上来源前缀
+    prefix = f"{job['name']}/{job['mailbox']}:".encode()
+    return [(prefix + uid, raw) for uid, raw in messages]
+
+
+async def _ingest(jobs: list[dict], keyword_sets, state_dir, limit) -> list:
+    pools = {server: asyncio.Semaphore(MAX_CONNECTIONS_PER_SERVER) for server in {j["server"] for j in jobs}}
+
+    async def one(job: dict):
+        async with pools[job["server"]]:
+            started = time.perf_counter()
+            with tracer.span(f"imap_source {job['name']}/{job['mailbox']}", cat="imap") as trace_args:
+                messages = await asyncio.to_thread(_fetch_one, job, keyword_sets, state_dir, limit)
+                trace_args["messages"] = len(messages)
+            return messages, time.perf_counter() - started
+
+    return await asyncio.gather(*(one(job) for job in jobs), return_exceptions=True)
+
+
+def ingest(jobs: list[dict], keyword_sets: list[dict] | None = None,
+           state_dir: str | None = None, limit: int | None = None) -> list[tuple[bytes, bytes]]:
+    """并发抓取所有邮箱，返回合并后的 [(来源:UID, 原始字节)]；失败的邮箱跳过"""
+    started = time.perf_counter()
+    print(f"📬 {len(jobs)} 个邮箱并发抓取（每个服务器最多 {MAX_CONNECTIONS_PER_SERVER} 个连接）...")
+    results = asyncio.run(_ingest(jobs, keyword_sets, state_dir, limit))
+
+    merged, slowest = [], 0.0
+    for job, result in zip(jobs, results):
+        label = f"{job['name']}/{job['mailbox']}"
+        if isinstance(result, BaseException):
+            print(f"⚠️ 邮箱 {label} 抓取失败，跳过: {type(result).__name__}: {result}")
+            continue
+        messages, seconds = result
+        slowest = max(slowest, seconds)
+        print(f"  · {label}: {len(messages)} 封，用时 {seconds:.1f}s")
+        merged += messages
+    print(f"📨 合并 {len(merged)} 封邮件，总用时 {time.perf_counter() - started:.1f}s（最慢的邮箱 {slowest:.1f}s）")
+    return merged
+
+
+if __name__ == "__main__":
+    for job in load_sources():
+        print(f"📬 {job['name']}: {job['user']}@{job['server']} / {job['mailbox']}")
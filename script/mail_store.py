@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+mail_store.py
+- 本地原始邮件库（SQLite + zlib 压缩），020 先查本地，命中就不再从邮箱下载：
+    messages  (邮箱, UIDVALIDITY, UID) → 原始 RFC822 字节；另按 Message-ID / 收到时间 / 主题建索引
+    reports   每封被选中的报表邮件的 HTML 正文（按 Message-ID），保留历史，不再只有 last_mail_html.html
+- 超过 MAIL_STORE_RETENTION_DAYS（按收到时间）的记录在关闭时清理
+- 下游失败后重跑、补跑历史某天：都只读本地库（见 020 的 replay_date / main.py --replay）
+- 位置：MAIL_STORE_PATH（默认 ~/.cache/meidiauto/mail_store.sqlite3）；MAIL_STORE=0 关闭
+- 查询：
+    python script/mail_store.py list --keyword 合肥市和裕达 --since 2025-09-01
+    python script/mail_store.py reports --date 2025-09-19
+    python script/mail_store.py html "<Message-ID>" > report.html
+    python script/mail_store.py stats | prune
+"""
+import os
+import sys
+import time
+import zlib
+import sqlite3
+from datetime import datetime, timedelta
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "meidiauto", "mail_store.sqlite3")
+DEFAULT_RETENTION_DAYS = 90
+COMPRESS_LEVEL = 6
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    mailbox     TEXT    NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid         INTEGER NOT NULL,
+    message_id  TEXT,
+    subject     TEXT,
+    received_at TEXT,
+    size        INTEGER,
+    raw         BLOB    NOT NULL,
+    stored_at   REAL    NOT NULL,
+    PRIMARY KEY (mailbox, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_message_id ON messages (message_id);
+CREATE INDEX IF NOT EXISTS idx_messages_received_at ON messages (received_at);
+CREATE TABLE IF NOT EXISTS reports (
+    message_id  TEXT PRIMARY KEY,
+    keyword     TEXT,
+    subject     TEXT,
+    received_at TEXT,
+    html        BLOB NOT NULL,
+    stored_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reports_received_at ON reports (received_at);
+"""
+
+
+def enabled() -> bool:
+    return os.getenv("MAIL_STORE", "1") != "0"
+
+
+class MailStore:
+    def __init__(self, path: str | None = None, retention_days: int | None = None):
+        self.path = path or os.getenv("MAIL_STORE_PATH") or DEFAULT_STORE_PATH
+        if retention_days is None:
+            retention_days = int(os.getenv("MAIL_STORE_RETENTION_DAYS", str(DEFAULT_RETENTION_DAYS)))
+        self.retention_days = retention_days
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30)  # 多租户子进程会同时写报表
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(_SCHEMA)
+
+    # ---------- 原始邮件 ----------
+    def get(self, mailbox: str, uidvalidity: int, uid: int) -> bytes | None:
+        row = self.db.execute("SELECT raw FROM messages WHERE mailbox=? AND uidvalidity=? AND uid=?",
+                              (mailbox, uidvalidity, uid)).fetchone()
+        return zlib.decompress(row["raw"]) if row else None
+
+    def get_by_message_id(self, message_id: str) -> bytes | None:
+        if not message_id:
+            return None
+        row = self.db.execute("SELECT raw FROM messages WHERE message_id=? ORDER BY stored_at DESC LIMIT 1",
+                              (message_id,)).fetchone()
+        return zlib.decompress(row["raw"]) if row else None
+
+    def put(self, mailbox: str, uidvalidity: int, uid: int, raw: bytes,
+            message_id: str | None = None, subject: str | None = None, received_at: str | None = None) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (mailbox, uidvalidity, uid, message_id, subject, received_at, len(raw),
+             zlib.compress(raw, COMPRESS_LEVEL), time.time()))
+        self.db.commit()
+
+    def find(self, keyword: str | None = None, since: str | None = None, until: str | None = None) -> list[dict]:
+        """按主题关键词 / 收到日期（YYYY-MM-DD，含端点）查找，按收到时间升序；不含原始字节"""
+        sql = "SELECT mailbox, uidvalidity, uid, message_id, subject, received_at, size FROM messages WHERE 1=1"
+        args = []
+        if keyword:
+            sql += " AND subject LIKE ?"
+            args.append(f"%{keyword}%")
+        if since:
+            sql += " AND received_at >= ?"
+            args.append(since)
+        if until:
+            sql += " AND received_at < ?"
+            args.append(_next_day(until))
+        return [dict(r) for r in self.db.execute(sql + " ORDER BY received_at", args)]
+
+    def messages_on(self, day: str, keywords: list[str]) -> list[tuple[bytes, bytes]]:
+        """某一天（北京时间）收到的、主题含任一关键词的邮件原始字节（供离线补跑）"""
+        raw_messages = []
+        seen = set()
+        for keyword in keywords:
+            for row in self.find(keyword, since=day, until=day):
+                # 同一封邮件在 UIDVALIDITY 变化前后可能各存一份
+                ident = row["message_id"] or (row["subject"], row["received_at"])
+                if ident not in seen:
+                    seen.add(ident)
+                    raw = self.get(row["mailbox"], row["uidvalidity"], row["uid"])
+                    raw_messages.append((str(row["uid"]).encode(), raw))
+        return raw_messages
+
+    # ---------- 报表 HTML ----------
+    def put_report(self, message_id: str, keyword: str, subject: str, received_at: str, html: str) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?)",
+            (message_id, keyword, subject, received_at,
+             zlib.compress(html.encode("utf-8"), COMPRESS_LEVEL), time.time()))
+        self.db.commit()
+
+    def find_reports(self, keyword: str | None = None, day: str | None = None) -> list[dict]:
+        sql = "SELECT message_id, keyword, subject, received_at FROM reports WHERE 1=1"
+        args = []
+        if keyword:
+            sql += " AND (keyword = ? OR subject LIKE ?)"
+            args += [keyword, f"%{keyword}%"]
+        if day:
+            sql += " AND received_at >= ? AND received_at < ?"
+            args += [day, _next_day(day)]
+        return [dict(r) for r in self.db.execute(sql + " ORDER BY received_at", args)]
+
+    def report_html(self, message_id: str) -> str | None:
+        row = self.db.execute("SELECT html FROM reports WHERE message_id=?", (message_id,)).fetchone()
+        return zlib.decompress(row["html"]).decode("utf-8") if row else None
+
+    # ---------- 维护 ----------
+    def prune(self) -> int:
+        """删除收到时间早于保留期的记录，返回删除条数"""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).date().isoformat()
+        removed = self.db.execute("DELETE FROM messages WHERE received_at < ?", (cutoff,)).rowcount
+        removed += self.db.execute("DELETE FROM reports WHERE received_at < ?", (cutoff,)).rowcount
+        self.db.commit()
+        return removed
+
+    def stats(self) -> dict:
+        m = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(raw)), 0) FROM messages").fetchone()
+        r = self.db.execute("SELECT COUNT(*) FROM reports").fetchone()
+        return {"messages": m[0], "raw_bytes": m[1], "stored_bytes": m[2], "reports": r[0],
+                "file_bytes": os.path.getsize(self.path)}
+
+    def close(self) -> None:
+        removed = self.prune()
+        if removed:
+            print(f"🧹 本地邮件库清理了 {removed} 条超过 {self.retention_days} 天的记录")
+        self.db.close()
+
+
+def _next_day(day: str) -> str:
+    return (datetime.fromisoformat(day[:10]) + timedelta(days=1)).date().isoformat()
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地原始邮件库查询")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_list = sub.add_parser("list", help="按关键词/日期列出邮件")
+    p_list.add_argument("--keyword")
+    p_list.add_argument("--since", help="YYYY-MM-DD")
+    p_list.add_argument("--until", help="YYYY-MM-DD")
+    p_rep = sub.add_parser("reports", help="列出保存的报表 HTML")
+    p_rep.add_argument("--keyword")
+    p_rep.add_argument("--date", help="YYYY-MM-DD")
+    p_html = sub.add_parser("html", help="输出某封报表邮件的 HTML")
+    p_html.add_argument("message_id")
+    sub.add_parser("stats", help="统计")
+    sub.add_parser("prune", help="按保留期清理")
+    args = parser.parse_args()
+
+    store = MailStore()
+    if args.cmd == "list":
+        for row in store.find(args.keyword, args.since, args.until):
+            print(f"{row['received_at']}  UID {row['uid']:<8} {row['size']:>10,}B  {row['subject']}  {row['message_id']}")
+    elif args.cmd == "reports":
+        for row in store.find_reports(args.keyword, args.date):
+            print(f"{row['received_at']}  [{row['keyword']}] {row['subject']}  {row['message_id']}")
+    elif args.cmd == "html":
+        html = store.report_html(args.message_id)
+        if html is None:
+            print(f"❌ 没有找到: {args.message_id}", file=sys.stderr)
+            sys.exit(1)
+        sys.stdout.write(html)
+    elif args.cmd == "stats":
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+    elif args.cmd == "prune":
+        print(f"🧹 删除 {store.prune()} 条")
+    store.db.close()
@@ -1,9 +1,13 @@
 import os
-import subprocess
 import sys
 
 # 获取当前主程序所在文件夹路径
 script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_dir)
+
+from pipeline import run_pipeline, print_summary  # noqa: E402
+from workbook_session import WorkbookSession  # noqa: E402
+import tracer  # noqa: E402
 
 # 定义要执行的子程序列表
 subprograms = [
@@ -23,17 +27,22 @@ subprograms = [
 
 ]
 
-# 依次执行子程序
-for script in subprograms:
-    script_path = os.path.join(script_dir, script)
-    print(f"🚀 正在运行 {script} ...")
-
-    try:
-        result = subprocess.run(["python", script_path],  # 去掉 common_folder
-                                capture_output=True, text=True, encoding="utf-8", check=True)
-        print(result.stdout)
-    except subprocess.CalledProcessError as e:
-        print(f"❌ {script} 运行失败，退出程序！\n错误信息:\n{e.stderr}")
-        sys.exit(1)  # 立即终止整个程序
+# 各子程序未传参时默认使用 当前目录/data
+data_folder = os.path.join(os.getcwd(), "data")
+
+# 依次执行子程序，任一失败立即终止整个程序
+context = {"data_dir": data_folder, "workbook_session": WorkbookSession(data_folder)}
+results = run_pipeline(subprograms, context, fail_fast=True)
+print_summary(results)
+
+# 设置了 PIPELINE_TRACE 时输出 trace.json
+trace_file = tracer.trace_path(data_folder)
+if trace_file:
+    tracer.save(trace_file)
+
+if not all(item["ok"] for item in results):
+    failed = next(item for item in results if not item["ok"])
+    print(f"❌ {failed['stage']} 运行失败，退出程序！\n错误信息:\n{failed['error']}")
+    sys.exit(1)  # 立即终止整个程序
 
 print("\n🎉 全部子程序执行完成！")
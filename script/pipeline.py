@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+pipeline.py
+- 在同一个 Python 进程内依次运行各阶段脚本，替代“每个阶段起一个 python 子进程”
+- 每个阶段脚本提供 run(context) 入口，返回 dict 结果；脚本仍可用 `python xxx.py <data目录>` 单独运行
+- pandas / openpyxl / bs4 只导入一次，阶段输出实时打印
+- context["workbook_session"] 存在时，“总库存”整次运行只加载/保存一次（见 workbook_session.py）
+"""
+import os
+import sys
+import time
+import traceback
+import importlib.util
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 阶段脚本里有 `import xxx` 的同目录模块时，需要 script 目录在 sys.path 中
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+from tracer import span  # noqa: E402
+import stage_log  # noqa: E402
+from lazy_import import IMPORT_TIMES, print_import_report  # noqa: E402
+
+# 默认阶段顺序（main.py、多租户、守护进程与 lazy_import --check 共用这一份）
+DEFAULT_STAGES = [
+    "020 Email download.py",
+    "021 Merge excel.py",
+    "030 Warehousing at home.py",
+    "032 Warehousing at out.py",
+    "033 list insertion.py",
+    "041 operation.py",
+    "042 Color display.py",
+    "050 mailtxt.py",
+    "051 Send an email.py",
+]
+
+_loaded_stages = {}
+
+
+def stage_module_name(filename: str) -> str:
+    """'030 Warehousing at home.py' -> 'stage_030_warehousing_at_home'"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    safe = "".join(c if (c.isalnum() or c == "_") else "_" for c in stem.lower())
+    return f"stage_{safe}"
+
+
+def load_stage(filename: str):
+    """按文件名导入阶段脚本（文件名含空格，不能直接 import），同一进程内只导入一次。"""
+    if filename in _loaded_stages:
+        return _loaded_stages[filename]
+
+    path = os.path.join(SCRIPT_DIR, filename)
+    spec = importlib.util.spec_from_file_location(stage_module_name(filename), path)
+    module = importlib.util.module_from_spec(spec)
+    started = time.perf_counter()
+    spec.loader.exec_module(module)
+    IMPORT_TIMES[f"stage:{filename}"] = time.perf_counter() - started
+
+    if not callable(getattr(module, "run", None)):
+        raise AttributeError(f"阶段脚本缺少 run(context) 入口: {filename}")
+
+    _loaded_stages[filename] = module
+    return module
+
+
+def run_stage(filename: str, context: dict) -> dict:
+    """
+    运行单个阶段，返回结构化结果：
+    {"stage", "ok", "seconds", "result", "error", "counters"}
+    - counters 为阶段内 stage_log.counters() 累计的计数（如回填命中数）
+    - 阶段内的 sys.exit(0)/exit() 视为正常结束；非 0 退出码视为失败
+    """
+    started = time.perf_counter()
+    outcome = {"stage": filename, "ok": True, "seconds": 0.0, "result": None, "error": None}
+
+    stage_log.begin_stage()
+    with span(filename, cat="stage") as trace_args:
+        try:
+            module = load_stage(filename)
+            outcome["result"] = module.run(context)
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                outcome["ok"] = False
+                outcome["error"] = f"SystemExit({e.code})"
+        except Exception as e:
+            outcome["ok"] = False
+            outcome["error"] = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        trace_args["ok"] = outcome["ok"]
+
+    outcome["seconds"] = time.perf_counter() - started
+    outcome["counters"] = stage_log.end_stage()
+    return outcome
+
+
+def _flush_session_for(filename: str, context: dict) -> bool:
+    """未声明 WORKBOOK_ACCESS 的阶段直接读磁盘文件，运行前先把会话中的修改落盘。返回是否落盘。"""
+    session = context.get("workbook_session")
+    if session is None or not session.dirty:
+        return False
+    try:
+        access = getattr(load_stage(filename), "WORKBOOK_ACCESS", None)
+    except Exception:
+        access = None  # 导入失败由 run_stage 报告
+    if access is None:
+        return session.save()
+    return False
+
+
+def run_pipeline(stages: list[str], context: dict, fail_fast: bool = False, cache=None) -> list[dict]:
+    """
+    依次运行阶段；fail_fast=True 时遇到失败立即停止。结束时保存工作簿会话。
+    cache 为 stage_cache.StageCache 时，命中缓存的阶段直接恢复输出（见 stage_cache.py）。
+    """
+    cached_run = None
+    if cache is not None:
+        from stage_cache import CachedRun
+        cached_run = CachedRun(cache, context)
+
+    results = []
+    for filename in stages:
+        print(f"🚀 正在运行 {filename} ...")
+        if cached_run is None:
+            _flush_session_for(filename, context)
+            outcome = run_stage(filename, context)
+        else:
+            try:
+                outcome = cached_run.run(filename)
+            except RuntimeError as e:
+                outcome = {"stage": filename, "ok": False, "seconds": 0.0, "result": None, "error": str(e)}
+        results.append(outcome)
+        context.setdefault("results", {})[filename] = outcome["result"]
+
+        if outcome["ok"]:
+            print(f"✅ {filename} 完成，用时 {outcome['seconds']:.2f}s\n")
+        else:
+            print(f"⚠️ {filename} 执行出错: {outcome['error']}\n")
+            if fail_fast:
+                break
+
+    session = context.get("workbook_session")
+    if cached_run is not None:
+        try:
+            cached_run.finish()
+        except RuntimeError as e:
+            print(f"⚠️ {e}")
+    if session is not None:
+        saved = session.save()
+        if cached_run is not None and saved:
+            cached_run.store_session()
+        session.close()
+    if cache is not None:
+        cache.close()
+    return results
+
+
+def print_summary(results: list[dict], show_imports: bool = True) -> None:
+    print("\n📊 阶段用时汇总：")
+    for item in results:
+        flag = "✅" if item["ok"] else "❌"
+        stats = "  ".join(f"{k}={v}" for k, v in (item.get("counters") or {}).items())
+        print(f"  {flag} {item['stage']:<32} {item['seconds']:>8.2f}s  {stats}".rstrip())
+    if show_imports:
+        print_import_report()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+scheduler.py
+- 按阶段声明的 INPUTS / OUTPUTS 构建依赖图（DAG），互不依赖的阶段并行执行
+- 资源写法：
+    "file:output.html"      data 目录下的文件（支持通配符，如 "file:总库存*.xlsx"）
+    "sheet:库存表"           总库存工作簿中的整张工作表
+    "sheet:库存表!M"         工作表中的某一列；"sheet:库存表!K:T" 表示 K~T 列
+    "mail:inbox"            其它外部资源，按名称精确匹配
+- 依赖规则（按阶段列表中的先后）：写后读、写后写、读后写都会产生依赖边
+- 任一阶段未声明 INPUTS/OUTPUTS 时，它与前后所有阶段串行（保持原有顺序）
+- WORKBOOK_ACCESS = "write" 的阶段要修改内存中的工作簿会话，始终在主进程内运行；
+  其它阶段在 workers > 1 时交给进程池，派发前先把会话落盘；
+  但 WORKBOOK_ACCESS = "read" 的阶段（如 050 mailtxt）在主进程里直接读内存中的工作簿，
+  只有当时确有别的阶段可以同时运行（另有就绪阶段或正在运行的阶段）才交给进程池——
+  否则子进程要先等会话落盘、再把“总库存”整本重新载入，只会更慢
+- 阶段可提供 prefetch(context)：不依赖前序阶段的准备工作（如 033 读取 list.xlsx），
+  在 workers > 1 时一开始就交给进程池，结果放在 context["prefetched"][阶段名]
+- 任一阶段失败立即停止派发新阶段（fail fast）
+- 不使用阶段缓存（stage_cache.py 的键按阶段顺序串联，只在串行的 pipeline.run_pipeline 中使用）
+"""
+import os
+import fnmatch
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from openpyxl.utils import column_index_from_string
+
+import tracer
+from pipeline import load_stage, run_stage, _flush_session_for
+from workbook_session import INVENTORY_PATTERN
+
+# 只能留在主进程里的 context 项（不可跨进程传递）
+LOCAL_ONLY_KEYS = {"workbook_session", "results"}
+
+
+# ================================
+# 🔗 资源匹配
+# ================================
+def _parse_sheet(value: str):
+    """'库存表!K:T' -> ('库存表', {11..20})；不带列时列集合为 None（整表）"""
+    sheet, _, cols = value.partition("!")
+    if not cols:
+        return sheet, None
+    first, _, last = cols.partition(":")
+    start = column_index_from_string(first)
+    end = column_index_from_string(last or first)
+    return sheet, set(range(min(start, end), max(start, end) + 1))
+
+
+def resources_overlap(a: str, b: str) -> bool:
+    kind_a, _, val_a = a.partition(":")
+    kind_b, _, val_b = b.partition(":")
+
+    if kind_a == kind_b == "file":
+        return fnmatch.fnmatch(val_a, val_b) or fnmatch.fnmatch(val_b, val_a)
+
+    if kind_a == kind_b == "sheet":
+        sheet_a, cols_a = _parse_sheet(val_a)
+        sheet_b, cols_b = _parse_sheet(val_b)
+        if not (fnmatch.fnmatch(sheet_a, sheet_b) or fnmatch.fnmatch(sheet_b, sheet_a)):
+            return False
+        return cols_a is None or cols_b is None or bool(cols_a & cols_b)
+
+    # 工作表都保存在“总库存”文件里：读文件的阶段要等写工作表的阶段
+    if {kind_a, kind_b} == {"file", "sheet"}:
+        file_val = val_a if kind_a == "file" else val_b
+        return (fnmatch.fnmatch(INVENTORY_PATTERN, file_val)
+                or fnmatch.fnmatch(file_val, INVENTORY_PATTERN))
+
+    return a == b
+
+
+def _any_overlap(xs, ys) -> bool:
+    return any(resources_overlap(x, y) for x in xs for y in ys)
+
+
+# ================================
+# 🧭 构建依赖图
+# ================================
+def stage_declarations(filename: str):
+    """返回 (inputs, outputs)；未声明时返回 None。"""
+    module = load_stage(filename)
+    inputs = getattr(module, "INPUTS", None)
+    outputs = getattr(module, "OUTPUTS", None)
+    if inputs is None or outputs is None:
+        return None
+    return list(inputs), list(outputs)
+
+
+def build_graph(stages: list[str]) -> dict[str, set[str]]:
+    """返回 {阶段: 它依赖的阶段集合}"""
+    decls = {s: stage_declarations(s) for s in stages}
+    deps = {s: set() for s in stages}
+
+    for i, later in enumerate(stages):
+        for earlier in stages[:i]:
+            d_early, d_late = decls[earlier], decls[later]
+            if d_early is None or d_late is None:
+                deps[later].add(earlier)
+                continue
+            in_e, out_e = d_early
+            in_l, out_l = d_late
+            if (_any_overlap(out_e, in_l)        # 写后读
+                    or _any_overlap(out_e, out_l)  # 写后写
+                    or _any_overlap(in_e, out_l)):  # 读后写
+                deps[later].add(earlier)
+    return deps
+
+
+def describe_graph(stages: list[str], deps: dict[str, set[str]]) -> None:
+    """打印依赖图（只列直接前驱，省略可由传递关系推出的边）"""
+    print("🧭 阶段依赖图：")
+    for s in stages:
+        direct = [d for d in stages if d in deps[s] and not any(d in deps[x] for x in deps[s])]
+        after = ", ".join(direct) or "（无）"
+        print(f"  · {s} ← {after}")
+
+
+# ================================
+# 🚀 并行执行
+# ================================
+def _run_in_worker(filename: str, context: dict) -> dict:
+    outcome = run_stage(filename, context)
+    outcome["trace"] = tracer.drain()  # 子进程的追踪事件随结果带回主进程
+    return outcome
+
+
+def _prefetch_in_worker(filename: str, context: dict):
+    with tracer.span(f"prefetch {filename}", cat="stage"):
+        result = load_stage(filename).prefetch(context)
+    return result, tracer.drain()
+
+
+def _take_prefetched(filename: str, prefetches: dict, context: dict) -> None:
+    fut = prefetches.pop(filename, None)
+    if fut is None:
+        return
+    try:
+        result, events = fut.result()
+        tracer.merge(events)
+        context.setdefault("prefetched", {})[filename] = result
+    except BaseException as e:  # 预取失败时由阶段自己重新准备
+        print(f"⚠️ {filename} 预取失败，改为阶段内处理: {e!r}")
+
+
+def _runs_in_main_process(filename: str) -> bool:
+    return getattr(load_stage(filename), "WORKBOOK_ACCESS", None) == "write"
+
+
+def _reads_session(filename: str) -> bool:
+    return getattr(load_stage(filename), "WORKBOOK_ACCESS", None) == "read"
+
+
+def run_scheduled(stages: list[str], context: dict, workers: int | None = None) -> list[dict]:
+    """
+    按依赖图运行阶段。workers 为进程池大小（默认取 PIPELINE_WORKERS 环境变量，再默认 CPU 数）。
+    返回值与 pipeline.run_pipeline 相同（按阶段列表顺序）。
+    """
+    if workers is None:
+        workers = int(os.getenv("PIPELINE_WORKERS", "0")) or (os.cpu_count() or 1)
+
+    deps = build_graph(stages)
+    describe_graph(stages, deps)
+
+    session = context.get("workbook_session")
+    worker_context = {k: v for k, v in context.items() if k not in LOCAL_ONLY_KEYS}
+
+    outcomes, done = {}, set()
+    pending = list(stages)
+    running = {}
+    failed = False
+
+    # 子进程 fork 时会继承主进程已记录的追踪事件：initializer 先清空，drain 只带回子进程自己的事件
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=tracer.drain) if workers > 1 else None
+    prefetches = {}
+    if pool is not None:
+        for s in stages:
+            if callable(getattr(load_stage(s), "prefetch", None)):
+                prefetches[s] = pool.submit(_prefetch_in_worker, s, worker_context)
+    try:
+        while (pending and not failed) or running:
+            ready = [s for s in pending if deps[s] <= done] if not failed else []
+
+            # 1) 可并行的阶段交给进程池
+            if pool is not None:
+                for s in [s for s in ready if not _runs_in_main_process(s)]:
+                    if _reads_session(s) and len(ready) == 1 and not running:
+                        continue  # 没有可同时运行的阶段：留在主进程读内存中的会话
+                    if session is not None:
+                        session.save()  # 子进程从磁盘读取最新状态
+                    print(f"🚀 并行派发 {s} ...")
+                    _take_prefetched(s, prefetches, worker_context)
+                    running[pool.submit(_run_in_worker, s, worker_context)] = s
+                    pending.remove(s)
+                    ready.remove(s)
+
+            # 2) 主进程内运行一个就绪阶段（修改工作簿会话的阶段只能在这里跑）
+            if ready:
+                s = ready[0]
+                pending.remove(s)
+                print(f"🚀 正在运行 {s} ...")
+                _take_prefetched(s, prefetches, context)
+                _flush_session_for(s, context)
+                outcome = run_stage(s, context)
+                outcomes[s] = outcome
+                context.setdefault("results", {})[s] = outcome["result"]
+                done.add(s)
+                failed = failed or not outcome["ok"]
+                _report(outcome)
+
+            # 3) 收集已完成的并行阶段；主进程无事可做时阻塞等待
+            if running:
+                finished, _ = wait(list(running), timeout=None if not ready else 0,
+                                   return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    s = running.pop(fut)
+                    outcome = fut.result()
+                    tracer.merge(outcome.pop("trace", []))
+                    outcomes[s] = outcome
+                    context.setdefault("results", {})[s] = outcome["result"]
+                    done.add(s)
+                    failed = failed or not outcome["ok"]
+                    _report(outcome)
+            elif not ready and pending and not failed:
+                raise RuntimeError(f"依赖图无法继续推进: {pending}")
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if session is not None:
+            session.close()
+
+    if failed:
+        skipped = [s for s in stages if s not in outcomes]
+        if skipped:
+            print(f"⛔ 有阶段失败，已停止后续阶段: {skipped}")
+    return [outcomes[s] for s in stages if s in outcomes]
+
+
+def _report(outcome: dict) -> None:
+    if outcome["ok"]:
+        print(f"✅ {outcome['stage']} 完成，用时 {outcome['seconds']:.2f}s\n")
+    else:
+        print(f"⚠️ {outcome['stage']} 执行出错: {outcome['error']}\n")
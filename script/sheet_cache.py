@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+sheet_cache.py
+- 021 合并输入的解析缓存：源 Excel 的每个工作表解析一次，值按列存成压缩文件，之后只要文件内容不变就不再用 openpyxl 解析
+- 键 = 文件内容 SHA-256 + 解析器版本（sheet_merge.PARSER_VERSION + openpyxl 版本）+ 工作表名；文件改名、被复制都能命中
+- 格式：gzip 压缩的 pickle 流，每 CHUNK_ROWS 行一块，块内按列存放（同列同类型，压缩率高），另记每行的长度；
+  边复制边写入、边读边复制，内存只多出一块
+- 写入先写临时文件再改名，中途出错不留半截文件；多进程（sheet_merge 的进程池）同时写同一个键时后写的覆盖，内容相同
+- 命中时先把整个文件解压一遍（gzip 在末尾校验 CRC 和长度，只解压不反序列化，很快），截断或损坏的缓存在
+  往目标工作表写第一行之前就发现：删除它，当作未命中，重新解析源文件
+- 淘汰：超过 SHEET_CACHE_MAX_AGE_DAYS（默认 30）天未使用的删除，总大小超过 SHEET_CACHE_MAX_MB（默认 256）时按最后使用时间从旧到新删除；
+  最后使用时间即文件 mtime，命中时刷新
+- 位置：SHEET_CACHE_DIR（默认 ~/.cache/meidiauto/sheets）；SHEET_CACHE=0 关闭
+- 说明：原计划用 Arrow IPC / Parquet，但 pyarrow 不在依赖中，且单元格是混合类型（文本、数字、日期、空）；
+  这里用标准库的 pickle + gzip 实现同样的按列存储。缓存目录只由本机用户自己写入
+- 维护：
+    python script/sheet_cache.py stats | prune | clear
+"""
+import os
+import sys
+import gzip
+import time
+import pickle
+import hashlib
+import tempfile
+
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "meidiauto", "sheets")
+SUFFIX = ".pkl.gz"
+CHUNK_ROWS = 1000
+COMPRESS_LEVEL = 1  # 写入快，压缩率已够用
+
+
+def enabled() -> bool:
+    return os.getenv("SHEET_CACHE", "1") != "0"
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_columns(rows: list[tuple]) -> tuple[list[int], list[list]]:
+    widths = [len(row) for row in rows]
+    width = max(widths, default=0)
+    if all(w == width for w in widths):
+        return widths, [list(col) for col in zip(*rows)]
+    padded = [tuple(row) + (None,) * (width - len(row)) for row in rows]  # read_only 的行有时是 list
+    return widths, [list(col) for col in zip(*padded)]
+
+
+def _to_rows(widths: list[int], columns: list[list]) -> list[tuple]:
+    if not columns:
+        return [()] * len(widths)
+    rows = list(zip(*columns))
+    width = len(columns)
+    if all(w == width for w in widths):
+        return rows
+    return [row[:w] for row, w in zip(rows, widths)]
+
+
+class SheetCache:
+    def __init__(self, root: str | None = None, version: str = "", max_bytes: int | None = None,
+                 max_age_days: float | None = None):
+        self.root = root or os.getenv("SHEET_CACHE_DIR") or DEFAULT_ROOT
+        os.makedirs(self.root, exist_ok=True)
+        self.version = version
+        if max_bytes is None:
+            max_bytes = int(os.getenv("SHEET_CACHE_MAX_MB", "256")) * 1024 * 1024
+        self.max_bytes = max_bytes
+        if max_age_days is None:
+            max_age_days = float(os.getenv("SHEET_CACHE_MAX_AGE_DAYS", "30"))
+        self.max_age_days = max_age_days
+
+    def _path(self, digest: str, name: str) -> str:
+        key = hashlib.sha256(f"{digest}\0{self.version}\0{name}".encode("utf-8")).hexdigest()
+        return os.path.join(self.root, key + SUFFIX)
+
+    # ---------- 读 ----------
+    def has(self, digest: str, name: str) -> bool:
+        return os.path.exists(self._path(digest, name))
+
+    def rows(self, digest: str, name: str):
+        """命中时返回逐行产出的迭代器（并刷新最后使用时间），未命中返回 None"""
+        path = self._path(digest, name)
+        f = None
+        try:
+            _verify(path)
+            f = gzip.open(path, "rb")
+            header = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            if f is not None:
+                f.close()
+            print(f"⚠️ 解析缓存文件损坏，重新解析: {e!r}")
+            _remove(path)
+            return None
+        if header != (self.version, name):
+            f.close()
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return self._iter(f)
+
+    @staticmethod
+    def _iter(f):
+        with f:
+            while (chunk := pickle.load(f)) is not None:
+                yield from _to_rows(*chunk)
+
+    # ---------- 写 ----------
+    def record(self, digest: str, name: str, rows):
+        """原样产出 rows，同时按块写入缓存；全部产出后才生效（中途异常或提前结束不留文件）"""
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        done = False
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=COMPRESS_LEVEL) as f:
+                pickle.dump((self.version, name), f, protocol=pickle.HIGHEST_PROTOCOL)
+                chunk = []
+                for row in rows:
+                    chunk.append(row)
+                    if len(chunk) >= CHUNK_ROWS:
+                        pickle.dump(_to_columns(chunk), f, protocol=pickle.HIGHEST_PROTOCOL)
+                        chunk = []
+                    yield row
+                if chunk:
+                    pickle.dump(_to_columns(chunk), f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(None, f)
+            os.replace(tmp, self._path(digest, name))
+            done = True
+        finally:
+            if not done:
+                _remove(tmp)
+
+    # ---------- 维护 ----------
+    def _entries(self) -> list[os.DirEntry]:
+        return [e for e in os.scandir(self.root) if e.is_file()]
+
+    def evict(self) -> int:
+        """删除过期的、超出总大小的（按最后使用时间从旧到新）缓存文件及残留的 .part；返回删除数"""
+        removed = 0
+        now = time.time()
+        entries = []
+        for e in self._entries():
+            st = e.stat()
+            stale_part = e.name.endswith(".part") and now - st.st_mtime > 3600
+            expired = self.max_age_days > 0 and now - st.st_mtime > self.max_age_days * 86400
+            if stale_part or (e.name.endswith(SUFFIX) and expired):
+                removed += _remove(e.path)
+            elif e.name.endswith(SUFFIX):
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            removed += _remove(path)
+            total -= size
+        return removed
+
+    def stats(self) -> dict:
+        entries = [e for e in self._entries() if e.name.endswith(SUFFIX)]
+        return {"entries": len(entries), "bytes": sum(e.stat().st_size for e in entries),
+                "max_bytes": self.max_bytes, "max_age_days": self.max_age_days}
+
+    def clear(self) -> int:
+        return sum(_remove(e.path) for e in self._entries())
+
+
+def _verify(path: str) -> None:
+    """整个文件解压一遍：截断时抛 EOFError，内容损坏时抛 BadGzipFile / zlib.error"""
+    with gzip.open(path, "rb") as f:
+        while f.read(1 << 20):
+            pass
+
+
+def _remove(path: str) -> int:
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0
+
+
+def open_cache(version: str) -> SheetCache | None:
+    if not enabled():
+        return None
+    try:
+        return SheetCache(version=version)
+    except Exception as e:
+        print(f"⚠️ 解析缓存不可用，本次直接解析: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="021 合并输入解析缓存")
+    parser.add_argument("cmd", choices=["stats", "prune", "clear"])
+    args = parser.parse_args()
+
+    cache = SheetCache()
+    if args.cmd == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    elif args.cmd == "prune":
+        print(f"🧹 删除 {cache.evict()} 个")
+    else:
+        print(f"🧹 删除 {cache.clear()} 个")
+    sys.exit(0)
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+sheet_merge.py
+- 021 的合并引擎：把其他 Excel 的工作表（只取值，公式取缓存值）按顺序复制进基底工作簿，同名工作表后写入的覆盖先写入的
+- 流式：源文件以 read_only 打开、逐行读取逐行追加，源文件从不整本载入；内存只多出一行
+- 先按工作表名走一遍“删除同名 → 追加到末尾”（只建空工作表），得出每个工作表最终来自哪个文件，
+  被后面文件覆盖的工作表不读取；一周的存量查询导出都叫“第一页”时只读最后一份
+- 结果（工作表顺序、重名处理、单元格值）与逐本 load_workbook 后逐行复制完全一致；
+  读得出工作表名、却载入失败的文件：先把工作簿恢复到合并前（只需还原工作表列表），去掉这个文件重新合并，
+  与原来整本跳过它的结果相同（少见，只多花一次重来的时间）
+- 基底工作簿由调用方载入（021 交给工作簿会话，下游阶段直接在内存中修改，不必再从磁盘读一遍）
+- 要读的文件不止一个时，在进程池中并行解析（XML 解析吃 CPU），各自返回值的行元组；
+  主进程按合并顺序逐个取结果写入（只有一个写入方，顺序和覆盖关系不变），最多同时持有 MERGE_WORKERS 个文件的行
+- MERGE_WORKERS：进程数，默认 CPU 核数；1 = 在本进程中逐行复制；文件都很小时（MERGE_PARALLEL_MIN_BYTES）也不开进程池
+- 解析缓存（sheet_cache.py）：按文件内容 + PARSER_VERSION 缓存每个工作表的值，命中时直接从缓存逐块写入，不再打开源文件；
+  只有未命中的文件才交给进程池。复制方式（值的取法）改变时要把 PARSER_VERSION 加一
+- 一致性自检（原实现、逐行流式、进程池并行三种合并逐格比对，并给出耗时与峰值内存）：
+    python script/sheet_merge.py data/合肥市和裕达_xxx.xlsx data/存量查询_*.xlsx
+    python script/sheet_merge.py --skus 60000 --days 7 [--distinct]   # 用 bench_generate 生成的合成文件
+  另有 cached：缓存预热后的合并（自检使用临时缓存目录，其余三种关闭缓存）
+"""
+import os
+import sys
+import time
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+
+from concurrent.futures import ProcessPoolExecutor
+
+import openpyxl
+from openpyxl import load_workbook
+
+import tracer
+import sheet_cache
+from tracer import span
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_PKG_RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_OFFICE_DOCUMENT = "/officeDocument"
+
+MERGE_WORKERS = int(os.getenv("MERGE_WORKERS", str(os.cpu_count() or 1)))
+MERGE_PARALLEL_MIN_BYTES = int(os.getenv("MERGE_PARALLEL_MIN_BYTES", str(2 * 1024 * 1024)))  # 要读的文件合计小于此大小时不开进程池
+PARSER_VERSION = 1
+CACHE_VERSION = f"{PARSER_VERSION}/openpyxl-{openpyxl.__version__}"
+
+
+def sheet_names(path: str) -> list[str]:
+    """只读 workbook.xml 取工作表名（不解析单元格和共享字符串）；不是有效的 xlsx 时抛异常"""
+    with zipfile.ZipFile(path) as zf:
+        part = "xl/workbook.xml"
+        rels = ET.fromstring(zf.read("_rels/.rels"))
+        for rel in rels.iter(f"{_NS_PKG_RELS}Relationship"):
+            if rel.get("Type", "").endswith(_OFFICE_DOCUMENT):
+                part = posixpath.normpath(rel.get("Target").lstrip("/"))
+                break
+        root = ET.fromstring(zf.read(part))
+    return [sheet.get("name") for sheet in root.iter(f"{_NS_MAIN}sheet")]
+
+
+def plan_merge(dst_wb, sources: list[tuple[str, list[str]]]) -> list[tuple[str, str, object]]:
+    """
+    按原顺序在 dst_wb 中执行“删除同名工作表 → 新建到末尾”（只建空表），
+    返回最终留在工作簿中的 [(源文件, 源工作表名, 目标工作表)]，按源文件顺序。
+    """
+    targets = []
+    for path, names in sources:
+        for name in names:
+            if name in dst_wb.sheetnames:
+                del dst_wb[name]
+            targets.append((path, name, dst_wb.create_sheet(name)))
+    alive = {id(ws) for ws in dst_wb.worksheets}
+    return [t for t in targets if id(t[2]) in alive]
+
+
+class SourceUnreadable(Exception):
+    """源文件在规划合并之后才发现无法载入"""
+
+    def __init__(self, path: str, reason):
+        super().__init__(str(reason))
+        self.path = path
+
+
+def merge_into(dst_wb, paths: list[str], prefix: str = "✅") -> list[tuple[str, str]]:
+    """
+    把 paths（按合并顺序）的工作表复制进 dst_wb，返回实际复制的 [(工作表名, 文件名)]。
+    打不开的文件整本跳过（与逐本 load_workbook 时一致）。
+    """
+    original_sheets = list(dst_wb._sheets)  # plan_merge 只删除、新建工作表；还原这个列表即回到合并前
+    try:
+        return _merge(dst_wb, paths, prefix)
+    except SourceUnreadable as e:
+        print(f"⚠️ 跳过无法打开的文件: {os.path.basename(e.path)}，原因：{e}；不含它重新合并")
+        dst_wb._sheets[:] = original_sheets
+        return merge_into(dst_wb, [p for p in paths if p != e.path], prefix)
+
+
+def _merge(dst_wb, paths: list[str], prefix: str) -> list[tuple[str, str]]:
+    sources = []
+    for path in paths:
+        try:
+            sources.append((path, sheet_names(path)))
+        except Exception as e:
+            print(f"⚠️ 跳过无法打开的文件: {os.path.basename(path)}，原因：{e}")
+
+    targets = plan_merge(dst_wb, sources)
+    wanted = {(path, name) for path, name, _ in targets}
+    for path, names in sources:
+        for name in names:
+            if (path, name) not in wanted:
+                print(f"⏭️ 工作表 {name} ← {os.path.basename(path)} 会被后面的文件覆盖，不读取")
+
+    by_file = {}
+    for path, name, ws in targets:
+        by_file.setdefault(path, []).append((name, ws))
+
+    cache = sheet_cache.open_cache(CACHE_VERSION)
+    digests = {}
+    if cache is not None:
+        with span("sheet_cache_lookup", files=len(by_file)):
+            for path in by_file:
+                try:
+                    digests[path] = sheet_cache.file_digest(path)
+                except OSError:
+                    pass
+    to_parse = [path for path, sheets in by_file.items()
+                if path not in digests or not all(cache.has(digests[path], name) for name, _ in sheets)]
+    if cache is not None and len(to_parse) < len(by_file):
+        print(f"📦 解析缓存命中 {len(by_file) - len(to_parse)}/{len(by_file)} 个文件")
+
+    workers = min(MERGE_WORKERS, len(to_parse))
+    if workers > 1 and sum(os.path.getsize(p) for p in to_parse) >= MERGE_PARALLEL_MIN_BYTES:
+        copied = _copy_parallel(by_file, to_parse, workers, prefix, cache, digests)
+    else:
+        copied = _copy_inline(by_file, prefix, cache, digests)
+
+    if cache is not None:
+        removed = cache.evict()
+        if removed:
+            print(f"🧹 解析缓存淘汰 {removed} 个文件")
+    return copied
+
+
+def _copy_inline(by_file: dict[str, list], prefix: str, cache=None, digests=None) -> list[tuple[str, str]]:
+    """本进程中逐行流式复制；缓存命中的工作表从缓存读，未命中的边复制边写入缓存"""
+    copied = []
+    digests = digests or {}
+    for path, sheets in by_file.items():
+        file = os.path.basename(path)
+        digest = digests.get(path)
+        src_wb = None
+        try:
+            for name, dst in sheets:
+                rows = cache.rows(digest, name) if digest else None
+                cached = rows is not None
+                if not cached:
+                    if src_wb is None:
+                        try:
+                            src_wb = load_workbook(path, read_only=True, data_only=True)
+                        except Exception as e:
+                            raise SourceUnreadable(path, e) from e
+                    rows = sheet_values(src_wb[name])
+                    if digest:
+                        rows = cache.record(digest, name, rows)
+                with span("copy_sheet_values", sheet=name, file=file,
+                          file_bytes=os.path.getsize(path), cached=cached) as trace_args:
+                    trace_args["rows"] = append_rows(rows, dst)
+                    trace_args["cols"] = dst.max_column
+                copied.append((name, file))
+                print(f"{prefix} 复制工作表: {name} ← {file}" + ("（解析缓存）" if cached else ""))
+        finally:
+            if src_wb is not None:
+                src_wb.close()
+    return copied
+
+
+def _copy_parallel(by_file: dict[str, list], to_parse: list[str], workers: int, prefix: str,
+                   cache=None, digests=None) -> list[tuple[str, str]]:
+    """
+    to_parse 中的文件在进程池并行解析，主进程按合并顺序写入；领先写入方最多 workers 个文件。
+    其余（已全部缓存的）文件在轮到时由本进程从缓存复制。
+    """
+    copied = []
+    digests = digests or {}
+    cache_root = cache.root if cache is not None else None
+    pending = iter(to_parse)
+    futures = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=tracer.drain) as pool:
+        def submit_next():
+            path = next(pending, None)
+            if path is not None:
+                futures[path] = pool.submit(read_sheets, path, [name for name, _ in by_file[path]],
+                                            digests.get(path), cache_root)
+
+        for _ in range(workers):
+            submit_next()
+        for path in by_file:
+            if path not in futures:
+                copied += _copy_inline({path: by_file[path]}, prefix, cache, digests)
+                continue
+            sheets, error, events = futures.pop(path).result()
+            submit_next()
+            tracer.merge(events)
+            file = os.path.basename(path)
+            if error is not None:
+                raise SourceUnreadable(path, error)
+            for (name, rows), (_, dst) in zip(sheets, by_file[path]):
+                with span("copy_sheet_values", sheet=name, file=file,
+                          file_bytes=os.path.getsize(path), rows=len(rows)) as trace_args:
+                    for row in rows:
+                        dst.append(row)
+                    trace_args["cols"] = dst.max_column
+                copied.append((name, file))
+                print(f"{prefix} 复制工作表: {name} ← {file}")
+    return copied
+
+
+def read_sheets(path: str, names: list[str], digest: str | None = None,
+                cache_root: str | None = None) -> tuple[list[tuple[str, list[tuple]]] | None, str | None, list]:
+    """
+    子进程：读出这些工作表的值，每个工作表为行元组的列表（比 openpyxl 的单元格对象紧凑得多）。
+    给出 digest 与 cache_root 时同时写入解析缓存。
+    返回 (工作表列表, 打不开时的原因, 本进程的追踪事件)。
+    """
+    sheets, error = None, None
+    cache = sheet_cache.SheetCache(cache_root, CACHE_VERSION) if digest and cache_root else None
+    with span("read_workbook", file=os.path.basename(path), sheets=len(names)):
+        try:
+            src_wb = load_workbook(path, read_only=True, data_only=True)
+        except Exception as e:
+            error = str(e)
+        else:
+            try:
+                sheets = []
+                for name in names:
+                    rows = sheet_values(src_wb[name])
+                    if cache is not None:
+                        rows = cache.record(digest, name, rows)
+                    sheets.append((name, list(rows)))
+            finally:
+                src_wb.close()
+    return sheets, error, tracer.drain()
+
+
+def sheet_values(src):
+    """逐行产出 read_only 工作表的值元组（缓存的就是这些行；改变取法时 PARSER_VERSION 加一）"""
+    # 不信任文件中的 <dimension>：有的导出工具写成 A1 或写小了，read_only 按它截断；按实际单元格读
+    src.reset_dimensions()
+    return src.iter_rows(values_only=True)
+
+
+def append_rows(rows, dst) -> int:
+    """逐行追加；返回行数"""
+    n = 0
+    for row in rows:
+        dst.append(row)
+        n += 1
+    return n
+
+
+# ================================
+# 🔍 一致性自检
+# ================================
+def merge_legacy(dst_wb, paths: list[str]) -> None:
+    """原实现：每个文件整本载入后逐个工作表复制（对照用）"""
+    for path in paths:
+        try:
+            wb = load_workbook(path, data_only=True, read_only=False)
+        except Exception as e:
+            print(f"⚠️ 跳过无法打开的文件: {os.path.basename(path)}，原因：{e}")
+            continue
+        for sheet_name in wb.sheetnames:
+            if sheet_name in dst_wb.sheetnames:
+                del dst_wb[sheet_name]
+            dst = dst_wb.create_sheet(sheet_name)
+            for row in wb[sheet_name].iter_rows(values_only=True):
+                dst.append(list(row))
+        wb.close()
+
+
+def _snapshot(wb) -> list:
+    return [(ws.title, [[(c.value, c.number_format) for c in row] for row in ws.iter_rows()])
+            for ws in wb.worksheets]
+
+
+def _rename_sheets(src: str, dst: str, suffix: str) -> None:
+    """复制 xlsx，工作表名加后缀（只改 workbook.xml）"""
+    with zipfile.ZipFile(src) as zin, zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED) as zout:
+        for item in zin.infolist():
+            data = zin.read(item)
+            if item.filename == "xl/workbook.xml":
+                root = ET.fromstring(data)
+                for sheet in root.iter(f"{_NS_MAIN}sheet"):
+                    sheet.set("name", sheet.get("name") + suffix)
+                data = ET.tostring(root, xml_declaration=True, encoding="UTF-8")
+            zout.writestr(item, data)
+
+
+def _measure(engine: str, base: str, paths: list[str]) -> tuple[float, float, list]:
+    """在独立子进程中运行，峰值 RSS 只算这一种合并（基底载入之后；并行时不含解析子进程）"""
+    from contextlib import redirect_stdout
+    from benchmark import reset_peak_rss, peak_rss_mb
+
+    global MERGE_WORKERS
+    wb = load_workbook(base)
+    reset_peak_rss()
+    before = peak_rss_mb()
+    started = time.perf_counter()
+    if engine != "cached":
+        os.environ["SHEET_CACHE"] = "0"
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        if engine == "legacy":
+            merge_legacy(wb, paths)
+        else:
+            MERGE_WORKERS = 1 if engine == "stream" else MERGE_WORKERS
+            merge_into(wb, paths)
+    seconds = time.perf_counter() - started
+    return seconds, peak_rss_mb() - before, _snapshot(wb)
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    from contextlib import redirect_stdout
+
+    parser = argparse.ArgumentParser(description="021 合并引擎一致性自检")
+    parser.add_argument("paths", nargs="*", help="基底文件 + 待合并文件（按合并顺序）")
+    parser.add_argument("--skus", type=int, default=None, help="另用 bench_generate 生成这么多行的存量查询")
+    parser.add_argument("--days", type=int, default=7, help="生成几天的存量查询导出（同名工作表，后者覆盖前者）")
+    parser.add_argument("--distinct", action="store_true", help="每天的工作表改名为 第一页_dN，全部保留（测并行解析）")
+    args = parser.parse_args()
+
+    paths = list(args.paths)
+    if args.skus:
+        import email
+        import shutil
+        import bench_generate
+        from pipeline import load_stage
+
+        workdir = tempfile.mkdtemp(prefix="sheet_merge_")
+        generated = bench_generate.generate(workdir, args.skus)
+        m020 = load_stage("020 Email download.py")
+        with open(generated["mail"], "rb") as f, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            query = m020.parse_and_save(m020.extract_html_from_msg(email.message_from_bytes(f.read())), workdir)
+        paths = [generated["base"]]
+        for day in range(args.days):
+            paths.append(os.path.join(workdir, f"存量查询_day{day + 1}.xlsx"))
+            if args.distinct:
+                _rename_sheets(query, paths[-1], f"_d{day + 1}")
+            else:
+                shutil.copyfile(query, paths[-1])
+    if len(paths) < 2:
+        parser.error("请给出基底文件和至少一个待合并文件，或 --skus")
+
+    os.environ["SHEET_CACHE_DIR"] = tempfile.mkdtemp(prefix="sheet_cache_")
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        merge_into(load_workbook(paths[0]), paths[1:])  # 预热缓存
+
+    results = {}
+    for engine in ("legacy", "stream", "parallel", "cached"):
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[engine] = pool.submit(_measure, engine, paths[0], paths[1:]).result()
+        seconds, peak, _ = results[engine]
+        print(f"  {engine:<8} {seconds:8.2f}s  合并时峰值内存增加 {peak:8.1f} MB")
+    same = all(results[engine][2] == results["legacy"][2] for engine in results)
+    print("✅ 四种合并结果一致" if same else "❌ 合并结果不一致")
+    sys.exit(0 if same else 1)
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+stage_cache.py
+- 阶段结果缓存：键 = 阶段代码 + 它用到的本地模块代码 + 配置常量 + 上游阶段的键 + 额外输入文件内容 的 SHA-256
+  本地模块：阶段脚本（递归地）import / lazy_import 的、与之同目录的 .py（如 021 → sheet_merge → sheet_cache），
+  再加上运行阶段的 FRAMEWORK_DEPS（pipeline / workbook_session）和阶段自己声明的 CACHE_DEPS（文件名列表）
+- 020 不缓存（要连邮箱），但会返回 fingerprint（选中邮件的 Message-ID + 附件字节摘要），
+  后续阶段的键都从它串联下去：邮件没变 → 键不变 → 直接从缓存恢复输出
+- 输出文件按内容 SHA-256 存为 blob，index.json 记录键 → 文件（相对 data_dir 的路径）；按总大小做 LRU 淘汰
+- 输出文件 = 运行前后 data_dir 顶层有变化的文件 + 阶段写的审计文件（stage_log.audit_paths()，在 data/audit/ 下）；
+  修改阶段的审计文件随会话文件一起记在 cover 阶段下
+- 共用工作簿会话的修改阶段（021~042）中间状态不落盘：
+  会话保存时把文件记在最后一个修改阶段的键下，之前的阶段记为“由它覆盖”（cover）；
+  下次运行时这些阶段先暂缓（deferred），到达 cover 阶段时直接恢复文件，一次都不解析；
+  中途有阶段未命中时，先把暂缓的阶段补算一遍再继续
+- 阶段可声明：CACHEABLE = False（有副作用，如 010/020/051/052）；cache_inputs(context) 返回额外输入文件（如 033 的 list.xlsx）；
+  结果中 "cacheable": False 表示本次结果不写入缓存（结果不完整、不应复用时）
+- 只在串行模式（pipeline.run_pipeline）中使用；--no-cache 关闭
+"""
+import os
+import ast
+import json
+import time
+import shutil
+import hashlib
+
+import stage_log
+from pipeline import load_stage, run_stage, _flush_session_for
+from tracer import span
+
+CACHE_VERSION = "1"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "meidiauto", "stages")
+DEFAULT_MAX_MB = 512
+INDEX_FILENAME = "index.json"
+FRAMEWORK_DEPS = ["pipeline.py", "workbook_session.py"]  # 不被阶段 import，但决定阶段怎么运行
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stage_config(module) -> str:
+    """阶段模块里的大写常量（CONFIG / KEYWORDS / WRITE_MAP 等）序列化为稳定字符串"""
+    items = {}
+    for name, value in vars(module).items():
+        if name.isupper() and isinstance(value, (dict, list, tuple, set, str, int, float, bool)):
+            items[name] = sorted(value, key=repr) if isinstance(value, set) else value
+    return json.dumps(items, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _is_main_block(node) -> bool:
+    return (isinstance(node, ast.If) and isinstance(node.test, ast.Compare)
+            and getattr(node.test.left, "id", None) == "__name__")
+
+
+def _imported_names(path: str) -> set[str]:
+    """文件中 import / from … import / lazy_import("…") 的顶层模块名（含函数内的导入，不含 __main__ 自检块）"""
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), filename=path)
+    tree.body = [node for node in tree.body if not _is_main_block(node)]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+        elif (isinstance(node, ast.Call) and getattr(node.func, "id", None) == "lazy_import"
+              and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+            names.add(node.args[0].value.split(".")[0])
+    return names
+
+
+def local_deps(path: str, extra=()) -> list[str]:
+    """阶段脚本依赖的同目录模块文件（递归），加上 FRAMEWORK_DEPS 与 extra；按文件名排序"""
+    folder = os.path.dirname(os.path.abspath(path))
+    found = {os.path.join(folder, name) for name in (*FRAMEWORK_DEPS, *extra)}
+    todo = [os.path.abspath(path), *found]
+    while todo:
+        current = todo.pop()
+        for name in _imported_names(current):
+            dep = os.path.join(folder, name + ".py")
+            if dep not in found and os.path.isfile(dep):
+                found.add(dep)
+                todo.append(dep)
+    found.discard(os.path.abspath(path))
+    return sorted(found, key=os.path.basename)
+
+
+# ================================
+# 🗄️ 存储
+# ================================
+class StageCache:
+    def __init__(self, root: str | None = None, max_bytes: int | None = None):
+        self.root = root or os.getenv("STAGE_CACHE_DIR") or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(os.getenv("STAGE_CACHE_MAX_MB", str(DEFAULT_MAX_MB))) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(self.root, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.index_path = os.path.join(self.root, INDEX_FILENAME)
+        self.index = self._load_index()
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠️ 缓存索引损坏，已重建: {e}")
+            return {}
+
+    def _save_index(self) -> None:
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.index_path)
+
+    # ---------- 键 ----------
+    def stage_key(self, filename: str, module, upstream: str, extra_inputs=()) -> str:
+        h = hashlib.sha256()
+        h.update(f"v{CACHE_VERSION}\0{filename}\0{upstream}\0".encode("utf-8"))
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+        for dep in local_deps(module.__file__, getattr(module, "CACHE_DEPS", ())):
+            h.update(f"\0{os.path.basename(dep)}\0{file_digest(dep)}".encode("utf-8"))
+        h.update(stage_config(module).encode("utf-8"))
+        for item in extra_inputs:
+            if isinstance(item, str) and os.path.isfile(item):
+                h.update(f"\0{os.path.basename(item)}\0{file_digest(item)}".encode("utf-8"))
+            else:
+                h.update(f"\0{item}".encode("utf-8"))
+        return h.hexdigest()
+
+    # ---------- 读 ----------
+    def get(self, key: str) -> dict | None:
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        cover = entry.get("cover")
+        if cover and cover not in self.index:
+            return None
+        if any(not os.path.exists(self._blob(f["sha256"])) for f in entry.get("files", [])):
+            return None
+        entry["last_used"] = time.time()
+        return entry
+
+    def restore(self, entry: dict, dest_dir: str) -> list[str]:
+        restored = []
+        for f in entry.get("files", []):
+            dest = os.path.join(dest_dir, f["name"])
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(self._blob(f["sha256"]), dest)
+            restored.append(dest)  # copyfile 不保留 mtime：恢复的文件就是“最新”的
+        return restored
+
+    # ---------- 写 ----------
+    def put(self, key: str, stage: str, paths=(), cover: str | None = None, base: str | None = None) -> None:
+        """paths 按相对 base 的路径记录（恢复时还原子目录，如 audit/）；不给 base 时只记文件名"""
+        files = []
+        for path in paths:
+            digest = file_digest(path)
+            blob = self._blob(digest)
+            if not os.path.exists(blob):
+                shutil.copyfile(path, blob)
+            name = os.path.relpath(path, base) if base else os.path.basename(path)
+            files.append({"name": name, "sha256": digest, "size": os.path.getsize(path)})
+        self.index[key] = {"stage": stage, "files": files, "cover": cover, "last_used": time.time()}
+
+    def _blob(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest)
+
+    # ---------- 淘汰 ----------
+    def evict(self) -> None:
+        """按 last_used 从旧到新淘汰，直到 blob 总大小不超过 max_bytes；再清理无引用的 blob。"""
+        def total_size():
+            sizes = {}
+            for entry in self.index.values():
+                for f in entry.get("files", []):
+                    sizes[f["sha256"]] = f["size"]
+            return sum(sizes.values())
+
+        for key in sorted(self.index, key=lambda k: self.index[k].get("last_used", 0)):
+            if total_size() <= self.max_bytes:
+                break
+            del self.index[key]
+
+        # cover 已被淘汰的链式记录也一并删除
+        for key in [k for k, e in self.index.items() if e.get("cover") and e["cover"] not in self.index]:
+            del self.index[key]
+
+        referenced = {f["sha256"] for e in self.index.values() for f in e.get("files", [])}
+        for name in os.listdir(self.blob_dir):
+            if name not in referenced:
+                os.remove(os.path.join(self.blob_dir, name))
+
+    def close(self) -> None:
+        self.evict()
+        self._save_index()
+
+
+# ================================
+# ♻️ 串行运行时的缓存逻辑
+# ================================
+def _snapshot(folder: str) -> dict:
+    try:
+        return {e.path: e.stat().st_mtime_ns for e in os.scandir(folder) if e.is_file()}
+    except FileNotFoundError:
+        return {}
+
+
+class CachedRun:
+    """pipeline.run_pipeline(cache=...) 使用：逐阶段判断命中、恢复或运行并写入缓存。"""
+
+    def __init__(self, cache: StageCache, context: dict):
+        self.cache = cache
+        self.context = context
+        self.session = context.get("workbook_session")
+        self.prev_key = ""     # 串联键；None 表示上游不可缓存，之后都不走缓存
+        self.deferred = []     # 暂缓执行的修改阶段（命中了 cover 链，等待恢复）
+        self.group = []        # 本次实际运行过、尚未随会话保存入缓存的修改阶段 (filename, key)
+        self.group_files = []  # 这些修改阶段在会话文件之外写出的文件（如审计文件），随会话文件一起缓存
+        context.setdefault("produced_files", set())
+
+    # ---------- 键 ----------
+    def _key(self, filename: str, module):
+        if self.prev_key is None:
+            return None
+        extra = []
+        if callable(getattr(module, "cache_inputs", None)):
+            extra = module.cache_inputs(self.context)
+        return self.cache.stage_key(filename, module, self.prev_key, extra)
+
+    # ---------- 运行 ----------
+    def _run(self, filename: str) -> dict:
+        folder = self.context["data_dir"]
+        before = _snapshot(folder)
+        outcome = run_stage(filename, self.context)
+        after = _snapshot(folder)
+        produced = [p for p, m in after.items() if before.get(p) != m and not p.endswith(".tmp")]
+        produced += [p for p in stage_log.audit_paths() if p not in produced]
+        self.context["produced_files"].update(produced)
+        outcome["produced"] = produced
+        return outcome
+
+    def _materialize(self) -> None:
+        """把暂缓的修改阶段补算一遍（之后的阶段需要真实的工作簿状态）"""
+        deferred, self.deferred = self.deferred, []
+        for filename, key in deferred:
+            print(f"♻️ 补算暂缓阶段 {filename} ...")
+            outcome = self._run(filename)
+            if not outcome["ok"]:
+                raise RuntimeError(f"补算 {filename} 失败: {outcome['error']}")
+            self._add_to_group(filename, key, outcome.pop("produced"))
+
+    def _add_to_group(self, filename: str, key: str, produced: list[str]) -> None:
+        self.group.append((filename, key))
+        session_path = os.path.abspath(self.session.path) if self.session.path else None
+        self.group_files += [p for p in produced if os.path.abspath(p) != session_path and p not in self.group_files]
+
+    def store_session(self) -> None:
+        """会话保存后调用：把工作簿文件记在最后一个修改阶段下，前面的阶段指向它"""
+        group, files = self.group, self.group_files
+        self.group, self.group_files = [], []
+        if not group or self.session is None or self.session.path is None:
+            return
+        (last_stage, cover), rest = group[-1], group[:-1]
+        # 会话文件放在第一个：命中时 restored[0] 就是要载入会话的工作簿
+        files = [self.session.path, *(p for p in files if os.path.isfile(p))]
+        self.cache.put(cover, last_stage, files, base=self.context["data_dir"])
+        for filename, key in rest:
+            self.cache.put(key, filename, cover=cover)
+
+    def run(self, filename: str) -> dict:
+        try:
+            module = load_stage(filename)
+        except Exception:
+            self.prev_key = None
+            return run_stage(filename, self.context)  # 由 run_stage 报告导入错误
+        writer = self.session is not None and getattr(module, "WORKBOOK_ACCESS", None) == "write"
+        cacheable = getattr(module, "CACHEABLE", True)
+        try:
+            key = self._key(filename, module) if cacheable else None
+        except Exception as e:
+            print(f"⚠️ {filename} 无法计算缓存键，本次不走缓存: {e}")
+            key = None
+            cacheable = False
+        entry = self.cache.get(key) if key else None
+
+        if entry is not None:
+            outcome = {"stage": filename, "ok": True, "seconds": 0.0, "error": None,
+                       "result": {"cached": True}}
+            if entry.get("cover"):
+                self.deferred.append((filename, key))
+                print(f"♻️ {filename} 命中缓存（等待后续阶段恢复工作簿）")
+            else:
+                with span(filename, cat="stage", cached=True):
+                    restored = self.cache.restore(entry, self.context["data_dir"])
+                self.context["produced_files"].update(restored)
+                if writer:
+                    self.deferred = []
+                    self.group, self.group_files = [], []
+                    self.session.load_from(restored[0])
+                outcome["result"]["files"] = restored
+                print(f"♻️ {filename} 命中缓存，已恢复: {[os.path.basename(p) for p in restored]}")
+            self.prev_key = key
+            return outcome
+
+        # 未命中：补算暂缓的修改阶段；直接读磁盘的阶段还要先把会话落盘
+        self._materialize()
+        if _flush_session_for(filename, self.context):
+            self.store_session()
+        outcome = self._run(filename)
+        result = outcome["result"] if isinstance(outcome["result"], dict) else {}
+
+        if not outcome["ok"]:
+            self.prev_key = None
+            self.group, self.group_files = [], []
+        elif key is None:
+            # 不可缓存的阶段（如 020）用其 fingerprint 作为下游的串联起点
+            fp = result.get("fingerprint")
+            self.prev_key = self.cache.stage_key(filename, module, str(self.prev_key), [fp]) if fp else None
+        else:
+            if writer:
+                self._add_to_group(filename, key, outcome["produced"])
+            elif result.get("cacheable", True):
+                self.cache.put(key, filename, outcome.pop("produced"), base=self.context["data_dir"])
+            self.prev_key = key
+        outcome.pop("produced", None)
+        return outcome
+
+    def finish(self) -> None:
+        self._materialize()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+stage_log.py
+- 各阶段共用的分级日志（标准库 logging）：逐行明细用 log.debug，默认级别 INFO 不输出也不格式化
+    log = get_logger(__file__)
+    log.debug("🔍 行 %s | 缺口: %.1f", row_idx, gap)      # 参数惰性格式化
+- 级别：环境变量 LOG_LEVEL（DEBUG / INFO / WARNING …），main.py --log-level 会写入该变量（子进程继承）
+- 阶段计数器：stats = counters(); stats["matched_4"] += 1
+  pipeline.run_stage 把当前阶段的计数器放进结果（outcome["counters"]），print_summary 一并打印
+- 逐行审计写成机器可读的 JSON Lines 文件（data/audit/<名称>.jsonl），代替刷屏的 print：
+    with audit_file(folder, "030_backfill") as audit:
+        audit.write({"source_row": 2, "match": "5", ...})
+  本阶段写过的审计文件由 audit_paths() 给出，stage_cache 把它们与阶段输出一起缓存、命中时一起恢复
+"""
+import os
+import sys
+import json
+import logging
+from collections import Counter
+from contextlib import contextmanager
+
+ENV_VAR = "LOG_LEVEL"
+DEFAULT_LEVEL = "INFO"
+AUDIT_DIRNAME = "audit"
+ROOT_LOGGER = "meidi"
+
+_configured = False
+_current = Counter()
+_audit_paths: list[str] = []
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """每次输出时取当前的 sys.stdout（与 print 一致，也能被 redirect_stdout 捕获）"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def _configure() -> None:
+    global _configured
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(os.getenv(ENV_VAR, DEFAULT_LEVEL).upper())
+    if not _configured:
+        handler = _StdoutHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        root.addHandler(handler)
+        root.propagate = False
+        _configured = True
+
+
+def set_level(level: str) -> None:
+    """设置日志级别（写入环境变量，进程池子进程也会继承）"""
+    os.environ[ENV_VAR] = level.upper()
+    _configure()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """按脚本名取 logger，如 get_logger(__file__) -> meidi.030 Warehousing at home"""
+    _configure()
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return logging.getLogger(f"{ROOT_LOGGER}.{stem}")
+
+
+# ================================
+# 🔢 阶段计数器
+# ================================
+def counters() -> Counter:
+    """当前阶段的计数器"""
+    return _current
+
+
+def begin_stage() -> None:
+    global _current
+    _current = Counter()
+    _audit_paths.clear()
+
+
+def end_stage() -> dict:
+    return dict(_current)
+
+
+# ================================
+# 🧾 审计文件（JSON Lines）
+# ================================
+class _AuditWriter:
+    def __init__(self, f):
+        self._f = f
+        self.rows = 0
+
+    def write(self, record: dict) -> None:
+        self._f.write(json.dumps(record, ensure_ascii=False, default=str))
+        self._f.write("\n")
+        self.rows += 1
+
+
+@contextmanager
+def audit_file(folder: str, name: str):
+    """写 <folder>/audit/<name>.jsonl（每次运行覆盖）"""
+    audit_dir = os.path.join(folder, AUDIT_DIRNAME)
+    os.makedirs(audit_dir, exist_ok=True)
+    path = os.path.join(audit_dir, f"{name}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        writer = _AuditWriter(f)
+        yield writer
+    _audit_paths.append(path)
+    get_logger(ROOT_LOGGER).info("🧾 审计明细已写入: %s（%d 行）", path, writer.rows)
+
+
+def audit_paths() -> list[str]:
+    """当前阶段写过的审计文件"""
+    return list(_audit_paths)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+tenants.py
+- 多租户（多仓库 / 多客户）运行：一个配置文件列出各租户，每个租户有自己的关键词、需求表、着色规则和收件人
+- 主进程只登录一次邮箱，抓取最近的邮件（原始字节）后共享给所有租户（UID 同步状态在 data 根目录）；
+  各租户在进程池中并发运行整条流水线，按自己的 KEYWORDS 选取邮件
+- 隔离：每个租户一个工作目录 data/tenants/<name>/（输出日志在其中的 run.log）、独立的阶段缓存目录；
+  每个租户在全新的子进程中运行（max_tasks_per_child=1），阶段模块的常量覆盖互不影响
+- 配置文件（JSON，示例见 tenants.example.json）：
+    {"tenants": [{
+        "name": "hefei_heyuda",
+        "keywords": {"waiting": "等待您查看", "heyu_da": "合肥市和裕达"},   → 020 KEYWORDS
+        "keyword_base": "合肥市",                                        → 021 KEYWORD_BASE
+        "demand_file": "script/data/list.xlsx",                         → 033 DATA_DIR / DEMAND_XLSX（相对配置文件）
+        "demand_sheet": "2503",                                         → 033 DEMAND_SHEET
+        "skip_codes": ["00514", "04928"],                               → 042 SKIP_CODES
+        "colors": {"deep_red": "FF0000"},                               → 042 COLOR_DEEP_RED …
+        "recipients": ["a@example.com"],                                → 051/052 TO_EMAIL_LIST
+        "overrides": {"030 Warehousing at home.py": {"CONFIG": {"warehouse_keep_value": "成品库"}}}
+    }]}
+  overrides 可覆盖任意阶段的大写常量；字典常量按键合并，其余整体替换
+- 用法：python main.py --tenants tenants.json [--tenant-workers N] [--no-cache] [--replay YYYY-MM-DD]
+"""
+import os
+import sys
+import json
+import time
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import tracer
+from pipeline import load_stage, run_pipeline, print_summary
+
+MAIL_STAGE = "020 Email download.py"
+TENANTS_DIRNAME = "tenants"
+LOG_FILENAME = "run.log"
+
+# 租户配置字段 → (阶段脚本, 常量名)
+FIELD_MAP = {
+    "keywords": [(MAIL_STAGE, "KEYWORDS")],
+    "keyword_base": [("021 Merge excel.py", "KEYWORD_BASE")],
+    "demand_sheet": [("033 list insertion.py", "DEMAND_SHEET")],
+    "skip_codes": [("042 Color display.py", "SKIP_CODES")],
+    "recipients": [("051 Send an email.py", "TO_EMAIL_LIST"), ("052 send email.py", "TO_EMAIL_LIST")],
+}
+COLOR_STAGE = "042 Color display.py"  # colors 的键 deep_red → COLOR_DEEP_RED
+DEMAND_STAGE = "033 list insertion.py"
+
+
+# ================================
+# 📋 配置
+# ================================
+def load_profiles(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        profiles = json.load(f)["tenants"]
+    base_dir = os.path.dirname(os.path.abspath(path))
+    names = set()
+    for profile in profiles:
+        name = profile.get("name")
+        # 名称直接作为 data/tenants/<名称>/ 目录名：不能是 . / ..，不能含任何平台的路径分隔符
+        if (not isinstance(name, str) or not name or name in names or name in (".", "..")
+                or "/" in name or "\\" in name or os.path.basename(name) != name):
+            raise ValueError(f"❌ 租户名称缺失、重复或不是合法的目录名: {name!r}")
+        names.add(name)
+        if profile.get("demand_file"):
+            profile["demand_file"] = os.path.join(base_dir, profile["demand_file"])
+    return profiles
+
+
+def profile_overrides(profile: dict) -> dict[str, dict]:
+    """把租户配置展开为 {阶段脚本: {常量名: 值}}"""
+    overrides: dict[str, dict] = {}
+    for field, targets in FIELD_MAP.items():
+        if field in profile:
+            for stage, const in targets:
+                overrides.setdefault(stage, {})[const] = profile[field]
+    for color, value in profile.get("colors", {}).items():
+        overrides.setdefault(COLOR_STAGE, {})[f"COLOR_{color.upper()}"] = value
+    if profile.get("demand_file"):
+        overrides.setdefault(DEMAND_STAGE, {}).update(
+            DATA_DIR=os.path.dirname(profile["demand_file"]), DEMAND_XLSX=os.path.basename(profile["demand_file"]))
+    for stage, consts in profile.get("overrides", {}).items():
+        overrides.setdefault(stage, {}).update(consts)
+    return overrides
+
+
+def apply_profile(profile: dict) -> None:
+    """覆盖阶段模块的常量（只在租户子进程中调用）"""
+    for stage, consts in profile_overrides(profile).items():
+        module = load_stage(stage)
+        for name, value in consts.items():
+            if not hasattr(module, name):
+                raise AttributeError(f"❌ {stage} 没有常量 {name}")
+            current = getattr(module, name)
+            if isinstance(current, dict) and isinstance(value, dict):
+                value = {**current, **value}
+            elif isinstance(current, (set, tuple)):
+                value = type(current)(value)
+            setattr(module, name, value)
+
+
+# ================================
+# 👷 租户子进程
+# ================================
+def _run_tenant(profile: dict, data_root: str, stages: list[str], mail_messages, use_cache: bool) -> dict:
+    from workbook_session import WorkbookSession
+    from stage_cache import StageCache, DEFAULT_CACHE_DIR
+
+    name = profile["name"]
+    tenant_dir = os.path.join(data_root, TENANTS_DIRNAME, name)
+    os.makedirs(tenant_dir, exist_ok=True)
+    log_path = os.path.join(tenant_dir, LOG_FILENAME)
+    started = time.perf_counter()
+
+    with open(log_path, "w", encoding="utf-8") as log, redirect_stdout(log), \
+            tracer.span(f"tenant {name}", cat="tenant"):
+        apply_profile(profile)
+        context = {"data_dir": tenant_dir, "workbook_session": WorkbookSession(tenant_dir), "tenant": name}
+        if mail_messages is not None:
+            context["mail_messages"] = mail_messages
+        cache = None
+        if use_cache:
+            cache_root = os.getenv("STAGE_CACHE_DIR") or DEFAULT_CACHE_DIR
+            cache = StageCache(os.path.join(cache_root, TENANTS_DIRNAME, name))  # 各租户独立索引，避免并发写
+        results = run_pipeline(stages, context, cache=cache)
+        print_summary(results)
+
+    return {"tenant": name, "results": results, "log": log_path,
+            "seconds": time.perf_counter() - started, "trace": tracer.drain()}
+
+
+# ================================
+# 🚀 主进程
+# ================================
+def fetch_shared_messages(profiles: list[dict], state_dir: str, replay_date: str | None = None):
+    """用一个 IMAP 会话为所有租户抓取邮件；失败时返回空列表（各租户按“没有邮件”处理）"""
+    m020 = load_stage(MAIL_STAGE)
+    keyword_sets = [{**m020.KEYWORDS, **p.get("keywords", {})} for p in profiles]
+    store = m020.open_store()
+    try:
+        if replay_date:
+            return m020.replay_messages(store, replay_date, keyword_sets)
+        if os.getenv("MAIL_SOURCES"):
+            import mail_sources
+            return mail_sources.ingest(mail_sources.load_sources(), keyword_sets, state_dir=state_dir,
+                                       limit=m020.RECENT_LIMIT * len(profiles))
+        user, password, server = m020.load_credentials()
+        if m020.FAST_SELECT:
+            # 服务器端按所有租户的关键词检索，每个关键词只下载最新一封（本地邮件库已有的不再下载）
+            messages = m020.fetch_latest_messages(server, user, password, keyword_sets,
+                                                  state_dir=state_dir, store=store)
+        else:
+            messages = m020.fetch_recent_messages(server, user, password, limit=m020.RECENT_LIMIT * len(profiles))
+        return messages or []
+    finally:
+        m020._close_store(store)
+
+
+def run_tenants(profiles: list[dict], stages: list[str], data_root: str,
+                workers: int | None = None, use_cache: bool = True,
+                replay_date: str | None = None) -> dict[str, list[dict]]:
+    """各租户并发运行整条流水线，返回 {租户: 阶段结果列表}；replay_date 给出时从本地邮件库补跑该日"""
+    workers = max(1, min(workers or os.cpu_count() or 1, len(profiles)))
+    mail_messages = None
+    if MAIL_STAGE in stages:
+        with tracer.span("shared_imap_fetch", tenants=len(profiles)):
+            mail_messages = fetch_shared_messages(profiles, data_root, replay_date)
+        print(f"📨 共享抓取 {len(mail_messages)} 封邮件，分发给 {len(profiles)} 个租户\n")
+
+    print(f"🏢 {len(profiles)} 个租户，{workers} 个进程并发运行 ...")
+    all_results = {}
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        futures = {pool.submit(_run_tenant, p, data_root, stages, mail_messages, use_cache): p["name"]
+                   for p in profiles}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                print(f"❌ 租户 {name} 运行失败: {type(e).__name__}: {e}")
+                all_results[name] = [{"stage": "(tenant)", "ok": False, "seconds": 0.0,
+                                      "result": None, "error": f"{type(e).__name__}: {e}"}]
+                continue
+            tracer.merge(report["trace"])
+            all_results[name] = report["results"]
+            ok = all(item["ok"] for item in report["results"])
+            print(f"{'✅' if ok else '⚠️'} 租户 {name} 完成，用时 {report['seconds']:.1f}s（日志: {report['log']}）")
+    return all_results
+
+
+def print_tenant_summary(all_results: dict[str, list[dict]]) -> None:
+    for name, results in all_results.items():
+        print(f"\n🏢 租户 {name}")
+        print_summary(results, show_imports=False)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python tenants.py <tenants.json>   # 只校验配置并打印各租户的常量覆盖")
+        sys.exit(1)
+    for p in load_profiles(sys.argv[1]):
+        print(f"🏢 {p['name']}")
+        for stage, consts in profile_overrides(p).items():
+            print(f"  {stage}: {json.dumps(consts, ensure_ascii=False)}")
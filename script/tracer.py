@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+tracer.py
+- 可选的耗时追踪：输出 Chrome trace-event 格式的 trace.json（chrome://tracing 或 Perfetto 打开）
+- 开启方式：main.py --trace [路径]，或环境变量 PIPELINE_TRACE=路径（写 1 表示 data 目录下的 trace.json）
+- 未开启时 span() 几乎没有开销
+- 用法：
+    with span("parse_html_table", html_bytes=len(html)) as args:
+        ...
+        args["rows"] = len(rows)      # 结束前补充参数（行数、字节数等）
+- 时间戳用墙钟微秒，进程池子进程的事件随阶段结果带回主进程合并（见 scheduler.py）
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+ENV_VAR = "PIPELINE_TRACE"
+DEFAULT_FILENAME = "trace.json"
+
+# perf_counter 精度高但各进程起点不同；换算到墙钟，保证多进程事件在同一时间轴上
+_CLOCK_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+_events = []
+_lock = threading.Lock()
+
+
+def _now_us() -> float:
+    return (time.perf_counter_ns() + _CLOCK_OFFSET_NS) / 1000
+
+
+def enabled() -> bool:
+    return bool(os.getenv(ENV_VAR))
+
+
+def enable(path: str) -> None:
+    """写入环境变量，进程池子进程也会继承"""
+    os.environ[ENV_VAR] = path
+
+
+def trace_path(data_dir: str) -> str | None:
+    value = os.getenv(ENV_VAR)
+    if not value:
+        return None
+    if value == "1":
+        return os.path.join(data_dir, DEFAULT_FILENAME)
+    return value
+
+
+class _NullArgs(dict):
+    """未开启追踪时给调用方的参数字典，写入即丢弃"""
+
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+@contextmanager
+def span(name: str, cat: str = "section", **args):
+    if not enabled():
+        yield _NullArgs()
+        return
+    start = _now_us()
+    try:
+        yield args
+    finally:
+        event = {
+            "name": name, "cat": cat, "ph": "X",
+            "ts": start, "dur": _now_us() - start,
+            "pid": os.getpid(), "tid": threading.get_ident(),
+            "args": args,
+        }
+        with _lock:
+            _events.append(event)
+
+
+def drain() -> list[dict]:
+    """取出并清空本进程记录的事件"""
+    global _events
+    with _lock:
+        events, _events = _events, []
+    return events
+
+
+def merge(events: list[dict]) -> None:
+    """合并其它进程带回来的事件"""
+    with _lock:
+        _events.extend(events)
+
+
+def save(path: str) -> str:
+    events = drain()
+    names = {}
+    for e in events:
+        names.setdefault(e["pid"], "main" if e["pid"] == os.getpid() else f"worker-{e['pid']}")
+    meta = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": label}}
+            for pid, label in names.items()]
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+    print(f"🧭 追踪文件已写入: {path}（{len(events)} 个事件，可在 chrome://tracing 打开）")
+    return path
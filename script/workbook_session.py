@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+workbook_session.py
+- 整次运行共用一个“总库存”工作簿：只 load 一次、只 save 一次
+- 修改类阶段（021/030/032/033/041/042）通过 session.workbook() 拿到同一个内存中的 Workbook
+- 只读阶段（050 mailtxt / 企业消息整理 / 050 image）通过 session.view() 读取内存中的最新状态
+- 需要从磁盘读取文件的阶段（051/052 发邮件）运行前，由 pipeline 调用 session.save() 落盘
+
+阶段脚本通过模块级常量 WORKBOOK_ACCESS = "write" / "read" 声明自己对会话的使用方式；
+未声明的阶段视为直接读磁盘文件。
+"""
+import os
+import glob
+
+from openpyxl import load_workbook
+
+from tracer import span
+
+INVENTORY_PATTERN = "总库存*.xlsx"
+
+
+class WorkbookSession:
+    def __init__(self, folder: str, pattern: str = INVENTORY_PATTERN):
+        self.folder = folder
+        self.pattern = pattern
+        self.path = None
+        self.wb = None
+        self.dirty = False
+        self.loads = 0
+        self.saves = 0
+
+    # ---------- 打开 ----------
+    def find_file(self) -> str:
+        """取目录下最新修改的 总库存*.xlsx（排除 ~$ 临时文件）"""
+        files = glob.glob(os.path.join(self.folder, self.pattern))
+        valid = [f for f in files if not os.path.basename(f).startswith("~$")]
+        if not valid:
+            raise FileNotFoundError(f"没有找到符合条件的文件：{os.path.join(self.folder, self.pattern)}")
+        return max(valid, key=os.path.getmtime)
+
+    def open(self):
+        if self.wb is None:
+            self.path = self.path or self.find_file()
+            with span("workbook_load", file_bytes=os.path.getsize(self.path)):
+                self.wb = load_workbook(self.path)
+            self.loads += 1
+            print(f"📖 会话已加载工作簿：{self.path}")
+        return self.wb
+
+    def adopt(self, wb, path: str) -> None:
+        """接管一个已在内存中的工作簿（021 合并结果），之后由会话负责保存。"""
+        self.wb = wb
+        self.path = path
+        self.dirty = True
+
+    def load_from(self, path: str) -> None:
+        """改用磁盘上的另一份文件（阶段缓存恢复的工作簿），丢弃内存中的状态，用到时再加载。"""
+        if self.wb is not None:
+            self.wb.close()
+        self.wb = None
+        self.path = path
+        self.dirty = False
+
+    # ---------- 访问 ----------
+    def workbook(self):
+        """修改类阶段使用：返回内存中的 Workbook，并标记需要保存。"""
+        wb = self.open()
+        self.dirty = True
+        return wb
+
+    def view(self):
+        """只读阶段使用：返回内存中的 Workbook，不标记修改。
+        注意：公式单元格给出的是公式文本而不是 Excel 缓存值。"""
+        return self.open()
+
+    # ---------- 保存 ----------
+    def save(self) -> bool:
+        """有未保存修改时写盘；返回是否真的写了文件。"""
+        if self.wb is None or not self.dirty:
+            return False
+        # 先写临时文件再替换：并行阶段可能正在读取上一次保存的文件
+        tmp_path = self.path + ".tmp"
+        with span("workbook_save") as trace_args:
+            self.wb.save(tmp_path)
+            os.replace(tmp_path, self.path)
+            trace_args["file_bytes"] = os.path.getsize(self.path)
+        self.saves += 1
+        self.dirty = False
+        print(f"💾 会话已保存工作簿：{self.path}")
+        return True
+
+    def close(self) -> None:
+        self.save()
+        if self.wb is not None:
+            self.wb.close()
+        self.wb = None
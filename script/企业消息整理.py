@@ -10,13 +10,21 @@ import re
 # ================================
 MAX_LIST = 20  # 明细最多展示条数（可按需调整）
 
+# 只读取 pipeline 工作簿会话中的“总库存”（独立运行时自行读文件）
+WORKBOOK_ACCESS = "read"
+
+# 阶段依赖声明（见 scheduler.py）
+INPUTS = ["sheet:库存表"]
+OUTPUTS = ["file:wechat_msg.txt"]
+
 # ================================
 # 📂 路径
 # ================================
-def get_inventory_folder():
-    default_inventory_folder = os.path.abspath(os.path.join(os.getcwd(), "data"))
-    inventory_folder = sys.argv[1] if len(sys.argv) >= 2 else default_inventory_folder
-    print(f"✅ 使用传入路径: {inventory_folder}" if len(sys.argv) >= 2 else f"⚠️ 未传入路径，使用默认路径: {inventory_folder}")
+def get_inventory_folder(inventory_folder=None):
+    if inventory_folder is None:
+        default_inventory_folder = os.path.abspath(os.path.join(os.getcwd(), "data"))
+        inventory_folder = sys.argv[1] if len(sys.argv) >= 2 else default_inventory_folder
+        print(f"✅ 使用传入路径: {inventory_folder}" if len(sys.argv) >= 2 else f"⚠️ 未传入路径，使用默认路径: {inventory_folder}")
 
     if not os.path.exists(inventory_folder):
         print(f"❌ 文件夹路径不存在: {inventory_folder}")
@@ -53,6 +61,16 @@ def load_worksheet(inventory_file, sheet_name="库存表"):
 
     return wb[sheet_name]
 
+def session_worksheet(session, sheet_name="库存表"):
+    """从 pipeline 工作簿会话读取内存中的工作表（不重新解析文件）"""
+    wb = session.view()
+    print(f"✅ 找到文件：{session.path}")
+    if sheet_name not in wb.sheetnames:
+        print(f"❌ 工作表“{sheet_name}”不存在！")
+        sys.exit(1)
+    return wb[sheet_name]
+
+
 # ================================
 # 🎨 颜色判断（仅识别填充色）
 # ================================
@@ -266,10 +284,13 @@ def save_wechat_message_to_file(message, output_dir):
 # ================================
 # 主程序
 # ================================
-def main():
-    inventory_folder = get_inventory_folder()
-    inventory_file = find_excel_file(inventory_folder)
-    sheet = load_worksheet(inventory_file)
+def main(inventory_folder=None, session=None):
+    inventory_folder = get_inventory_folder(inventory_folder)
+    if session is not None:
+        sheet = session_worksheet(session)
+    else:
+        inventory_file = find_excel_file(inventory_folder)
+        sheet = load_worksheet(inventory_file)
 
     colored_rows = find_colored_rows(sheet)
     date, date2 = get_dates(sheet)
@@ -290,6 +311,10 @@ def main():
 
     print("✅ 红色或紫色单元格数量：", len(colored_rows))
     print("📌 行号列表：", colored_rows)
+    return {"message_path": os.path.join(inventory_folder, "wechat_msg.txt"), "colored_rows": len(colored_rows)}
+
+def run(context: dict) -> dict:
+    return main(context["data_dir"], context.get("workbook_session"))
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,12 @@
 import os
 import re
-import pandas as pd
 from openpyxl import load_workbook
-from openpyxl.chart import LineChart, Reference, Series
+
+from lazy_import import lazy_import
+
+# 汇总/画图时才导入
+pd = lazy_import("pandas")
+xl_chart = lazy_import("openpyxl.chart")
 
 # ======================== 配置区域 ========================
 folder_path = r'C:\Users\ishel\Desktop\坚果备份\A四川和裕达新材料有限公司\32重庆-美的\美的发货\月度汇总'
@@ -76,7 +80,7 @@ def create_excel_chart(excel_path, sheet_name, title):
     ws = wb[sheet_name]
     max_col, max_row = ws.max_column, ws.max_row
 
-    chart = LineChart()
+    chart = xl_chart.LineChart()
     chart.title = title
     chart.style = 13
     chart.y_axis.title = '数量'
@@ -85,12 +89,12 @@ def create_excel_chart(excel_path, sheet_name, title):
     chart.x_axis.majorTickMark = "out"
 
     # 去掉“合计”列，不然图表重复统计
-    cats = Reference(ws, min_col=2, max_col=max_col-1, min_row=1)
+    cats = xl_chart.Reference(ws, min_col=2, max_col=max_col-1, min_row=1)
     chart.set_categories(cats)
 
     for r in range(2, max_row + 1):
-        series = Series(
-            Reference(ws, min_col=2, max_col=max_col-1, min_row=r, max_row=r),
+        series = xl_chart.Series(
+            xl_chart.Reference(ws, min_col=2, max_col=max_col-1, min_row=r, max_row=r),
             title=str(ws.cell(row=r, column=1).value)
         )
         chart.series.append(series)